@@ -0,0 +1,286 @@
+"""Benchmarks for command building and service launch overhead.
+
+No real podman is needed, a fake podman stub script is used instead, so the numbers
+only reflect the overhead of this library (and process spawning).
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --compare baseline.json
+"""
+import argparse
+import asyncio
+import copy
+import dataclasses
+import json
+import pathlib
+import sys
+import tempfile
+import time
+import typing
+
+from .fake_podman import make_fake_podman
+from .runner import BenchmarkResult
+from .runner import compare_reports
+from .runner import load_report
+from .runner import make_report
+from .runner import measure
+from .runner import measure_async
+from containers import BindMount
+from containers import Container
+from containers import ContainersService
+from containers import ImageCache
+from containers import Podman
+from containers import serialization
+from containers.providers.helpers import make_env_args
+
+
+def make_container(size: int) -> Container:
+    return Container(
+        image="alpine",
+        command=("echo", "hello"),
+        remove=True,
+        environ={f"ENV_VAR{i}": f"VAL{i}" for i in range(size)},
+        mounts=[
+            BindMount(
+                source=f"/var/tmp/source{i}",
+                target=f"/data/target{i}",
+                readonly=bool(i % 2),
+            )
+            for i in range(size)
+        ],
+    )
+
+
+def bench_command_building(
+    sizes: typing.Sequence[int], rounds: int
+) -> typing.List[BenchmarkResult]:
+    podman = Podman()
+    results = []
+    for size in sizes:
+        container = make_container(size)
+        environ = container.environ
+        mounts = container.mounts
+        results.append(
+            BenchmarkResult(
+                name="build_command",
+                params=dict(size=size),
+                samples=measure(lambda: podman.build_command(container), rounds=rounds),
+            )
+        )
+        compiled = podman.compile(container)
+        results.append(
+            BenchmarkResult(
+                name="compiled_build_command",
+                params=dict(size=size),
+                samples=measure(
+                    lambda: compiled.build_command(
+                        command=("echo", "world"), environ=dict(EXTRA="1")
+                    ),
+                    rounds=rounds,
+                ),
+            )
+        )
+        results.append(
+            BenchmarkResult(
+                name="make_env_args",
+                params=dict(size=size),
+                samples=measure(lambda: make_env_args(environ), rounds=rounds),
+            )
+        )
+        results.append(
+            BenchmarkResult(
+                name="make_mounts",
+                params=dict(size=size),
+                samples=measure(
+                    lambda: [
+                        podman.make_mount(mount, name=f"mount-{i}")
+                        for i, mount in enumerate(mounts)
+                    ],
+                    rounds=rounds,
+                ),
+            )
+        )
+    return results
+
+
+def bench_copying(
+    sizes: typing.Sequence[int], rounds: int
+) -> typing.List[BenchmarkResult]:
+    results = []
+    for size in sizes:
+        container = make_container(size)
+        results.append(
+            BenchmarkResult(
+                name="deepcopy_container",
+                params=dict(size=size),
+                samples=measure(lambda: copy.deepcopy(container), rounds=rounds),
+            )
+        )
+        results.append(
+            BenchmarkResult(
+                name="replace_container",
+                params=dict(size=size),
+                samples=measure(
+                    lambda: dataclasses.replace(container, command=("echo", "world")),
+                    rounds=rounds,
+                ),
+            )
+        )
+    return results
+
+
+def bench_serialization(rounds: int) -> typing.List[BenchmarkResult]:
+    results = []
+    containers = [make_container(10) for _ in range(100)]
+    for name, dumps, loads in (
+        ("json", serialization.dumps_json_many, serialization.loads_json_many),
+        ("binary", serialization.dumps_binary_many, serialization.loads_binary_many),
+    ):
+        data = dumps(containers)
+        results.append(
+            BenchmarkResult(
+                name="encode_containers",
+                params=dict(format=name, count=len(containers)),
+                samples=measure(lambda: dumps(containers), rounds=rounds),
+            )
+        )
+        results.append(
+            BenchmarkResult(
+                name="decode_containers",
+                params=dict(format=name, count=len(containers)),
+                samples=measure(lambda: loads(data), rounds=rounds),
+            )
+        )
+    return results
+
+
+async def bench_load_image(
+    executable: pathlib.Path, rounds: int, number: int
+) -> typing.List[BenchmarkResult]:
+    results = []
+    for cached in (False, True):
+        # A zero TTL cache expires everything right away
+        service = ContainersService(
+            Podman(executable=executable),
+            image_cache=ImageCache() if cached else ImageCache(ttl=0),
+        )
+        # Warm up so that the cached one measures cache hits only
+        await service.load_image("alpine")
+        results.append(
+            BenchmarkResult(
+                name="load_image",
+                params=dict(cached=cached),
+                samples=await measure_async(
+                    lambda: service.load_image("alpine"),
+                    rounds=rounds,
+                    number=number,
+                ),
+            )
+        )
+    return results
+
+
+async def bench_run(
+    executable: pathlib.Path,
+    concurrencies: typing.Sequence[int],
+    rounds: int,
+    number: int,
+) -> typing.List[BenchmarkResult]:
+    service = ContainersService(Podman(executable=executable))
+    container = make_container(10)
+
+    async def run_once():
+        async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+            await proc.stdout.read()
+            await proc.wait()
+
+    results = [
+        BenchmarkResult(
+            name="run_latency",
+            params=dict(),
+            samples=await measure_async(run_once, rounds=rounds, number=number),
+        )
+    ]
+    for concurrency in concurrencies:
+        samples = []
+        for _ in range(rounds):
+            begin = time.perf_counter()
+            for _ in range(number):
+                await asyncio.gather(*(run_once() for _ in range(concurrency)))
+            samples.append((time.perf_counter() - begin) / (number * concurrency))
+        results.append(
+            BenchmarkResult(
+                name="run_throughput",
+                params=dict(concurrency=concurrency),
+                samples=samples,
+            )
+        )
+    return results
+
+
+def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--output", type=pathlib.Path, help="write the JSON results to this file"
+    )
+    parser.add_argument(
+        "--compare",
+        type=pathlib.Path,
+        help="compare the results with a JSON results file of a previous run",
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--quick", action="store_true", help="run fewer and smaller benchmarks"
+    )
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        sizes = (0, 10, 100)
+        concurrencies = (1, 8)
+        number = 2
+    else:
+        sizes = (0, 10, 100, 1000)
+        concurrencies = (1, 8, 32)
+        number = 10
+
+    results = bench_command_building(sizes, rounds=args.rounds)
+    results.extend(bench_copying(sizes, rounds=args.rounds))
+    results.extend(bench_serialization(rounds=args.rounds))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        executable = make_fake_podman(pathlib.Path(temp_dir))
+        results.extend(
+            asyncio.run(bench_load_image(executable, rounds=args.rounds, number=number))
+        )
+        results.extend(
+            asyncio.run(
+                bench_run(
+                    executable,
+                    concurrencies=concurrencies,
+                    rounds=args.rounds,
+                    number=number,
+                )
+            )
+        )
+
+    report = make_report(results)
+    for result in report["results"]:
+        print(
+            f"{result['key']:<50} median={result['median'] * 1e6:12.2f}us "
+            f"ops/s={result['ops_per_sec'] or 0:12.1f}"
+        )
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.compare is not None:
+        print()
+        print(f"Compared with {args.compare}:")
+        for key, base, current, ratio in compare_reports(
+            load_report(args.compare), report
+        ):
+            print(
+                f"{key:<50} {base * 1e6:12.2f}us -> {current * 1e6:12.2f}us "
+                f"({ratio:.2f}x)"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
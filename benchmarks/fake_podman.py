@@ -0,0 +1,31 @@
+import os
+import pathlib
+
+# A shell script is used instead of a Python one so that we measure the overhead
+# of our own code instead of the interpreter startup time of the stub
+FAKE_PODMAN_SCRIPT = """#!/bin/sh
+while [ "${1#--}" != "$1" ]; do
+    shift 2
+done
+case "$1" in
+    image)
+        echo "sha256:0000000000000000000000000000000000000000000000000000000000000000"
+        ;;
+    pull)
+        ;;
+    run)
+        echo "ok"
+        ;;
+    *)
+        echo "unknown command $1" >&2
+        exit 125
+        ;;
+esac
+"""
+
+
+def make_fake_podman(directory: pathlib.Path) -> pathlib.Path:
+    executable = directory / "podman"
+    executable.write_text(FAKE_PODMAN_SCRIPT)
+    os.chmod(executable, 0o755)
+    return executable
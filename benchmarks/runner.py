@@ -0,0 +1,121 @@
+import dataclasses
+import json
+import pathlib
+import platform
+import statistics
+import time
+import typing
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    name: str
+    params: typing.Dict[str, typing.Any]
+    # Seconds per operation of each sample
+    samples: typing.List[float]
+
+    @property
+    def key(self) -> str:
+        params = ",".join(f"{key}={value}" for key, value in self.params.items())
+        return f"{self.name}[{params}]" if params else self.name
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        median = statistics.median(self.samples)
+        return dict(
+            name=self.name,
+            params=self.params,
+            key=self.key,
+            rounds=len(self.samples),
+            min=min(self.samples),
+            max=max(self.samples),
+            mean=statistics.fmean(self.samples),
+            median=median,
+            stdev=statistics.stdev(self.samples) if len(self.samples) > 1 else 0.0,
+            ops_per_sec=(1 / median) if median else None,
+        )
+
+
+def measure(
+    func: typing.Callable[[], typing.Any],
+    rounds: int = 5,
+    min_time: float = 0.05,
+) -> typing.List[float]:
+    """Measure seconds per call of func, calls are batched in each round until it
+    takes at least min_time so that the timer resolution doesn't matter
+    """
+    number = 1
+    while True:
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - begin
+        if elapsed >= min_time:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(rounds - 1):
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - begin) / number)
+    return samples
+
+
+async def measure_async(
+    func: typing.Callable[[], typing.Awaitable[typing.Any]],
+    rounds: int = 5,
+    number: int = 10,
+) -> typing.List[float]:
+    samples = []
+    for _ in range(rounds):
+        begin = time.perf_counter()
+        for _ in range(number):
+            await func()
+        samples.append((time.perf_counter() - begin) / number)
+    return samples
+
+
+def get_package_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("container-helpers")
+    except Exception:
+        return "unknown"
+
+
+def make_report(results: typing.List[BenchmarkResult]) -> typing.Dict[str, typing.Any]:
+    return dict(
+        version=get_package_version(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        created_at=time.time(),
+        results=[result.to_dict() for result in results],
+    )
+
+
+def compare_reports(
+    baseline: typing.Dict[str, typing.Any], current: typing.Dict[str, typing.Any]
+) -> typing.List[typing.Tuple[str, float, float, float]]:
+    """Returns (key, baseline median, current median, ratio) of the benchmarks
+    appear in both reports, ratio above 1 means the current one is slower
+    """
+    baseline_results = {result["key"]: result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        base = baseline_results.get(result["key"])
+        if base is None or not base["median"]:
+            continue
+        rows.append(
+            (
+                result["key"],
+                base["median"],
+                result["median"],
+                result["median"] / base["median"],
+            )
+        )
+    return rows
+
+
+def load_report(path: pathlib.Path) -> typing.Dict[str, typing.Any]:
+    return json.loads(path.read_text())
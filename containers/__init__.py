@@ -1,12 +1,61 @@
+from .data_types import ArchiveImageMount
 from .data_types import BindMount
 from .data_types import Container
 from .data_types import ImageMount
 from .data_types import Mount
+from .data_types import ResourceLimits
 from .data_types import SecurityOptions
 from .data_types import VolumeMount
+from .errors import ContainerRunError
 from .errors import LoadImageError
+from .errors import LoadImagesError
+from .errors import PodmanAPIError
 from .providers.base import ContainerProvider
+from .providers.oci import OCIRuntime
+from .providers.podman import CompiledContainer
 from .providers.podman import Podman
+from .providers.podman_api import PodmanAPI
+from .providers.podman_api import PodmanAPIClient
 from .services import make_containers_service
+from .services.api import APIContainersService
 from .services.base import ContainersService
+from .services.batch import LoadImageResult
+from .services.batch import LoadImagesReport
+from .services.batch import LoadImageStatus
+from .services.collect import RunResult
+from .services.copy_engine import CopyEngine
+from .services.copy_engine import CopyStats
+from .services.copy_engine import SmallFileCache
+from .services.events import DetachedContainer
+from .services.events import EventsWatcher
+from .services.file_waiter import FileWaiter
+from .services.image_cache import ImageCache
+from .services.image_sources import ArchiveImageSource
+from .services.image_sources import ImageSource
+from .services.instrumentation import CallbackInstrument
+from .services.instrumentation import HistogramCollector
+from .services.instrumentation import Instrument
+from .services.instrumentation import TimingEvent
+from .services.instrumentation import TracingInstrument
+from .services.oci import OCIContainersService
+from .services.placement import CPUTopology
+from .services.placement import NUMALocalStrategy
+from .services.placement import NUMANode
+from .services.placement import PackStrategy
+from .services.placement import Placement
+from .services.placement import PlacementManager
+from .services.placement import PlacementStrategy
+from .services.placement import SpreadStrategy
+from .services.pool import ContainerPool
+from .services.pool import PoolStats
+from .services.scheduler import AdmissionPolicy
+from .services.scheduler import LaunchScheduler
+from .services.scheduler import ResourceAdmission
+from .services.session import ContainerSession
+from .services.shared_store import SharedImageStore
+from .services.streaming import FileSink
+from .services.streaming import OutputChunk
+from .services.streaming import OutputStream
+from .services.termination import TerminationPolicy
+from .services.termination import TerminationStats
 from .services.windows import WindowsContainersService
@@ -0,0 +1,275 @@
+"""Run a batch of containers from a file of container specs.
+
+    python -m containers specs.json --concurrency 8 --output-dir out
+    python -m containers specs.json --dry-run
+
+The specs file is either a document written by `serialization.dumps_json_many`,
+a JSON list of container specs, or JSON lines with one container spec per line.
+YAML files are supported as well if PyYAML is installed.
+"""
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import json
+import math
+import pathlib
+import shlex
+import sys
+import time
+import typing
+
+from . import serialization
+from .data_types import Container
+from .errors import LoadImagesError
+from .providers.podman import Podman
+from .services.base import ContainersService
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+YAML_SUFFIXES = (".yaml", ".yml")
+
+
+@dataclasses.dataclass
+class JobResult:
+    index: int
+    image: str
+    exit_code: typing.Optional[int]
+    # From the launch request to the process spawned, including the queue time
+    spawn_time: float
+    total_time: float
+    error: typing.Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exit_code == 0
+
+
+def _load_document(text: str, yaml_format: bool) -> typing.Any:
+    if yaml_format:
+        if yaml is None:
+            raise ValueError("PyYAML is required to read YAML specs")
+        return yaml.safe_load(text)
+    try:
+        return json.loads(text)
+    except ValueError:
+        # JSON lines
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def parse_specs(text: str, yaml_format: bool = False) -> typing.List[Container]:
+    document = _load_document(text, yaml_format=yaml_format)
+    if isinstance(document, dict) and "version" in document:
+        return serialization.from_document(document)
+    if isinstance(document, dict):
+        document = [document]
+    if not isinstance(document, list):
+        raise ValueError("Expected a list of container specs")
+    return [serialization.from_dict(data) for data in document]
+
+
+def read_specs(path: str) -> typing.List[Container]:
+    if path == "-":
+        return parse_specs(sys.stdin.read())
+    return parse_specs(
+        pathlib.Path(path).read_text(), yaml_format=path.endswith(YAML_SUFFIXES)
+    )
+
+
+def percentile(values: typing.Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile of the values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(
+    results: typing.Sequence[JobResult], elapsed: float
+) -> typing.Dict[str, typing.Any]:
+    summary: typing.Dict[str, typing.Any] = dict(
+        jobs=len(results),
+        succeeded=sum(result.succeeded for result in results),
+        failed=sum(not result.succeeded for result in results),
+        elapsed=elapsed,
+        throughput=len(results) / elapsed if elapsed else 0.0,
+    )
+    for name in ("spawn_time", "total_time"):
+        values = [getattr(result, name) for result in results if result.error is None]
+        summary[name] = {
+            f"p{percent}": percentile(values, percent) for percent in (50, 95, 99)
+        }
+    return summary
+
+
+async def run_job(
+    service: ContainersService,
+    index: int,
+    container: Container,
+    output_dir: typing.Optional[pathlib.Path],
+    log_level: typing.Optional[str] = None,
+) -> JobResult:
+    begin = time.perf_counter()
+    spawn_time = 0.0
+    try:
+        with contextlib.ExitStack() as stack:
+            if output_dir is not None:
+                stdout = stack.enter_context(
+                    open(output_dir / f"job-{index:05d}.stdout", "wb")
+                )
+                stderr = stack.enter_context(
+                    open(output_dir / f"job-{index:05d}.stderr", "wb")
+                )
+            else:
+                stdout = stderr = asyncio.subprocess.DEVNULL
+            # The output goes from the container process to the files directly
+            async with service.run(
+                container, stdout=stdout, stderr=stderr, log_level=log_level
+            ) as proc:
+                spawn_time = time.perf_counter() - begin
+                exit_code = await proc.wait()
+    except Exception as exc:
+        return JobResult(
+            index=index,
+            image=container.image,
+            exit_code=None,
+            spawn_time=spawn_time,
+            total_time=time.perf_counter() - begin,
+            error=str(exc),
+        )
+    return JobResult(
+        index=index,
+        image=container.image,
+        exit_code=exit_code,
+        spawn_time=spawn_time,
+        total_time=time.perf_counter() - begin,
+    )
+
+
+async def run_batch(
+    service: ContainersService,
+    containers: typing.Sequence[Container],
+    concurrency: int = 4,
+    output_dir: typing.Optional[pathlib.Path] = None,
+    log_level: typing.Optional[str] = None,
+) -> typing.List[JobResult]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(index: int, container: Container) -> JobResult:
+        async with semaphore:
+            result = await run_job(
+                service, index, container, output_dir=output_dir, log_level=log_level
+            )
+        service.logger.info(
+            "Job %s of image %s finished with exit code %s in %.3fs",
+            index,
+            container.image,
+            result.exit_code,
+            result.total_time,
+        )
+        return result
+
+    return list(
+        await asyncio.gather(
+            *(_run(index, container) for index, container in enumerate(containers))
+        )
+    )
+
+
+def format_summary(summary: typing.Dict[str, typing.Any]) -> str:
+    lines = [
+        f"jobs={summary['jobs']} succeeded={summary['succeeded']} "
+        f"failed={summary['failed']} elapsed={summary['elapsed']:.3f}s "
+        f"throughput={summary['throughput']:.2f} jobs/s"
+    ]
+    for name in ("spawn_time", "total_time"):
+        values = " ".join(
+            f"{key}={value * 1e3:.1f}ms" for key, value in summary[name].items()
+        )
+        lines.append(f"{name:<10} {values}")
+    return "\n".join(lines)
+
+
+def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m containers")
+    parser.add_argument("specs", help="container specs file, or - for stdin")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--output-dir",
+        type=pathlib.Path,
+        help="write the stdout and stderr of each job into files in this directory",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the command of each container instead of running them",
+    )
+    parser.add_argument(
+        "--pull", action="store_true", help="load all the images before running"
+    )
+    parser.add_argument("--executable", type=pathlib.Path, default="podman")
+    parser.add_argument("--log-level", help="log level of podman")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    try:
+        containers = read_specs(args.specs)
+    except (OSError, ValueError, TypeError, KeyError) as exc:
+        parser.error(f"unable to read specs {args.specs}: {exc}")
+    provider = Podman(executable=args.executable)
+    if args.dry_run:
+        for container in containers:
+            command = provider.build_command(container, log_level=args.log_level)
+            print(" ".join(map(shlex.quote, command)))
+        return 0
+
+    if args.output_dir is not None:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+    service = ContainersService(provider)
+
+    async def _main() -> typing.List[JobResult]:
+        if args.pull:
+            report = await service.load_images(
+                [container.image for container in containers],
+                concurrency=args.concurrency,
+            )
+            report.raise_for_errors()
+        return await run_batch(
+            service,
+            containers,
+            concurrency=args.concurrency,
+            output_dir=args.output_dir,
+            log_level=args.log_level,
+        )
+
+    begin = time.perf_counter()
+    try:
+        results = asyncio.run(_main())
+    except LoadImagesError as exc:
+        for error in exc.errors:
+            print(
+                f"unable to load image {error.image}: {error.stderr.strip()}",
+                file=sys.stderr,
+            )
+        return 1
+    summary = summarize(results, elapsed=time.perf_counter() - begin)
+    if args.json:
+        summary["results"] = [dataclasses.asdict(result) for result in results]
+        print(json.dumps(summary, indent=2))
+    else:
+        for result in results:
+            if result.error is not None:
+                print(f"job {result.index} ({result.image}) failed: {result.error}")
+            elif not result.succeeded:
+                print(
+                    f"job {result.index} ({result.image}) exited with "
+                    f"code {result.exit_code}"
+                )
+        print(format_summary(summary))
+    return 0 if summary["failed"] == 0 else 1
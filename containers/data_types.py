@@ -1,15 +1,64 @@
 import dataclasses
 import pathlib
+import re
 import typing
 
+from .providers.helpers import parse_size
+
 PathType = typing.Union[str, pathlib.Path, pathlib.PurePath]
+T = typing.TypeVar("T")
+
+CPU_SET_PATTERN = re.compile(r"^\d+(-\d+)?(,\d+(-\d+)?)*$")
+ULIMIT_NAMES = frozenset(
+    [
+        "core",
+        "cpu",
+        "data",
+        "fsize",
+        "locks",
+        "memlock",
+        "msgqueue",
+        "nice",
+        "nofile",
+        "nproc",
+        "rss",
+        "rtprio",
+        "rttime",
+        "sigpending",
+        "stack",
+    ]
+)
+
+
+def add_slots(cls: typing.Type[T]) -> typing.Type[T]:
+    """Rebuild a dataclass with `__slots__` of its own fields, like `slots=True` of
+    dataclasses which is only available since Python 3.10
+    """
+    inherited = {
+        name for base in cls.__mro__[1:] for name in getattr(base, "__slots__", ())
+    }
+    field_names = tuple(
+        field.name for field in dataclasses.fields(cls) if field.name not in inherited
+    )
+    cls_dict = dict(cls.__dict__)
+    # Defaults are kept by the generated __init__, they would conflict with slots
+    for name in field_names:
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    cls_dict["__slots__"] = field_names
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
 
 
+@add_slots
 @dataclasses.dataclass
 class Mount:
     target: PathType
 
 
+@add_slots
 @dataclasses.dataclass
 class BindMount(Mount):
     source: PathType
@@ -19,24 +68,137 @@ class BindMount(Mount):
     bind_propagation: typing.Optional[str] = None
 
 
+@add_slots
 @dataclasses.dataclass
 class VolumeMount(Mount):
     readonly: bool
     chown: bool = False
 
 
+@add_slots
 @dataclasses.dataclass
 class ImageMount(Mount):
     source: str
     read_write: bool = False
 
 
+@add_slots
+@dataclasses.dataclass
+class ArchiveImageMount(ImageMount):
+    """Image mount with the annotations of the archive-overlay OCI hook, which
+    archives the upper dir of the mount to `archive_to` when the container exits
+    and then creates the `archive_success` file, and of the mount-chown OCI hook
+    """
+
+    archive_to: typing.Optional[PathType] = None
+    archive_success: typing.Optional[PathType] = None
+    # Like tar.gz
+    archive_method: typing.Optional[str] = None
+    archive_tar_content_owner: typing.Optional[str] = None
+    # Owner like 1000:1000 of the mount point
+    chown: typing.Optional[str] = None
+    chown_policy: typing.Optional[str] = None
+    mode: typing.Optional[int] = None
+
+
+@add_slots
 @dataclasses.dataclass
 class SecurityOptions:
     no_new_privileges: bool = False
     seccomp: typing.Optional[PathType] = None
 
 
+def validate_cpu_set(value: str, name: str):
+    if not CPU_SET_PATTERN.match(value):
+        raise ValueError(f"Invalid {name} {value!r}, expected a list like 0-3,8")
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        if last and int(last) < int(first):
+            raise ValueError(f"Invalid {name} {value!r}, range {part} is reversed")
+
+
+@add_slots
+@dataclasses.dataclass
+class ResourceLimits:
+    # Number of CPUs, like 1.5
+    cpus: typing.Optional[float] = None
+    # CPUs allowed to run on, like 0-3,8
+    cpuset_cpus: typing.Optional[str] = None
+    # NUMA memory nodes allowed to allocate memory from, like 0,1
+    cpuset_mems: typing.Optional[str] = None
+    # Sizes like 512m or in bytes
+    memory: typing.Optional[typing.Union[str, int]] = None
+    # Memory plus swap, -1 for unlimited swap
+    memory_swap: typing.Optional[typing.Union[str, int]] = None
+    # -1 for unlimited
+    pids_limit: typing.Optional[int] = None
+    # Name to soft limit or (soft, hard) limits, -1 for unlimited
+    ulimits: typing.Dict[str, typing.Union[int, typing.Tuple[int, int]]] = (
+        dataclasses.field(default_factory=dict)
+    )
+    # Relative block IO weight between 10 and 1000
+    blkio_weight: typing.Optional[int] = None
+
+    def __post_init__(self):
+        if self.cpus is not None:
+            if isinstance(self.cpus, str):
+                try:
+                    self.cpus = float(self.cpus)
+                except ValueError:
+                    pass
+            if (
+                not isinstance(self.cpus, (int, float))
+                or isinstance(self.cpus, bool)
+                or not self.cpus > 0
+            ):
+                raise ValueError(
+                    f"Invalid cpus {self.cpus!r}, expected a positive number"
+                )
+        if self.cpuset_cpus is not None:
+            validate_cpu_set(self.cpuset_cpus, "cpuset_cpus")
+        if self.cpuset_mems is not None:
+            validate_cpu_set(self.cpuset_mems, "cpuset_mems")
+        memory = None
+        if self.memory is not None:
+            memory = parse_size(self.memory)
+            if memory <= 0:
+                raise ValueError(f"Invalid memory {self.memory!r}")
+        if isinstance(self.memory_swap, str) and self.memory_swap.strip() == "-1":
+            self.memory_swap = -1
+        if self.memory_swap is not None and self.memory_swap != -1:
+            if memory is None:
+                raise ValueError("memory_swap requires memory to be set")
+            if parse_size(self.memory_swap) < memory:
+                raise ValueError(
+                    f"Invalid memory_swap {self.memory_swap!r}, it includes memory "
+                    "and cannot be smaller than it"
+                )
+        if self.pids_limit is not None and (
+            self.pids_limit == 0 or self.pids_limit < -1
+        ):
+            raise ValueError(f"Invalid pids_limit {self.pids_limit!r}")
+        for name, value in self.ulimits.items():
+            if name not in ULIMIT_NAMES:
+                raise ValueError(f"Unknown ulimit {name!r}")
+            soft, hard = self.get_ulimit(name)
+            if hard != -1 and (soft == -1 or soft > hard):
+                raise ValueError(
+                    f"Invalid ulimit {name} {value!r}, soft limit is above hard limit"
+                )
+        if self.blkio_weight is not None and not 10 <= self.blkio_weight <= 1000:
+            raise ValueError(
+                f"Invalid blkio_weight {self.blkio_weight!r}, expected 10 to 1000"
+            )
+
+    def get_ulimit(self, name: str) -> typing.Tuple[int, int]:
+        value = self.ulimits[name]
+        if isinstance(value, int):
+            return value, value
+        soft, hard = value
+        return soft, hard
+
+
+@add_slots
 @dataclasses.dataclass
 class Container:
     image: str
@@ -53,3 +215,5 @@ class Container:
     shm_size: typing.Optional[str] = None
     timeout: typing.Optional[int] = None
     security_options: typing.Optional[SecurityOptions] = None
+    name: typing.Optional[str] = None
+    resources: typing.Optional[ResourceLimits] = None
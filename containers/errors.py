@@ -1,3 +1,6 @@
+import typing
+
+
 class LoadImageError(Exception):
     """Raised when loading (pulling) a container image fails."""
 
@@ -6,3 +9,35 @@ class LoadImageError(Exception):
         self.code = code
         self.stderr = stderr
         super().__init__(f"Failed to load image {image} with code {code}: {stderr}")
+
+
+class LoadImagesError(Exception):
+    """Raised when loading one or more images of a batch fails."""
+
+    def __init__(self, errors: typing.List[LoadImageError]):
+        self.errors = errors
+        images = ", ".join(error.image for error in errors)
+        super().__init__(f"Failed to load {len(errors)} image(s): {images}")
+
+
+class PodmanAPIError(Exception):
+    """Raised when a podman REST API call returns an error."""
+
+    def __init__(self, status: int, message: str):
+        self.status = status
+        self.message = message
+        super().__init__(f"Podman API error with status {status}: {message}")
+
+
+class ContainerRunError(Exception):
+    """Raised when a container exits with a non-zero code and the caller checks it."""
+
+    def __init__(self, image: str, code: int, stdout: bytes, stderr: bytes):
+        self.image = image
+        self.code = code
+        self.stdout = stdout
+        self.stderr = stderr
+        super().__init__(
+            f"Container of image {image} exited with code {code}: "
+            f"{stderr.decode('utf8', 'replace')[-1024:]}"
+        )
@@ -1,5 +1,15 @@
 import typing
 
+if typing.TYPE_CHECKING:
+    from ..data_types import ArchiveImageMount
+    from ..data_types import ResourceLimits
+
+ARCHIVE_HOOK_PREFIX = "com.launchplatform.oci-hooks.archive-overlay."
+CHOWN_HOOK_PREFIX = "com.launchplatform.oci-hooks.mount-chown."
+# The default CFS period in microseconds, used to turn cpus into a quota
+CPU_PERIOD = 100000
+RLIM_INFINITY = 2**64 - 1
+
 
 def make_mount(params: typing.Dict[str, str]) -> str:
     return ",".join(map(lambda item: "=".join(item), params.items()))
@@ -17,9 +27,127 @@ def make_annotation_args(annotations: typing.Dict[str, str]) -> typing.Tuple[str
     return tuple(args)
 
 
+def make_overlay_archive_annotations(
+    mount: "ArchiveImageMount", name: str
+) -> typing.Dict[str, str]:
+    if mount.archive_to is None:
+        return {}
+    annotations = {
+        f"{ARCHIVE_HOOK_PREFIX}{name}.mount-point": str(mount.target),
+        f"{ARCHIVE_HOOK_PREFIX}{name}.archive-to": str(mount.archive_to),
+    }
+    if mount.archive_success is not None:
+        annotations[f"{ARCHIVE_HOOK_PREFIX}{name}.success"] = str(mount.archive_success)
+    if mount.archive_method is not None:
+        annotations[f"{ARCHIVE_HOOK_PREFIX}{name}.method"] = mount.archive_method
+    if mount.archive_tar_content_owner is not None:
+        annotations[f"{ARCHIVE_HOOK_PREFIX}{name}.tar-content-owner"] = (
+            mount.archive_tar_content_owner
+        )
+    return annotations
+
+
+def make_mount_chown_annotations(
+    mount: "ArchiveImageMount", name: str
+) -> typing.Dict[str, str]:
+    if mount.chown is None and mount.mode is None:
+        return {}
+    annotations = {f"{CHOWN_HOOK_PREFIX}{name}.path": str(mount.target)}
+    if mount.chown is not None:
+        annotations[f"{CHOWN_HOOK_PREFIX}{name}.owner"] = mount.chown
+    if mount.chown_policy is not None:
+        annotations[f"{CHOWN_HOOK_PREFIX}{name}.policy"] = mount.chown_policy
+    if mount.mode is not None:
+        annotations[f"{CHOWN_HOOK_PREFIX}{name}.mode"] = f"{mount.mode:o}"
+    return annotations
+
+
+def make_hook_annotations(
+    mount: "ArchiveImageMount", name: str
+) -> typing.Dict[str, str]:
+    """Annotations of the OCI hooks for the mount, `name` tells apart the
+    annotations of each mount
+    """
+    return {
+        **make_overlay_archive_annotations(mount, name),
+        **make_mount_chown_annotations(mount, name),
+    }
+
+
 def make_env_args(environ: typing.Dict[str, str]) -> typing.Tuple[str, ...]:
     args = []
     for env_arg in map(lambda item: "=".join(item), environ.items()):
         args.append("--env")
         args.append(env_arg)
     return tuple(args)
+
+
+SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "k": 1024,
+    "m": 1024**2,
+    "g": 1024**3,
+    "t": 1024**4,
+}
+
+
+def parse_size(size: typing.Union[str, int]) -> int:
+    """Parse size string like 256m into bytes, the same way podman does"""
+    if isinstance(size, int):
+        return size
+    value = size.strip().lower()
+    if value.endswith("b") and len(value) > 1 and value[-2] in SIZE_UNITS:
+        value = value[:-1]
+    unit = value[-1:] if value[-1:].isalpha() else ""
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"Invalid size {size!r}")
+    number = value[: len(value) - len(unit)]
+    try:
+        amount = float(number)
+    except ValueError:
+        raise ValueError(f"Invalid size {size!r}")
+    if amount < 0:
+        raise ValueError(f"Invalid size {size!r}")
+    return int(amount * SIZE_UNITS[unit])
+
+
+def make_linux_resources(resources: "ResourceLimits") -> typing.Dict[str, typing.Any]:
+    """Map the resource limits to the runtime-spec LinuxResources"""
+    limits: typing.Dict[str, typing.Any] = {}
+    if resources.cpus is not None:
+        limits.setdefault("cpu", {}).update(
+            quota=int(resources.cpus * CPU_PERIOD), period=CPU_PERIOD
+        )
+    if resources.cpuset_cpus is not None:
+        limits.setdefault("cpu", {})["cpus"] = resources.cpuset_cpus
+    if resources.cpuset_mems is not None:
+        limits.setdefault("cpu", {})["mems"] = resources.cpuset_mems
+    if resources.memory is not None:
+        limits.setdefault("memory", {})["limit"] = parse_size(resources.memory)
+    if resources.memory_swap is not None:
+        limits.setdefault("memory", {})["swap"] = (
+            -1 if resources.memory_swap == -1 else parse_size(resources.memory_swap)
+        )
+    if resources.pids_limit is not None:
+        limits["pids"] = {"limit": resources.pids_limit}
+    if resources.blkio_weight is not None:
+        limits["blockIO"] = {"weight": resources.blkio_weight}
+    return limits
+
+
+def make_rlimits(
+    resources: "ResourceLimits",
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Map the ulimits to the runtime-spec POSIX rlimits"""
+    r_limits = []
+    for name in resources.ulimits:
+        soft, hard = resources.get_ulimit(name)
+        r_limits.append(
+            {
+                "type": f"RLIMIT_{name.upper()}",
+                "soft": RLIM_INFINITY if soft == -1 else soft,
+                "hard": RLIM_INFINITY if hard == -1 else hard,
+            }
+        )
+    return r_limits
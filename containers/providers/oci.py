@@ -0,0 +1,467 @@
+import dataclasses
+import json
+import os
+import pathlib
+import platform
+import typing
+
+from ..data_types import BindMount
+from ..data_types import Container
+from ..data_types import ImageMount
+from ..data_types import Mount
+from ..data_types import PathType
+from ..data_types import VolumeMount
+from .base import ContainerProvider
+from .helpers import make_linux_resources
+from .helpers import make_rlimits
+from .helpers import parse_size
+
+OCI_VERSION = "1.0.2"
+DEFAULT_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+DEFAULT_SHM_SIZE = 64 * 1024**2
+# The default capabilities of podman
+DEFAULT_CAPABILITIES = (
+    "CAP_CHOWN",
+    "CAP_DAC_OVERRIDE",
+    "CAP_FOWNER",
+    "CAP_FSETID",
+    "CAP_KILL",
+    "CAP_NET_BIND_SERVICE",
+    "CAP_SETFCAP",
+    "CAP_SETGID",
+    "CAP_SETPCAP",
+    "CAP_SETUID",
+    "CAP_SYS_CHROOT",
+)
+MASKED_PATHS = (
+    "/proc/acpi",
+    "/proc/kcore",
+    "/proc/keys",
+    "/proc/latency_stats",
+    "/proc/timer_list",
+    "/proc/timer_stats",
+    "/proc/sched_debug",
+    "/proc/scsi",
+    "/sys/firmware",
+)
+READONLY_PATHS = (
+    "/proc/asound",
+    "/proc/bus",
+    "/proc/fs",
+    "/proc/irq",
+    "/proc/sys",
+    "/proc/sysrq-trigger",
+)
+# The rootfs is shared by all the containers of an image and read-only, these
+# paths get a tmpfs of their own unless they are mounted over
+WRITABLE_PATHS = ("/tmp", "/run")
+HOSTNAME = "container"
+SECCOMP_ARCHES = {
+    "x86_64": "SCMP_ARCH_X86_64",
+    "aarch64": "SCMP_ARCH_AARCH64",
+    "arm64": "SCMP_ARCH_AARCH64",
+    "ppc64le": "SCMP_ARCH_PPC64LE",
+    "s390x": "SCMP_ARCH_S390X",
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class ImageConfig:
+    """The parts of the image config used to run its containers"""
+
+    env: typing.Tuple[str, ...] = ()
+    entrypoint: typing.Tuple[str, ...] = ()
+    cmd: typing.Tuple[str, ...] = ()
+    work_dir: typing.Optional[str] = None
+    user: typing.Optional[str] = None
+
+    @classmethod
+    def from_inspect(cls, data: typing.Dict[str, typing.Any]) -> "ImageConfig":
+        """Make it from an item of `podman image inspect --format json`"""
+        config = data.get("Config") or {}
+        return cls(
+            env=tuple(config.get("Env") or ()),
+            entrypoint=tuple(config.get("Entrypoint") or ()),
+            cmd=tuple(config.get("Cmd") or ()),
+            work_dir=config.get("WorkingDir") or None,
+            user=config.get("User") or None,
+        )
+
+
+def _read_id_file(path: pathlib.Path) -> typing.List[typing.List[str]]:
+    if not path.exists():
+        return []
+    return [
+        line.split(":")
+        for line in path.read_text().splitlines()
+        if line and not line.startswith("#")
+    ]
+
+
+def resolve_user(
+    rootfs: PathType,
+    user: typing.Optional[str],
+    group: typing.Optional[str] = None,
+) -> typing.Tuple[int, int]:
+    """Resolve the user and group, names or numbers, to uid and gid with the
+    passwd and group files of the rootfs
+    """
+    if user is not None and group is None and ":" in user:
+        user, group = user.split(":", 1)
+    uid = gid = 0
+    if user:
+        passwd = _read_id_file(pathlib.Path(rootfs) / "etc" / "passwd")
+        entry = next((entry for entry in passwd if user in (entry[0], entry[2])), None)
+        if entry is not None:
+            uid, gid = int(entry[2]), int(entry[3])
+        elif user.isdigit():
+            uid = int(user)
+        else:
+            raise ValueError(f"Unable to find user {user} in the image")
+    if group:
+        groups = _read_id_file(pathlib.Path(rootfs) / "etc" / "group")
+        entry = next((entry for entry in groups if group in (entry[0], entry[2])), None)
+        if entry is not None:
+            gid = int(entry[2])
+        elif group.isdigit():
+            gid = int(group)
+        else:
+            raise ValueError(f"Unable to find group {group} in the image")
+    return uid, gid
+
+
+def convert_seccomp_profile(
+    profile: typing.Dict[str, typing.Any],
+    arch: typing.Optional[str] = None,
+    capabilities: typing.Collection[str] = DEFAULT_CAPABILITIES,
+) -> typing.Dict[str, typing.Any]:
+    """Convert a seccomp profile in the containers (docker) JSON format, as taken
+    by podman, to the runtime-spec LinuxSeccomp. The conditional rules are resolved
+    for the architecture and the granted capabilities.
+    """
+    if arch is None:
+        arch = SECCOMP_ARCHES.get(platform.machine())
+    architectures = list(profile.get("architectures") or ())
+    for item in profile.get("archMap") or ():
+        if item["architecture"] == arch:
+            architectures = [arch, *(item.get("subArchitectures") or ())]
+    syscalls = []
+    for rule in profile.get("syscalls") or ():
+        includes = rule.get("includes") or {}
+        excludes = rule.get("excludes") or {}
+        if includes.get("arches") and arch not in includes["arches"]:
+            continue
+        if includes.get("caps") and not set(includes["caps"]) <= set(capabilities):
+            continue
+        if excludes.get("arches") and arch in excludes["arches"]:
+            continue
+        if excludes.get("caps") and set(excludes["caps"]) & set(capabilities):
+            continue
+        syscall = {
+            "names": rule.get("names") or [rule["name"]],
+            "action": rule["action"],
+        }
+        for key in ("args", "errnoRet"):
+            if rule.get(key):
+                syscall[key] = rule[key]
+        syscalls.append(syscall)
+    seccomp = {"defaultAction": profile["defaultAction"], "syscalls": syscalls}
+    if "defaultErrnoRet" in profile:
+        seccomp["defaultErrnoRet"] = profile["defaultErrnoRet"]
+    if architectures:
+        seccomp["architectures"] = architectures
+    return seccomp
+
+
+class OCIRuntime(ContainerProvider):
+    """Provider runs containers with an OCI runtime like crun or runc directly, from
+    a bundle with the `config.json` generated out of the container, to be used with
+    `OCIContainersService`. Podman is still used to pull and mount the images.
+
+    The rootfs of an image is shared by all its containers and read-only, with a
+    tmpfs on `/tmp` and `/run`. Mount targets must exist in the image, and volume
+    mounts and networks other than `none` and `host` are not supported.
+    """
+
+    def __init__(
+        self,
+        runtime: pathlib.Path = pathlib.Path("crun"),
+        executable: pathlib.Path = pathlib.Path("podman"),
+        state_dir: typing.Optional[pathlib.Path] = None,
+        rootless: typing.Optional[bool] = None,
+    ):
+        self.runtime = runtime
+        # Podman for the images
+        self.executable = executable
+        self.state_dir = state_dir
+        self.rootless = os.geteuid() != 0 if rootless is None else rootless
+        self._seccomp_profiles: typing.Dict[
+            typing.Tuple[str, int], typing.Dict[str, typing.Any]
+        ] = {}
+
+    def load_seccomp_profile(self, path: PathType) -> typing.Dict[str, typing.Any]:
+        path = str(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        key = (path, mtime_ns)
+        seccomp = self._seccomp_profiles.get(key)
+        if seccomp is None:
+            with open(path, "rb") as fo:
+                seccomp = convert_seccomp_profile(json.load(fo))
+            self._seccomp_profiles[key] = seccomp
+        return seccomp
+
+    def make_mount_spec(
+        self, mount: Mount, image_mounts: typing.Mapping[str, str]
+    ) -> typing.Dict[str, typing.Any]:
+        if isinstance(mount, ImageMount):
+            if mount.read_write:
+                raise ValueError("Read-write image mounts are not supported")
+            return {
+                "destination": str(mount.target),
+                "type": "bind",
+                "source": image_mounts[mount.source],
+                "options": ["rbind", "ro"],
+            }
+        elif isinstance(mount, BindMount):
+            if mount.chown:
+                raise ValueError("Bind mounts with chown are not supported")
+            options = ["rbind", "ro" if mount.readonly else "rw"]
+            if mount.bind_propagation is not None:
+                options.append(mount.bind_propagation)
+            return {
+                "destination": str(mount.target),
+                "type": "bind",
+                "source": os.path.abspath(mount.source),
+                "options": options,
+            }
+        elif isinstance(mount, VolumeMount):
+            raise ValueError("Volume mounts are not supported")
+        else:
+            raise ValueError("Unknown mount type %s", mount.__class__)
+
+    def make_mounts(
+        self,
+        container: Container,
+        image_mounts: typing.Mapping[str, str],
+        host_network: bool,
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        shm_size = DEFAULT_SHM_SIZE
+        if container.shm_size is not None:
+            shm_size = parse_size(container.shm_size)
+        devpts_options = [
+            "nosuid",
+            "noexec",
+            "newinstance",
+            "ptmxmode=0666",
+            "mode=0620",
+        ]
+        if not self.rootless:
+            devpts_options.append("gid=5")
+        mounts = [
+            {"destination": "/proc", "type": "proc", "source": "proc"},
+            {
+                "destination": "/dev",
+                "type": "tmpfs",
+                "source": "tmpfs",
+                "options": ["nosuid", "strictatime", "mode=755", "size=65536k"],
+            },
+            {
+                "destination": "/dev/pts",
+                "type": "devpts",
+                "source": "devpts",
+                "options": devpts_options,
+            },
+            {
+                "destination": "/dev/shm",
+                "type": "tmpfs",
+                "source": "shm",
+                "options": ["nosuid", "noexec", "nodev", f"size={shm_size}"],
+            },
+            {
+                "destination": "/dev/mqueue",
+                "type": "mqueue",
+                "source": "mqueue",
+                "options": ["nosuid", "noexec", "nodev"],
+            },
+        ]
+        if self.rootless or host_network:
+            # sysfs cannot be mounted without owning the network namespace
+            mounts.append(
+                {
+                    "destination": "/sys",
+                    "type": "none",
+                    "source": "/sys",
+                    "options": ["rbind", "nosuid", "noexec", "nodev", "ro"],
+                }
+            )
+        else:
+            mounts.append(
+                {
+                    "destination": "/sys",
+                    "type": "sysfs",
+                    "source": "sysfs",
+                    "options": ["nosuid", "noexec", "nodev", "ro"],
+                }
+            )
+        targets = {os.path.normpath(str(mount.target)) for mount in container.mounts}
+        for path in WRITABLE_PATHS:
+            if path not in targets:
+                mounts.append(
+                    {
+                        "destination": path,
+                        "type": "tmpfs",
+                        "source": "tmpfs",
+                        "options": ["nosuid", "nodev", "mode=1777"],
+                    }
+                )
+        for mount in container.mounts:
+            mounts.append(self.make_mount_spec(mount, image_mounts))
+        return mounts
+
+    def make_process_args(
+        self, container: Container, image_config: ImageConfig = ImageConfig()
+    ) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """The args and env of the container process"""
+        # Same as podman, the command replaces the cmd but not the entrypoint
+        args = [*image_config.entrypoint, *(container.command or image_config.cmd)]
+        if not args:
+            raise ValueError(f"No command to run for image {container.image}")
+        env = dict(item.split("=", 1) for item in image_config.env if "=" in item)
+        env.setdefault("PATH", DEFAULT_PATH)
+        env.update(container.environ)
+        return args, [f"{key}={value}" for key, value in env.items()]
+
+    def make_launch_config(
+        self,
+        config: typing.Dict[str, typing.Any],
+        container: Container,
+        image_config: ImageConfig = ImageConfig(),
+    ) -> typing.Dict[str, typing.Any]:
+        """Apply what changes from a launch to another, the command, environment
+        and resources, to the config made by `make_config` for another container
+        of the same template. The given config is not modified.
+        """
+        args, env = self.make_process_args(container, image_config)
+        linux = dict(config["linux"])
+        linux.pop("resources", None)
+        if container.resources is not None:
+            resources = make_linux_resources(container.resources)
+            if resources:
+                linux["resources"] = resources
+        return {
+            **config,
+            "process": {**config["process"], "args": args, "env": env},
+            "linux": linux,
+        }
+
+    def make_config(
+        self,
+        container: Container,
+        rootfs: PathType,
+        image_config: ImageConfig = ImageConfig(),
+        image_mounts: typing.Optional[typing.Mapping[str, str]] = None,
+    ) -> typing.Dict[str, typing.Any]:
+        """Generate the runtime-spec `config.json` of the container, with the
+        rootfs of its image and the paths of its mounted images. Nothing specific
+        to a launch goes in there, so that the bundle can be reused, see
+        `make_launch_config` for the parts that change between launches.
+        """
+        if container.network not in (None, "none", "host"):
+            raise ValueError(f"Network {container.network} is not supported")
+        if image_mounts is None:
+            image_mounts = {}
+        host_network = container.network == "host"
+        args, env = self.make_process_args(container, image_config)
+        uid, gid = resolve_user(
+            rootfs,
+            container.user if container.user is not None else image_config.user,
+            container.group,
+        )
+        process: typing.Dict[str, typing.Any] = {
+            "terminal": container.tty,
+            "user": {"uid": uid, "gid": gid},
+            "args": args,
+            "env": env,
+            "cwd": str(container.work_dir or image_config.work_dir or "/"),
+            "capabilities": {
+                key: list(DEFAULT_CAPABILITIES)
+                for key in ("bounding", "effective", "permitted")
+            },
+        }
+        linux: typing.Dict[str, typing.Any] = {
+            "namespaces": [
+                {"type": namespace}
+                for namespace in ("pid", "ipc", "uts", "mount", "cgroup")
+            ],
+            "maskedPaths": list(MASKED_PATHS),
+            "readonlyPaths": list(READONLY_PATHS),
+        }
+        if not host_network:
+            linux["namespaces"].append({"type": "network"})
+        if self.rootless:
+            linux["namespaces"].append({"type": "user"})
+            linux["uidMappings"] = [
+                {"containerID": 0, "hostID": os.geteuid(), "size": 1}
+            ]
+            linux["gidMappings"] = [
+                {"containerID": 0, "hostID": os.getegid(), "size": 1}
+            ]
+        if container.resources is not None:
+            resources = make_linux_resources(container.resources)
+            if resources:
+                linux["resources"] = resources
+            r_limits = make_rlimits(container.resources)
+            if r_limits:
+                process["rlimits"] = r_limits
+        security_options = container.security_options
+        if security_options is not None:
+            if security_options.no_new_privileges:
+                process["noNewPrivileges"] = True
+            seccomp = security_options.seccomp
+            if seccomp is not None and str(seccomp) != "unconfined":
+                linux["seccomp"] = self.load_seccomp_profile(seccomp)
+        return {
+            "ociVersion": OCI_VERSION,
+            "process": process,
+            "root": {"path": os.path.abspath(rootfs), "readonly": True},
+            "hostname": HOSTNAME,
+            "mounts": self.make_mounts(container, image_mounts, host_network),
+            "linux": linux,
+        }
+
+    def _make_base_args(
+        self, log_level: typing.Optional[str] = None
+    ) -> typing.List[str]:
+        args = [str(self.runtime)]
+        if self.state_dir is not None:
+            args.extend(["--root", str(self.state_dir)])
+        if log_level is not None:
+            args.extend(["--log-level", log_level])
+        return args
+
+    def build_run_command(
+        self,
+        bundle: PathType,
+        container_id: str,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        args = self._make_base_args(log_level)
+        args.extend(["run", "--bundle", str(bundle), container_id])
+        return tuple(args)
+
+    def build_kill_command(
+        self,
+        *container_ids: str,
+        signal: typing.Optional[str] = None,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        (container_id,) = container_ids
+        args = self._make_base_args(log_level)
+        args.extend(["kill", container_id, signal or "SIGKILL"])
+        return tuple(args)
+
+    def build_remove_command(
+        self, *container_ids: str, log_level: typing.Optional[str] = None
+    ) -> typing.Tuple[str, ...]:
+        (container_id,) = container_ids
+        return (*self._make_base_args(log_level), "delete", "--force", container_id)
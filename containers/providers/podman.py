@@ -1,19 +1,57 @@
-import functools
 import pathlib
 import typing
 import uuid
 
+from ..data_types import ArchiveImageMount
 from ..data_types import BindMount
 from ..data_types import Container
 from ..data_types import ImageMount
 from ..data_types import Mount
+from ..data_types import PathType
+from ..data_types import ResourceLimits
 from ..data_types import SecurityOptions
 from ..data_types import VolumeMount
 from .base import ContainerProvider
+from .helpers import make_annotation_args
 from .helpers import make_env_args
+from .helpers import make_hook_annotations
 from .helpers import make_mount_args
 
 
+class CompiledContainer:
+    """Pre-built command of a container template, only the command and environment
+    variables can be overridden when building the command of each launch.
+    """
+
+    def __init__(
+        self,
+        head_args: typing.Tuple[str, ...],
+        environ: typing.Dict[str, str],
+        tail_args: typing.Tuple[str, ...],
+        command: typing.Tuple[str, ...],
+    ):
+        self.head_args = head_args
+        self.environ = environ
+        self.tail_args = tail_args
+        self.command = command
+        self._env_args = make_env_args(environ)
+
+    def build_command(
+        self,
+        command: typing.Optional[typing.Sequence[str]] = None,
+        environ: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> typing.Tuple[str, ...]:
+        env_args = self._env_args
+        if environ:
+            env_args = make_env_args({**self.environ, **environ})
+        return (
+            *self.head_args,
+            *env_args,
+            *self.tail_args,
+            *(self.command if command is None else command),
+        )
+
+
 class Podman(ContainerProvider):
     def __init__(self, executable: pathlib.Path = pathlib.Path("podman")):
         self.executable = executable
@@ -28,7 +66,12 @@ class Podman(ContainerProvider):
             "target": str(mount.target),
             "rw": str(mount.read_write).lower(),
         }
-        return make_mount_args(params)
+        args = make_mount_args(params)
+        if isinstance(mount, ArchiveImageMount):
+            if name is None:
+                name = self._make_unique_mount_name()
+            args += make_annotation_args(make_hook_annotations(mount, name))
+        return args
 
     def make_bind_mount(self, mount: BindMount, name: typing.Optional[str] = None):
         params = {
@@ -79,86 +122,186 @@ class Podman(ContainerProvider):
             args.extend(["--security-opt", f"seccomp={security_options.seccomp}"])
         return tuple(args)
 
-    def build_command(
-        self, container: Container, log_level: typing.Optional[str] = None
-    ) -> typing.Tuple[str, ...]:
-        shared_args = []
-        if log_level is not None:
-            shared_args.append("--log-level")
-            shared_args.append(log_level)
-        base_args = (
-            str(self.executable),
-            *shared_args,
-            "run",
-        )
+    def make_resource_limits(self, resources: ResourceLimits) -> typing.Tuple[str, ...]:
+        args = []
+        if resources.cpus is not None:
+            args.extend(["--cpus", str(resources.cpus)])
+        if resources.cpuset_cpus is not None:
+            args.extend(["--cpuset-cpus", resources.cpuset_cpus])
+        if resources.cpuset_mems is not None:
+            args.extend(["--cpuset-mems", resources.cpuset_mems])
+        if resources.memory is not None:
+            args.extend(["--memory", str(resources.memory)])
+        if resources.memory_swap is not None:
+            args.extend(["--memory-swap", str(resources.memory_swap)])
+        if resources.pids_limit is not None:
+            args.extend(["--pids-limit", str(resources.pids_limit)])
+        for name, value in resources.ulimits.items():
+            if not isinstance(value, int):
+                value = ":".join(map(str, value))
+            args.extend(["--ulimit", f"{name}={value}"])
+        if resources.blkio_weight is not None:
+            args.extend(["--blkio-weight", str(resources.blkio_weight)])
+        return tuple(args)
 
-        env_args = make_env_args(container.environ)
+    def _make_base_args(
+        self, log_level: typing.Optional[str] = None
+    ) -> typing.List[str]:
+        args = [str(self.executable)]
+        if log_level is not None:
+            args.extend(["--log-level", log_level])
+        return args
 
-        interactive_args = tuple()
+    def compile(
+        self,
+        container: Container,
+        log_level: typing.Optional[str] = None,
+        subcommand: str = "run",
+        detach: bool = False,
+    ) -> CompiledContainer:
+        head_args = self._make_base_args(log_level)
+        head_args.append(subcommand)
+        if detach:
+            head_args.append("--detach")
         if container.interactive:
-            interactive_args = ("--interactive",)
-
-        tty_args = tuple()
+            head_args.append("--interactive")
         if container.tty:
-            tty_args = ("--tty",)
-
-        remove_args = tuple()
+            head_args.append("--tty")
         if container.remove:
-            remove_args = ("--rm",)
-
-        timeout_args = tuple()
+            head_args.append("--rm")
         if container.timeout is not None:
-            timeout_args = ("--timeout", str(container.timeout))
+            head_args.extend(["--timeout", str(container.timeout)])
 
-        user_args = tuple()
+        tail_args = []
+        if container.name is not None:
+            tail_args.extend(["--name", container.name])
         if container.user is not None:
             user_group = str(container.user)
             if container.group is not None:
                 user_group += f":{container.group}"
-            user_args = ("--user", user_group)
-
-        work_dir_args = tuple()
+            tail_args.extend(["--user", user_group])
         if container.work_dir is not None:
-            work_dir_args = ("--workdir", str(container.work_dir))
-
-        network_args = tuple()
+            tail_args.extend(["--workdir", str(container.work_dir)])
         if container.network is not None:
-            network_args = ("--network", container.network)
-
-        shm_size_args = tuple()
+            tail_args.extend(["--network", container.network])
         if container.shm_size is not None:
-            shm_size_args = ("--shm-size", str(container.shm_size))
-
-        security_options_args = tuple()
+            tail_args.extend(["--shm-size", str(container.shm_size)])
+        if container.resources is not None:
+            tail_args.extend(self.make_resource_limits(container.resources))
         if container.security_options is not None:
-            security_options_args = self.make_security_options(
-                container.security_options
-            )
-
-        mount_args = tuple(
-            functools.reduce(
-                lambda lhs, rhs: lhs + rhs,
-                map(
-                    lambda item: self.make_mount(item[1], name=f"mount-{item[0]}"),
-                    enumerate(container.mounts),
-                ),
-                tuple(),
-            )
-        )
-        args = (
-            *base_args,
-            *interactive_args,
-            *tty_args,
-            *remove_args,
-            *timeout_args,
-            *env_args,
-            *user_args,
-            *work_dir_args,
-            *network_args,
-            *shm_size_args,
-            *security_options_args,
-            *mount_args,
-            container.image,
-            *container.command,
+            tail_args.extend(self.make_security_options(container.security_options))
+        for i, mount in enumerate(container.mounts):
+            tail_args.extend(self.make_mount(mount, name=f"mount-{i}"))
+        tail_args.append(container.image)
+
+        return CompiledContainer(
+            head_args=tuple(head_args),
+            environ=dict(container.environ),
+            tail_args=tuple(tail_args),
+            command=tuple(container.command),
         )
-        return args
+
+    def build_command(
+        self, container: Container, log_level: typing.Optional[str] = None
+    ) -> typing.Tuple[str, ...]:
+        return self.compile(container, log_level=log_level).build_command()
+
+    def build_create_command(
+        self, container: Container, log_level: typing.Optional[str] = None
+    ) -> typing.Tuple[str, ...]:
+        return self.compile(
+            container, log_level=log_level, subcommand="create"
+        ).build_command()
+
+    def build_detached_command(
+        self, container: Container, log_level: typing.Optional[str] = None
+    ) -> typing.Tuple[str, ...]:
+        return self.compile(container, log_level=log_level, detach=True).build_command()
+
+    def build_events_command(
+        self,
+        filters: typing.Sequence[str] = (),
+        since: typing.Optional[str] = None,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        args = self._make_base_args(log_level)
+        args.extend(["events", "--format", "json"])
+        for event_filter in filters:
+            args.extend(["--filter", event_filter])
+        if since is not None:
+            args.extend(["--since", since])
+        return tuple(args)
+
+    def build_start_command(
+        self,
+        container_id: str,
+        interactive: bool = False,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        args = self._make_base_args(log_level)
+        args.extend(["start", "--attach"])
+        if interactive:
+            args.append("--interactive")
+        args.append(container_id)
+        return tuple(args)
+
+    def build_exec_command(
+        self,
+        container_id: str,
+        command: typing.Sequence[str],
+        interactive: bool = False,
+        tty: bool = False,
+        environ: typing.Optional[typing.Dict[str, str]] = None,
+        work_dir: typing.Optional[PathType] = None,
+        user: typing.Optional[str] = None,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        args = self._make_base_args(log_level)
+        args.append("exec")
+        if interactive:
+            args.append("--interactive")
+        if tty:
+            args.append("--tty")
+        if environ:
+            args.extend(make_env_args(environ))
+        if work_dir is not None:
+            args.extend(["--workdir", str(work_dir)])
+        if user is not None:
+            args.extend(["--user", user])
+        args.append(container_id)
+        args.extend(command)
+        return tuple(args)
+
+    def build_kill_command(
+        self,
+        *container_ids: str,
+        signal: typing.Optional[str] = None,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        args = self._make_base_args(log_level)
+        args.append("kill")
+        if signal is not None:
+            args.extend(["--signal", signal])
+        args.extend(container_ids)
+        return tuple(args)
+
+    def build_remove_command(
+        self, *container_ids: str, log_level: typing.Optional[str] = None
+    ) -> typing.Tuple[str, ...]:
+        return (*self._make_base_args(log_level), "rm", "--force", *container_ids)
+
+    def build_update_command(
+        self,
+        container_id: str,
+        cpuset_cpus: typing.Optional[str] = None,
+        cpuset_mems: typing.Optional[str] = None,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, ...]:
+        args = self._make_base_args(log_level)
+        args.append("update")
+        if cpuset_cpus is not None:
+            args.extend(["--cpuset-cpus", cpuset_cpus])
+        if cpuset_mems is not None:
+            args.extend(["--cpuset-mems", cpuset_mems])
+        args.append(container_id)
+        return tuple(args)
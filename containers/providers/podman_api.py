@@ -0,0 +1,447 @@
+import asyncio
+import base64
+import collections
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import pathlib
+import typing
+import urllib.parse
+
+from ..data_types import ArchiveImageMount
+from ..data_types import BindMount
+from ..data_types import Container
+from ..data_types import ImageMount
+from ..data_types import Mount
+from ..data_types import ResourceLimits
+from ..data_types import VolumeMount
+from ..errors import PodmanAPIError
+from .base import ContainerProvider
+from .helpers import make_hook_annotations
+from .helpers import make_linux_resources
+from .helpers import make_rlimits
+from .helpers import parse_size
+
+DEFAULT_API_VERSION = "v4.0.0"
+# Network modes podman takes as namespace mode instead of a network name
+NETWORK_NS_MODES = frozenset(
+    ["none", "host", "bridge", "private", "slirp4netns", "pasta"]
+)
+RELABEL_OPTIONS = {"shared": "z", "private": "Z"}
+
+
+def default_socket_path() -> pathlib.Path:
+    if os.getuid() == 0:
+        return pathlib.Path("/run/podman/podman.sock")
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", f"/run/user/{os.getuid()}")
+    return pathlib.Path(runtime_dir) / "podman" / "podman.sock"
+
+
+@dataclasses.dataclass
+class APIResponse:
+    status: int
+    headers: typing.Dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body)
+
+    def iter_json(self) -> typing.Iterator[typing.Any]:
+        """Iterate over JSON objects of a streamed body, like the one of pulling"""
+        decoder = json.JSONDecoder()
+        text = self.body.decode(errors="replace")
+        index = 0
+        while True:
+            while index < len(text) and text[index].isspace():
+                index += 1
+            if index >= len(text):
+                return
+            item, index = decoder.raw_decode(text, index)
+            yield item
+
+    def raise_for_status(self):
+        if self.status < 400:
+            return
+        message = self.body.decode(errors="replace")
+        with contextlib.suppress(ValueError, AttributeError):
+            message = self.json().get("message", message)
+        raise PodmanAPIError(self.status, message)
+
+
+async def read_response_head(
+    reader: asyncio.StreamReader,
+) -> typing.Tuple[int, typing.Dict[str, str]]:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed before response")
+    _, status, *_ = status_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return int(status), headers
+
+
+async def read_response_body(
+    reader: asyncio.StreamReader,
+    status: int,
+    headers: typing.Dict[str, str],
+) -> typing.Tuple[bytes, bool]:
+    """Read the response body, returns the body and whether the connection can be
+    reused afterward
+    """
+    if status in (204, 304) or 100 <= status < 200:
+        return b"", True
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # Skip trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return b"".join(chunks), True
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"])), True
+    return await reader.read(), False
+
+
+class PodmanAPIClient:
+    """A minimal HTTP/1.1 client of the podman REST API over its Unix socket,
+    keeping a pool of keep-alive connections.
+    """
+
+    def __init__(
+        self,
+        socket_path: typing.Optional[pathlib.Path] = None,
+        api_version: str = DEFAULT_API_VERSION,
+        max_connections: int = 16,
+    ):
+        self.socket_path = socket_path or default_socket_path()
+        self.api_version = api_version
+        self.max_connections = max_connections
+        self.connections_opened = 0
+        self.logger = logging.getLogger(__name__)
+        self._idle: typing.Deque[
+            typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+        ] = collections.deque()
+        # Created lazily so that the semaphore is bound to the running loop
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+
+    def make_url(
+        self, path: str, params: typing.Optional[typing.Dict[str, typing.Any]] = None
+    ) -> str:
+        url = f"/{self.api_version}/libpod{path}"
+        if params:
+            query = {
+                key: (str(value).lower() if isinstance(value, bool) else str(value))
+                for key, value in params.items()
+                if value is not None
+            }
+            url += "?" + urllib.parse.urlencode(query)
+        return url
+
+    async def _open(self) -> typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        self.connections_opened += 1
+        return await asyncio.open_unix_connection(str(self.socket_path))
+
+    @staticmethod
+    def _write_request(
+        writer: asyncio.StreamWriter,
+        method: str,
+        url: str,
+        body: typing.Optional[bytes] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ):
+        lines = [f"{method} {url} HTTP/1.1", "Host: d"]
+        for key, value in (headers or {}).items():
+            lines.append(f"{key}: {value}")
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines.append(f"Content-Length: {len(body or b'')}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body:
+            writer.write(body)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        json_body: typing.Any = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> APIResponse:
+        url = self.make_url(path, params)
+        body = None if json_body is None else json.dumps(json_body).encode()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            while True:
+                reused = bool(self._idle)
+                if reused:
+                    reader, writer = self._idle.pop()
+                else:
+                    reader, writer = await self._open()
+                try:
+                    self._write_request(writer, method, url, body, headers)
+                    await writer.drain()
+                    status, response_headers = await read_response_head(reader)
+                    response_body, reusable = await read_response_body(
+                        reader, status, response_headers
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # The server might close an idle keep-alive connection
+                    # anytime, retry with a fresh one in that case
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+        response = APIResponse(
+            status=status, headers=response_headers, body=response_body
+        )
+        if reusable and response.keep_alive:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def hijack(
+        self,
+        method: str,
+        path: str,
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Make a request and take over the connection as a raw stream afterward,
+        like the one for attaching to a container
+        """
+        reader, writer = await self._open()
+        try:
+            self._write_request(
+                writer,
+                method,
+                self.make_url(path, params),
+                headers=dict(Connection="Upgrade", Upgrade="tcp"),
+            )
+            await writer.drain()
+            status, headers = await read_response_head(reader)
+            if status >= 400:
+                body, _ = await read_response_body(reader, status, headers)
+                APIResponse(
+                    status=status, headers=headers, body=body
+                ).raise_for_status()
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+
+class PodmanAPI(ContainerProvider):
+    """Provider talks to the podman (libpod) REST API instead of running the podman
+    CLI, to be used with `APIContainersService`
+    """
+
+    def __init__(self, client: typing.Optional[PodmanAPIClient] = None):
+        self.client = client or PodmanAPIClient()
+
+    def make_mount_spec(self, mount: Mount) -> typing.Tuple[str, typing.Dict]:
+        if isinstance(mount, ImageMount):
+            return "image_volumes", {
+                "Source": str(mount.source),
+                "Destination": str(mount.target),
+                "ReadWrite": mount.read_write,
+            }
+        elif isinstance(mount, BindMount):
+            options = ["ro" if mount.readonly else "rw"]
+            if mount.chown:
+                options.append("U")
+            if mount.relabel is not None:
+                options.append(RELABEL_OPTIONS.get(mount.relabel, mount.relabel))
+            if mount.bind_propagation is not None:
+                options.append(mount.bind_propagation)
+            return "mounts", {
+                "type": "bind",
+                "source": str(mount.source),
+                "destination": str(mount.target),
+                "options": options,
+            }
+        elif isinstance(mount, VolumeMount):
+            options = []
+            if mount.readonly:
+                options.append("ro")
+            if mount.chown:
+                options.append("U")
+            return "volumes", {
+                "Name": "",
+                "Dest": str(mount.target),
+                "Options": options,
+            }
+        else:
+            raise ValueError("Unknown mount type %s", mount.__class__)
+
+    def make_resource_spec(
+        self, resources: ResourceLimits
+    ) -> typing.Dict[str, typing.Any]:
+        """Map the resource limits to the runtime-spec LinuxResources and rlimits"""
+        spec: typing.Dict[str, typing.Any] = {}
+        limits = make_linux_resources(resources)
+        if limits:
+            spec["resource_limits"] = limits
+        r_limits = make_rlimits(resources)
+        if r_limits:
+            spec["r_limits"] = r_limits
+        return spec
+
+    def make_spec(self, container: Container) -> typing.Dict[str, typing.Any]:
+        """Map the container to the SpecGenerator JSON of the libpod create API"""
+        spec: typing.Dict[str, typing.Any] = {
+            "image": container.image,
+            "command": list(container.command),
+            "env": dict(container.environ),
+            "stdin": container.interactive,
+            "terminal": container.tty,
+            "remove": container.remove,
+        }
+        if container.name is not None:
+            spec["name"] = container.name
+        if container.timeout is not None:
+            spec["timeout"] = container.timeout
+        if container.user is not None:
+            user_group = str(container.user)
+            if container.group is not None:
+                user_group += f":{container.group}"
+            spec["user"] = user_group
+        if container.work_dir is not None:
+            spec["work_dir"] = str(container.work_dir)
+        if container.network is not None:
+            if container.network in NETWORK_NS_MODES:
+                spec["netns"] = {"nsmode": container.network}
+            else:
+                spec["netns"] = {"nsmode": "bridge"}
+                spec["Networks"] = {container.network: {}}
+        if container.shm_size is not None:
+            spec["shm_size"] = parse_size(container.shm_size)
+        if container.resources is not None:
+            spec.update(self.make_resource_spec(container.resources))
+        if container.security_options is not None:
+            if container.security_options.no_new_privileges:
+                spec["no_new_privileges"] = True
+            if container.security_options.seccomp is not None:
+                spec["seccomp_profile_path"] = str(container.security_options.seccomp)
+        for i, mount in enumerate(container.mounts):
+            key, mount_spec = self.make_mount_spec(mount)
+            spec.setdefault(key, []).append(mount_spec)
+            if isinstance(mount, ArchiveImageMount):
+                spec.setdefault("annotations", {}).update(
+                    make_hook_annotations(mount, name=f"mount-{i}")
+                )
+        return spec
+
+    async def inspect_image(self, image: str) -> typing.Optional[typing.Dict]:
+        response = await self.client.request(
+            "GET", f"/images/{urllib.parse.quote(image, safe='')}/json"
+        )
+        if response.status == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def pull_image(
+        self,
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ):
+        headers = {}
+        if credentials is not None:
+            username, password = credentials
+            auth = json.dumps(dict(username=username, password=password))
+            headers["X-Registry-Auth"] = base64.urlsafe_b64encode(
+                auth.encode()
+            ).decode()
+        response = await self.client.request(
+            "POST",
+            "/images/pull",
+            params=dict(reference=image, quiet=True),
+            headers=headers,
+        )
+        response.raise_for_status()
+        # Errors happen after the streaming started are reported in the body
+        for item in response.iter_json():
+            if isinstance(item, dict) and item.get("error"):
+                raise PodmanAPIError(response.status, item["error"])
+
+    async def create_container(
+        self,
+        container: Container,
+        spec: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> str:
+        """Create the container, from its `spec` if it's made already"""
+        if spec is None:
+            spec = self.make_spec(container)
+        response = await self.client.request(
+            "POST", "/containers/create", json_body=spec
+        )
+        response.raise_for_status()
+        return response.json()["Id"]
+
+    async def attach_container(
+        self, container_id: str, stdin: bool = False
+    ) -> typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await self.client.hijack(
+            "POST",
+            f"/containers/{container_id}/attach",
+            params=dict(stream=True, stdout=True, stderr=True, stdin=stdin),
+        )
+
+    async def start_container(self, container_id: str):
+        response = await self.client.request(
+            "POST", f"/containers/{container_id}/start"
+        )
+        response.raise_for_status()
+
+    async def wait_container(self, container_id: str) -> int:
+        response = await self.client.request(
+            "POST",
+            f"/containers/{container_id}/wait",
+            params=dict(condition="exited"),
+        )
+        response.raise_for_status()
+        return int(response.json())
+
+    async def kill_container(self, container_id: str, signal: str = "SIGKILL"):
+        response = await self.client.request(
+            "POST", f"/containers/{container_id}/kill", params=dict(signal=signal)
+        )
+        # Conflict means the container is not running anymore
+        if response.status not in (404, 409):
+            response.raise_for_status()
+
+    async def remove_container(self, container_id: str, force: bool = True):
+        response = await self.client.request(
+            "DELETE", f"/containers/{container_id}", params=dict(force=force)
+        )
+        if response.status != 404:
+            response.raise_for_status()
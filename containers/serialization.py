@@ -0,0 +1,233 @@
+"""Serialize container specs to JSON or a compact binary form.
+
+The binary form is msgpack if the optional msgpack package is installed, or UTF-8
+encoded JSON otherwise, which can still be loaded once msgpack is installed. Both
+come with a schema version, and each mount carries its type as a
+discriminator. Fields with default values are omitted.
+"""
+import dataclasses
+import json
+import typing
+
+from .data_types import ArchiveImageMount
+from .data_types import BindMount
+from .data_types import Container
+from .data_types import ImageMount
+from .data_types import Mount
+from .data_types import PathType
+from .data_types import ResourceLimits
+from .data_types import SecurityOptions
+from .data_types import VolumeMount
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SCHEMA_VERSION = 1
+MOUNT_TYPE_KEY = "type"
+
+T = typing.TypeVar("T")
+Encoder = typing.Callable[[typing.Any], typing.Any]
+Decoder = typing.Callable[[typing.Any], typing.Any]
+
+MISSING = dataclasses.MISSING
+PATH_TYPES = (PathType, typing.Optional[PathType])
+
+
+def _encode_path(value: typing.Optional[PathType]) -> typing.Optional[str]:
+    return None if value is None else str(value)
+
+
+class Codec(typing.Generic[T]):
+    """Convert a dataclass from and to a dict of plain values, the fields and their
+    converters are worked out once so that converting many objects is fast
+    """
+
+    def __init__(
+        self,
+        cls: typing.Type[T],
+        tag: typing.Optional[str] = None,
+        encoders: typing.Optional[typing.Dict[str, Encoder]] = None,
+        decoders: typing.Optional[typing.Dict[str, Decoder]] = None,
+    ):
+        self.cls = cls
+        self.tag = tag
+        encoders = encoders or {}
+        decoders = decoders or {}
+        self.fields: typing.List[
+            typing.Tuple[
+                str, typing.Any, typing.Optional[Encoder], typing.Optional[Decoder]
+            ]
+        ] = []
+        for field in dataclasses.fields(cls):
+            if field.default is not MISSING:
+                default = field.default
+            elif field.default_factory is not MISSING:
+                default = field.default_factory()
+            else:
+                default = MISSING
+            encoder = encoders.get(field.name)
+            if encoder is None and field.type in PATH_TYPES:
+                encoder = _encode_path
+            self.fields.append((field.name, default, encoder, decoders.get(field.name)))
+
+    def encode(self, obj: T) -> typing.Dict[str, typing.Any]:
+        data = {} if self.tag is None else {MOUNT_TYPE_KEY: self.tag}
+        for name, default, encoder, _ in self.fields:
+            value = getattr(obj, name)
+            if default is not MISSING and value == default:
+                continue
+            data[name] = value if encoder is None else encoder(value)
+        return data
+
+    def decode(self, data: typing.Dict[str, typing.Any]) -> T:
+        kwargs = {}
+        for name, _, _, decoder in self.fields:
+            if name not in data:
+                continue
+            value = data[name]
+            kwargs[name] = value if decoder is None or value is None else decoder(value)
+        try:
+            return self.cls(**kwargs)
+        except TypeError as exc:
+            raise ValueError(f"Invalid {self.cls.__name__} data: {exc}") from exc
+
+
+_mount_codecs: typing.Dict[typing.Type[Mount], Codec] = {}
+_mount_codecs_by_tag: typing.Dict[str, Codec] = {}
+
+
+def register_mount_type(tag: str, cls: typing.Type[Mount]):
+    """Register a mount class with its discriminator, for custom mount types"""
+    codec = Codec(cls, tag=tag)
+    _mount_codecs[cls] = codec
+    _mount_codecs_by_tag[tag] = codec
+
+
+register_mount_type("bind", BindMount)
+register_mount_type("volume", VolumeMount)
+register_mount_type("image", ImageMount)
+register_mount_type("archive-image", ArchiveImageMount)
+
+
+def encode_mount(mount: Mount) -> typing.Dict[str, typing.Any]:
+    codec = _mount_codecs.get(type(mount))
+    if codec is None:
+        raise ValueError(f"Unknown mount type {type(mount)}")
+    return codec.encode(mount)
+
+
+def decode_mount(data: typing.Dict[str, typing.Any]) -> Mount:
+    codec = _mount_codecs_by_tag.get(data.get(MOUNT_TYPE_KEY))
+    if codec is None:
+        raise ValueError(f"Unknown mount type {data.get(MOUNT_TYPE_KEY)!r}")
+    return codec.decode(data)
+
+
+SECURITY_OPTIONS_CODEC = Codec(SecurityOptions)
+RESOURCE_LIMITS_CODEC = Codec(
+    ResourceLimits,
+    encoders=dict(
+        ulimits=lambda ulimits: {
+            name: value if isinstance(value, int) else list(value)
+            for name, value in ulimits.items()
+        }
+    ),
+    decoders=dict(
+        ulimits=lambda ulimits: {
+            name: value if isinstance(value, int) else tuple(value)
+            for name, value in ulimits.items()
+        }
+    ),
+)
+CONTAINER_CODEC = Codec(
+    Container,
+    encoders=dict(
+        command=list,
+        mounts=lambda mounts: [encode_mount(mount) for mount in mounts],
+        security_options=lambda value: (
+            None if value is None else SECURITY_OPTIONS_CODEC.encode(value)
+        ),
+        resources=lambda value: (
+            None if value is None else RESOURCE_LIMITS_CODEC.encode(value)
+        ),
+    ),
+    decoders=dict(
+        command=tuple,
+        mounts=lambda mounts: [decode_mount(mount) for mount in mounts],
+        security_options=SECURITY_OPTIONS_CODEC.decode,
+        resources=RESOURCE_LIMITS_CODEC.decode,
+    ),
+)
+
+
+def to_dict(container: Container) -> typing.Dict[str, typing.Any]:
+    return CONTAINER_CODEC.encode(container)
+
+
+def from_dict(data: typing.Dict[str, typing.Any]) -> Container:
+    return CONTAINER_CODEC.decode(data)
+
+
+def to_document(containers: typing.Sequence[Container]) -> typing.Dict[str, typing.Any]:
+    encode = CONTAINER_CODEC.encode
+    return dict(version=SCHEMA_VERSION, containers=[encode(c) for c in containers])
+
+
+def from_document(document: typing.Any) -> typing.List[Container]:
+    """Decode a document already parsed from JSON, msgpack or YAML"""
+    if not isinstance(document, dict) or "version" not in document:
+        raise ValueError("Expected a document with a schema version")
+    version = document["version"]
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise ValueError(f"Invalid schema version {version!r}, expected an integer")
+    if version > SCHEMA_VERSION:
+        raise ValueError(
+            f"Unsupported schema version {version}, up to {SCHEMA_VERSION} is supported"
+        )
+    containers = document.get("containers")
+    if not isinstance(containers, list):
+        raise ValueError("Expected a document with a list of containers")
+    decode = CONTAINER_CODEC.decode
+    return [decode(data) for data in containers]
+
+
+def dumps_json_many(containers: typing.Sequence[Container]) -> str:
+    return json.dumps(to_document(containers), separators=(",", ":"))
+
+
+def loads_json_many(data: typing.Union[str, bytes]) -> typing.List[Container]:
+    return from_document(json.loads(data))
+
+
+def dumps_json(container: Container) -> str:
+    return dumps_json_many([container])
+
+
+def loads_json(data: typing.Union[str, bytes]) -> Container:
+    (container,) = loads_json_many(data)
+    return container
+
+
+def dumps_binary_many(containers: typing.Sequence[Container]) -> bytes:
+    document = to_document(containers)
+    if msgpack is not None:
+        return msgpack.packb(document, use_bin_type=True)
+    return json.dumps(document, separators=(",", ":")).encode()
+
+
+def loads_binary_many(data: bytes) -> typing.List[Container]:
+    # A msgpack document is a map, so it never starts like a JSON object
+    if msgpack is not None and data[:1] != b"{":
+        return from_document(msgpack.unpackb(data, raw=False))
+    return from_document(json.loads(data))
+
+
+def dumps_binary(container: Container) -> bytes:
+    return dumps_binary_many([container])
+
+
+def loads_binary(data: bytes) -> Container:
+    (container,) = loads_binary_many(data)
+    return container
@@ -0,0 +1,281 @@
+import asyncio.subprocess
+import codecs
+import contextlib
+import struct
+import sys
+import time
+import typing
+
+from ..data_types import Container
+from ..errors import LoadImageError
+from ..errors import PodmanAPIError
+from ..providers.podman_api import PodmanAPI
+from .base import ContainersService
+from .base import DEFAULT_LIMIT
+from .instrumentation import BUILD_COMMAND
+from .instrumentation import emit
+
+STDOUT_STREAM = 1
+STDERR_STREAM = 2
+
+
+class APIStdin:
+    """Mimic the stdin writer of a subprocess, writing into the attach connection"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+
+    def write(self, data: bytes):
+        self._writer.write(data)
+
+    async def drain(self):
+        await self._writer.drain()
+
+    def close(self):
+        if self._writer.can_write_eof():
+            self._writer.write_eof()
+
+    def is_closing(self) -> bool:
+        return self._writer.is_closing()
+
+
+class APIContainerProcess:
+    """Mimic `asyncio.subprocess.Process` for a container runs via the REST API"""
+
+    def __init__(
+        self,
+        provider: PodmanAPI,
+        container_id: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        stdin: typing.Optional[int],
+        stdout: typing.Optional[int],
+        stderr: typing.Optional[int],
+        tty: bool,
+        limit: int,
+    ):
+        self.provider = provider
+        self.container_id = container_id
+        self.pid = None
+        self.returncode: typing.Optional[int] = None
+        self.stdin = APIStdin(writer) if stdin == asyncio.subprocess.PIPE else None
+        self.stdout = self._make_reader(stdout, limit)
+        self.stderr = self._make_reader(stderr, limit)
+        self._sinks = {
+            STDOUT_STREAM: self._make_sink(self.stdout, stdout, sys.stdout),
+            STDERR_STREAM: self._make_sink(self.stderr, stderr, sys.stderr),
+        }
+        self._reader = reader
+        self._writer = writer
+        self._tty = tty
+        self._output_task = asyncio.ensure_future(self._read_output())
+        self._wait_task: typing.Optional[asyncio.Future] = None
+
+    @staticmethod
+    def _make_reader(
+        option: typing.Optional[int], limit: int
+    ) -> typing.Optional[asyncio.StreamReader]:
+        if option != asyncio.subprocess.PIPE:
+            return None
+        return asyncio.StreamReader(limit=limit)
+
+    @staticmethod
+    def _make_sink(
+        stream_reader: typing.Optional[asyncio.StreamReader],
+        option: typing.Optional[int],
+        inherited: typing.TextIO,
+    ) -> typing.Optional[typing.Callable[[bytes], None]]:
+        if stream_reader is not None:
+            return stream_reader.feed_data
+        if option is None:
+            # Like a subprocess inherits the stdout / stderr of the parent
+            buffer = getattr(inherited, "buffer", None)
+            if buffer is not None:
+
+                def write(data: bytes):
+                    buffer.write(data)
+                    buffer.flush()
+
+                return write
+            # Replaced by a text only stream, like io.StringIO, the output is
+            # decoded incrementally as a character can be split across chunks
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+            def write_text(data: bytes):
+                inherited.write(decoder.decode(data))
+                inherited.flush()
+
+            return write_text
+        return None
+
+    def _dispatch(self, stream: int, data: bytes):
+        sink = self._sinks.get(stream)
+        if sink is not None:
+            sink(data)
+
+    async def _read_output(self):
+        try:
+            if self._tty:
+                while True:
+                    data = await self._reader.read(2**16)
+                    if not data:
+                        break
+                    self._dispatch(STDOUT_STREAM, data)
+                return
+            # Multiplexed stream, each frame comes with 8 bytes header, the first
+            # byte is stream type and the last 4 bytes is the payload size
+            while True:
+                try:
+                    header = await self._reader.readexactly(8)
+                except asyncio.IncompleteReadError:
+                    break
+                stream, size = struct.unpack(">BxxxL", header)
+                data = await self._reader.readexactly(size)
+                self._dispatch(stream, data)
+        finally:
+            for stream_reader in (self.stdout, self.stderr):
+                if stream_reader is not None:
+                    stream_reader.feed_eof()
+
+    async def wait(self) -> int:
+        if self._wait_task is None:
+            self._wait_task = asyncio.ensure_future(
+                self.provider.wait_container(self.container_id)
+            )
+        self.returncode = await asyncio.shield(self._wait_task)
+        return self.returncode
+
+    async def close(self):
+        self._output_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, ConnectionError):
+            await self._output_task
+        self._writer.close()
+        if self._wait_task is not None and not self._wait_task.done():
+            self._wait_task.cancel()
+
+
+class APIContainersService(ContainersService):
+    """Containers service uses the podman REST API over its Unix socket instead of
+    spawning a podman CLI process for each operation
+    """
+
+    provider: PodmanAPI
+
+    def __init__(self, provider: typing.Optional[PodmanAPI] = None, **kwargs):
+        super().__init__(provider or PodmanAPI(), **kwargs)
+
+    async def _inspect_image(
+        self, image: str
+    ) -> typing.Tuple[bool, typing.Optional[str]]:
+        info = await self.provider.inspect_image(image)
+        if info is None:
+            return False, None
+        return True, info.get("Digest") or None
+
+    async def _inspect_images(
+        self, images: typing.Sequence[str]
+    ) -> typing.Tuple[typing.Dict[str, typing.Optional[str]], bool]:
+        # There's no round trip of process spawning to save, just do it one by one
+        results = await asyncio.gather(*map(self._inspect_image, images))
+        found = {
+            image: digest for image, (found, digest) in zip(images, results) if found
+        }
+        return found, True
+
+    async def _pull_image(
+        self,
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ):
+        self.logger.debug("Pulling image %s via API", image)
+        try:
+            await self.provider.pull_image(image, credentials=credentials)
+        except PodmanAPIError as exc:
+            self.logger.error(
+                "Failed to load image %s with status=%s, error=%s",
+                image,
+                exc.status,
+                exc.message,
+            )
+            raise LoadImageError(image, exc.status, exc.message) from exc
+
+    async def _terminate_container(
+        self,
+        proc: APIContainerProcess,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        await self.provider.kill_container(proc.container_id, signal="SIGTERM")
+
+    async def _kill_container(
+        self,
+        proc: APIContainerProcess,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        await self.provider.kill_container(proc.container_id, signal="SIGKILL")
+
+    async def _force_remove_container(
+        self,
+        proc: APIContainerProcess,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        await self.provider.remove_container(proc.container_id, force=True)
+
+    @contextlib.asynccontextmanager
+    async def _run(
+        self,
+        container: Container,
+        stdin: typing.Optional[int] = None,
+        stdout: typing.Optional[int] = None,
+        stderr: typing.Optional[int] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.AsyncContextManager[APIContainerProcess]:
+        if runtime_env is not None:
+            self.logger.warning(
+                "runtime_env is not supported by the API service, ignored"
+            )
+        instruments = self.instruments
+        if instruments:
+            begin = time.perf_counter()
+        spec = self.provider.make_spec(container)
+        if instruments:
+            emit(instruments, BUILD_COMMAND, begin, image=container.image)
+
+        async def launch() -> APIContainerProcess:
+            container_id = await self.provider.create_container(container, spec=spec)
+            self.logger.info("Run container %s via API", container_id)
+            try:
+                reader, writer = await self.provider.attach_container(
+                    container_id, stdin=stdin == asyncio.subprocess.PIPE
+                )
+            except BaseException:
+                await self.provider.remove_container(container_id)
+                raise
+            proc = APIContainerProcess(
+                provider=self.provider,
+                container_id=container_id,
+                reader=reader,
+                writer=writer,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                tty=container.tty,
+                limit=limit,
+            )
+            try:
+                await self.provider.start_container(container_id)
+            except BaseException:
+                await proc.close()
+                await self.provider.remove_container(container_id)
+                raise
+            return proc
+
+        async with self._track_process(container.image, launch) as proc:
+            try:
+                yield proc
+            finally:
+                await proc.close()
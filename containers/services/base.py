@@ -1,11 +1,43 @@
 import asyncio.subprocess
 import contextlib
+import dataclasses
+import json
 import logging
+import pathlib
 import shlex
+import signal
+import time
 import typing
+import uuid
 
+from .batch import LoadImageResult
+from .batch import LoadImagesReport
+from .batch import LoadImageStatus
+from .batch import normalize_image_reference
+from .collect import OutputCollector
+from .collect import RunResult
+from .events import DetachedContainer
+from .events import EventsWatcher
+from .image_cache import ImageCache
+from .image_sources import ImageSource
+from .instrumentation import BUILD_COMMAND
+from .instrumentation import emit
+from .instrumentation import FIRST_BYTE
+from .instrumentation import HistogramCollector
+from .instrumentation import INSPECT_IMAGE
+from .instrumentation import Instrument
+from .instrumentation import PULL_IMAGE
+from .instrumentation import QUEUE
+from .instrumentation import RUN
+from .instrumentation import SPAWN
+from .placement import PlacementManager
+from .scheduler import LaunchScheduler
+from .streaming import OutputStream
+from .streaming import Sink
+from .termination import TerminationPolicy
 from containers import Container
 from containers import ContainerProvider
+from containers import ContainerRunError
 from containers import LoadImageError
 from containers import Podman
 
@@ -18,34 +50,72 @@ class ContainersService:
     def __init__(
         self,
         provider: typing.Optional[ContainerProvider] = None,
+        image_cache: typing.Optional[ImageCache] = None,
+        max_concurrent_pulls: typing.Optional[int] = None,
+        instruments: typing.Sequence[Instrument] = (),
+        collect_timings: bool = False,
+        scheduler: typing.Optional[LaunchScheduler] = None,
+        termination: typing.Optional[TerminationPolicy] = None,
+        placement: typing.Optional[PlacementManager] = None,
+        events: typing.Optional[EventsWatcher] = None,
+        image_sources: typing.Sequence[ImageSource] = (),
     ):
         self.provider = provider or Podman()
+        self.scheduler = scheduler
+        self.termination = termination
+        self.placement = placement
+        # Created on the first detached run if not provided, and then closed with
+        # the service
+        self.events = events
+        self._owns_events = events is None
+        self.instruments: typing.List[Instrument] = list(instruments)
+        # Built-in in-memory histograms of timing events, if enabled
+        self.timings: typing.Optional[HistogramCollector] = None
+        if collect_timings:
+            self.timings = HistogramCollector()
+            self.instruments.append(self.timings)
+        self.image_cache = image_cache if image_cache is not None else ImageCache()
+        # Tried in order before pulling from the registry
+        self.image_sources: typing.List[ImageSource] = list(image_sources)
+        self.max_concurrent_pulls = max_concurrent_pulls
+        # Created lazily so that the semaphore is bound to the running loop
+        self._pull_semaphore: typing.Optional[asyncio.Semaphore] = None
+        self._loading_images: typing.Dict[
+            typing.Tuple[str, bool, typing.Optional[typing.Tuple[str, str]]],
+            asyncio.Future,
+        ] = {}
+        # Background tasks storing pulled images into the image sources
+        self._store_tasks: typing.Set[asyncio.Task] = set()
         self.logger = logging.getLogger(__name__)
 
-    async def load_image(
+    async def _inspect_image(
+        self, image: str
+    ) -> typing.Tuple[bool, typing.Optional[str]]:
+        command = (
+            str(self.provider.executable),
+            "image",
+            "inspect",
+            "--format",
+            "{{.Digest}}",
+            image,
+        )
+        self.logger.debug("Running image inspect command %s", " ".join(command))
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+        if proc.returncode != 0:
+            return False, None
+        digest = stdout.decode(errors="replace").strip()
+        return True, digest or None
+
+    async def _pull_image(
         self,
         image: str,
-        always_pull: bool = False,
         credentials: typing.Optional[typing.Tuple[str, str]] = None,
     ):
-        # TODO: abstract this to provider instead
-        if not always_pull:
-            command = (
-                str(self.provider.executable),
-                "image",
-                "inspect",
-                image,
-            )
-            self.logger.debug("Running image inspect command %s", " ".join(command))
-            proc = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.DEVNULL,
-            )
-            code = await proc.wait()
-            if code == 0:
-                return
-            self.logger.debug("Image %s not found, pulling now ...", image)
         command = (
             str(self.provider.executable),
             "pull",
@@ -83,7 +153,295 @@ class ContainersService:
                 stderr_content,
             )
             raise LoadImageError(image, code, stderr_text)
+
+    @contextlib.asynccontextmanager
+    async def _pull_slot(self) -> typing.AsyncContextManager[None]:
+        if self.max_concurrent_pulls is None:
+            yield
+            return
+        if self._pull_semaphore is None:
+            self._pull_semaphore = asyncio.Semaphore(self.max_concurrent_pulls)
+        async with self._pull_semaphore:
+            yield
+
+    async def _load_image(
+        self,
+        image: str,
+        always_pull: bool,
+        credentials: typing.Optional[typing.Tuple[str, str]],
+    ) -> bool:
+        # TODO: abstract this to provider instead
+        if not always_pull:
+            instruments = self.instruments
+            if instruments:
+                begin = time.perf_counter()
+            found, digest = await self._inspect_image(image)
+            if instruments:
+                emit(instruments, INSPECT_IMAGE, begin, image=image, found=found)
+            if found:
+                self.image_cache.add(image, digest=digest)
+                return False
+            self.logger.debug("Image %s not found, pulling now ...", image)
+        return await self._fetch_image(
+            image, always_pull=always_pull, credentials=credentials
+        )
+
+    async def _fetch_image(
+        self,
+        image: str,
+        always_pull: bool,
+        credentials: typing.Optional[typing.Tuple[str, str]],
+    ) -> bool:
+        """Load the image from the sources or the registry, without checking if
+        it's present first
+        """
+        instruments = self.instruments
+        self.image_cache.invalidate(image)
+        async with self._pull_slot():
+            if not always_pull and await self._load_from_sources(
+                image, credentials=credentials
+            ):
+                self.image_cache.add(image)
+                return True
+            if instruments:
+                begin = time.perf_counter()
+            await self._pull_image(image, credentials=credentials)
+            if instruments:
+                emit(instruments, PULL_IMAGE, begin, image=image, source="registry")
+        self.image_cache.add(image)
         self.logger.info("Image %s loaded", image)
+        if self.image_sources:
+            # Not waited, the image can be used while it's being saved
+            task = asyncio.ensure_future(self._store_image(image))
+            self._store_tasks.add(task)
+            task.add_done_callback(self._store_tasks.discard)
+        return True
+
+    async def _store_image(self, image: str):
+        for source in self.image_sources:
+            try:
+                await source.store(self, image)
+            except Exception:
+                self.logger.warning(
+                    "Failed to store image %s into %s", image, source, exc_info=True
+                )
+
+    async def wait_image_stores(self):
+        """Wait until the images pulled from the registry so far are stored into
+        the image sources, which happens in the background
+        """
+        while True:
+            tasks = [task for task in self._store_tasks if not task.done()]
+            if not tasks:
+                return
+            await asyncio.wait(tasks)
+
+    async def _load_from_sources(
+        self,
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ) -> bool:
+        for source in self.image_sources:
+            if self.instruments:
+                begin = time.perf_counter()
+            try:
+                loaded = await source.load(self, image, credentials=credentials)
+            except Exception:
+                self.logger.warning(
+                    "Failed to load image %s from %s", image, source, exc_info=True
+                )
+                continue
+            if loaded:
+                if self.instruments:
+                    emit(
+                        self.instruments,
+                        PULL_IMAGE,
+                        begin,
+                        image=image,
+                        source=source.__class__.__name__,
+                    )
+                self.logger.info("Image %s loaded from %s", image, source)
+                return True
+        return False
+
+    async def load_image(
+        self,
+        image: str,
+        always_pull: bool = False,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ) -> bool:
+        """Make sure the image is present locally, returns True if it was pulled"""
+        if not always_pull and image in self.image_cache:
+            self.logger.debug("Image %s found in image cache", image)
+            return False
+        return await self._share_loading(
+            image,
+            always_pull,
+            credentials,
+            lambda: self._load_image(
+                image, always_pull=always_pull, credentials=credentials
+            ),
+        )
+
+    async def _share_loading(
+        self,
+        image: str,
+        always_pull: bool,
+        credentials: typing.Optional[typing.Tuple[str, str]],
+        factory: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        # Concurrent calls for the same image share a single in-flight
+        # inspect / pull, all the waiters get the same result or error. Calls
+        # with other credentials don't, as they could get another auth result
+        key = (image, always_pull, credentials)
+        future = self._loading_images.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._loading_images[key] = future
+
+            def _done(done_future: asyncio.Future):
+                if self._loading_images.get(key) is done_future:
+                    del self._loading_images[key]
+                # Mark the exception as retrieved in case all waiters are gone
+                if not done_future.cancelled():
+                    done_future.exception()
+
+            future.add_done_callback(_done)
+        else:
+            self.logger.debug("Waiting for in-flight loading of image %s", image)
+        return await asyncio.shield(future)
+
+    async def _inspect_images(
+        self, images: typing.Sequence[str]
+    ) -> typing.Tuple[typing.Dict[str, typing.Optional[str]], bool]:
+        """Inspect many images with a single command, returns the digests of the
+        images found present keyed by the requested reference, and whether the
+        other images are known to be missing. They may not be if a present image
+        couldn't be matched back to its reference, like a short name resolved to
+        another registry or an image ID.
+        """
+        if not images:
+            return {}, True
+        command = (
+            str(self.provider.executable),
+            "image",
+            "inspect",
+            "--format",
+            "json",
+            *images,
+        )
+        self.logger.debug("Running image inspect command %s", " ".join(command))
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+        try:
+            items = json.loads(stdout or b"[]")
+        except ValueError:
+            self.logger.warning("Unable to parse image inspect output %r", stdout)
+            return {}, False
+        # Missing images make the command fail, but the present ones are still
+        # reported, so we match them back to the requested references by name
+        requested: typing.Dict[str, typing.List[str]] = {}
+        for image in images:
+            requested.setdefault(normalize_image_reference(image), []).append(image)
+        found = {}
+        complete = True
+        for item in items or []:
+            digest = item.get("Digest") or None
+            matched = False
+            for name in (
+                *(item.get("RepoTags") or ()),
+                *(item.get("RepoDigests") or ()),
+            ):
+                for image in requested.get(normalize_image_reference(name), ()):
+                    found[image] = digest
+                    matched = True
+            complete = complete and matched
+        return found, complete
+
+    async def load_images(
+        self,
+        images: typing.Iterable[str],
+        concurrency: int = 4,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ) -> LoadImagesReport:
+        """Make sure all the given images are present, pulling the missing ones
+        concurrently. Failures are collected in the returned report instead of
+        being raised, call `raise_for_errors` on it to raise them.
+        """
+        begin = time.monotonic()
+        images = list(dict.fromkeys(images))
+        results: typing.Dict[str, LoadImageResult] = {}
+        to_inspect = []
+        for image in images:
+            if image in self.image_cache:
+                results[image] = LoadImageResult(
+                    image=image, status=LoadImageStatus.CACHED, elapsed=0.0
+                )
+            else:
+                to_inspect.append(image)
+        found, complete = await self._inspect_images(to_inspect)
+        inspect_elapsed = time.monotonic() - begin
+        for image, digest in found.items():
+            self.image_cache.add(image, digest=digest)
+            results[image] = LoadImageResult(
+                image=image, status=LoadImageStatus.PRESENT, elapsed=inspect_elapsed
+            )
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _load(image: str) -> LoadImageResult:
+            async with semaphore:
+                load_begin = time.monotonic()
+                try:
+                    if complete:
+                        # Known missing from the batched inspect, no need to
+                        # inspect it again, unless it joins an in-flight
+                        # load_image call
+                        pulled = await self._share_loading(
+                            image,
+                            False,
+                            credentials,
+                            lambda: self._fetch_image(
+                                image, always_pull=False, credentials=credentials
+                            ),
+                        )
+                    else:
+                        # Maybe one of the present images that couldn't be
+                        # matched by name, inspected on its own before pulling
+                        pulled = await self.load_image(image, credentials=credentials)
+                except LoadImageError as exc:
+                    return LoadImageResult(
+                        image=image,
+                        status=LoadImageStatus.FAILED,
+                        elapsed=time.monotonic() - load_begin,
+                        error=exc,
+                    )
+                return LoadImageResult(
+                    image=image,
+                    status=(
+                        LoadImageStatus.PULLED if pulled else LoadImageStatus.PRESENT
+                    ),
+                    elapsed=time.monotonic() - load_begin,
+                )
+
+        missing = [image for image in images if image not in results]
+        for result in await asyncio.gather(*map(_load, missing)):
+            results[result.image] = result
+        report = LoadImagesReport(
+            results=[results[image] for image in images],
+            elapsed=time.monotonic() - begin,
+        )
+        self.logger.info(
+            "Loaded %s images in %.3fs with %s failures",
+            len(images),
+            report.elapsed,
+            len(report.failures),
+        )
+        return report
 
     @contextlib.asynccontextmanager
     async def run(
@@ -95,19 +453,481 @@ class ContainersService:
         runtime_env: typing.Optional[dict] = None,
         limit: int = DEFAULT_LIMIT,
         log_level: typing.Optional[str] = None,
+        priority: int = 0,
     ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
-        command = self.provider.build_command(container, log_level=log_level)
+        async with (
+            self._launch_slot(container.image, priority=priority),
+            self._place(container) as container,
+        ):
+            if self.termination is not None and container.name is None:
+                # A name is needed to kill or remove the container
+                container = dataclasses.replace(
+                    container, name=f"container-helpers-{uuid.uuid4().hex}"
+                )
+            async with self._run(
+                container,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                runtime_env=runtime_env,
+                limit=limit,
+                log_level=log_level,
+            ) as proc:
+                if self.termination is None:
+                    yield proc
+                    return
+                async with self._enforce_termination(
+                    container, proc, log_level=log_level
+                ):
+                    yield proc
+
+    async def close(self):
+        """Stop the events watcher created for the detached runs, a watcher given
+        to the service is left to its owner
+        """
+        if self.events is not None and self._owns_events:
+            await self.events.close()
+            self.events = None
+
+    @contextlib.asynccontextmanager
+    async def run_detached(
+        self,
+        container: Container,
+        runtime_env: typing.Optional[dict] = None,
+        log_level: typing.Optional[str] = None,
+        priority: int = 0,
+    ) -> typing.AsyncContextManager[DetachedContainer]:
+        """Run the container in the background with `podman run --detach`, instead
+        of keeping an attached podman process around for its whole life, its exit
+        code is collected from the shared events watcher. The container is removed
+        if it's still running when the context exits.
+        """
+        if not isinstance(self.provider, Podman):
+            raise TypeError(
+                f"{type(self).__name__} doesn't support detached runs, it requires "
+                "the podman CLI provider"
+            )
+        if self.events is None:
+            self.events = EventsWatcher(self.provider)
+        # Must be following the events before the container could exit
+        await self.events.start()
+        async with (
+            self._launch_slot(container.image, priority=priority),
+            self._place(container) as container,
+        ):
+            instruments = self.instruments
+            if instruments:
+                begin = time.perf_counter()
+            container_id = await self._launch_detached(
+                container, runtime_env=runtime_env, log_level=log_level
+            )
+            if instruments:
+                emit(instruments, SPAWN, begin, image=container.image)
+            detached = DetachedContainer(
+                id=container_id, container=container, watcher=self.events
+            )
+            try:
+                yield detached
+            finally:
+                if not detached.done:
+                    self.logger.info(
+                        "Remove detached container %s still running", detached.id
+                    )
+                    await asyncio.shield(
+                        self._run_podman_command(
+                            self.provider.build_remove_command(
+                                detached.id, log_level=log_level
+                            )
+                        )
+                    )
+                if instruments:
+                    emit(
+                        instruments,
+                        RUN,
+                        begin,
+                        image=container.image,
+                        exit_code=detached.exit_code,
+                    )
+
+    async def _launch_detached(
+        self,
+        container: Container,
+        runtime_env: typing.Optional[dict] = None,
+        log_level: typing.Optional[str] = None,
+    ) -> str:
+        """Launch the container with `podman run --detach` and return its ID"""
+        command = self.provider.build_detached_command(container, log_level=log_level)
         self.logger.info(
-            "Run container with command: %s, runtime_env=%s",
+            "Run detached container with command: %s, runtime_env=%s",
             " ".join(map(shlex.quote, command)),
             runtime_env,
         )
         proc = await asyncio.create_subprocess_exec(
             *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=runtime_env,
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise ContainerRunError(container.image, proc.returncode, stdout, stderr)
+        return stdout.decode().strip()
+
+    @contextlib.asynccontextmanager
+    async def _launch_slot(
+        self, image: str, priority: int = 0
+    ) -> typing.AsyncContextManager[None]:
+        if self.scheduler is None:
+            yield
+            return
+        if self.instruments:
+            begin = time.perf_counter()
+        async with self.scheduler.slot(image, priority=priority):
+            if self.instruments:
+                emit(self.instruments, QUEUE, begin, image=image, priority=priority)
+            yield
+
+    @contextlib.asynccontextmanager
+    async def _place(
+        self, container: Container
+    ) -> typing.AsyncContextManager[Container]:
+        if self.placement is None:
+            yield container
+            return
+        async with self.placement.place(container) as placed_container:
+            yield placed_container
+
+    @contextlib.asynccontextmanager
+    async def _enforce_termination(
+        self,
+        container: Container,
+        proc: asyncio.subprocess.Process,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.AsyncContextManager[None]:
+        policy = self.termination
+        timeout = policy.get_timeout(container.timeout)
+        escalating = False
+
+        async def watchdog():
+            nonlocal escalating
+            if await policy.wait_exit(proc, timeout):
+                return
+            self.logger.warning(
+                "Container %s timed out after %s seconds", container.name, timeout
+            )
+            policy.stats.timeouts += 1
+            escalating = True
+            await policy.escalate(self, proc, container.name, log_level=log_level)
+
+        watchdog_task = None
+        if timeout is not None:
+            watchdog_task = asyncio.ensure_future(watchdog())
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            cleanup = None
+            if watchdog_task is not None:
+                if escalating:
+                    cleanup = watchdog_task
+                else:
+                    watchdog_task.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await watchdog_task
+            if cleanup is None and proc.returncode is None:
+                if cancelled:
+                    policy.stats.cancellations += 1
+                else:
+                    policy.stats.abandoned += 1
+                cleanup = asyncio.ensure_future(
+                    policy.escalate(self, proc, container.name, log_level=log_level)
+                )
+            if cleanup is not None:
+                # Shielded so that the container is still stopped even if we get
+                # cancelled again in the meantime
+                await asyncio.shield(cleanup)
+
+    async def _run_podman_command(self, command: typing.Sequence[str]) -> int:
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        return await proc.wait()
+
+    async def _terminate_container(
+        self,
+        proc: asyncio.subprocess.Process,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        # The podman run process proxies the signal to the container
+        with contextlib.suppress(ProcessLookupError):
+            proc.send_signal(signal.SIGTERM)
+
+    async def _kill_container(
+        self,
+        proc: asyncio.subprocess.Process,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        await self._run_podman_command(
+            self.provider.build_kill_command(name, log_level=log_level)
+        )
+
+    async def _force_remove_container(
+        self,
+        proc: asyncio.subprocess.Process,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        await self._run_podman_command(
+            self.provider.build_remove_command(name, log_level=log_level)
+        )
+        if proc.returncode is None:
+            # The container is gone, don't leave the podman process behind
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+
+    @contextlib.asynccontextmanager
+    async def _run(
+        self,
+        container: Container,
+        stdin: typing.Optional[int] = None,
+        stdout: typing.Optional[int] = None,
+        stderr: typing.Optional[int] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
+        instruments = self.instruments
+        if instruments:
+            begin = time.perf_counter()
+        command = self.provider.build_command(container, log_level=log_level)
+        if instruments:
+            emit(instruments, BUILD_COMMAND, begin, image=container.image)
+        async with self._spawn(
+            command,
+            image=container.image,
             stdin=stdin,
             stdout=stdout,
             stderr=stderr,
-            env=runtime_env,
+            runtime_env=runtime_env,
             limit=limit,
+        ) as proc:
+            yield proc
+
+    @contextlib.asynccontextmanager
+    async def _spawn(
+        self,
+        command: typing.Sequence[str],
+        image: str,
+        stdin: typing.Optional[int] = None,
+        stdout: typing.Optional[int] = None,
+        stderr: typing.Optional[int] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+    ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
+        self.logger.info(
+            "Run container with command: %s, runtime_env=%s",
+            " ".join(map(shlex.quote, command)),
+            runtime_env,
+        )
+        async with self._track_process(
+            image,
+            lambda: asyncio.create_subprocess_exec(
+                *command,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                env=runtime_env,
+                limit=limit,
+            ),
+        ) as proc:
+            yield proc
+
+    @contextlib.asynccontextmanager
+    async def _track_process(
+        self, image: str, launch: typing.Callable[[], typing.Awaitable[typing.Any]]
+    ) -> typing.AsyncContextManager[typing.Any]:
+        """Launch the container process, and emit its spawn and run timing events"""
+        instruments = self.instruments
+        if instruments:
+            begin = time.perf_counter()
+        proc = await launch()
+        if not instruments:
+            yield proc
+            return
+        emit(instruments, SPAWN, begin, image=image)
+        try:
+            yield proc
+        finally:
+            emit(
+                instruments,
+                RUN,
+                begin,
+                image=image,
+                exit_code=proc.returncode,
+            )
+
+    async def run_and_collect(
+        self,
+        container: Container,
+        input: typing.Optional[bytes] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+        log_level: typing.Optional[str] = None,
+        max_output_size: typing.Optional[int] = DEFAULT_LIMIT * 16,
+        spill: bool = False,
+        spill_dir: typing.Optional[pathlib.Path] = None,
+        check: bool = False,
+        priority: int = 0,
+    ) -> RunResult:
+        """Run the container to the end and collect its output, stdout and stderr
+        are drained concurrently and each keeps at most `max_output_size` bytes in
+        memory, with `spill=True` the complete output goes to temp files when it
+        exceeds the limit
+        """
+        begin = time.perf_counter()
+        collectors = {
+            name: OutputCollector(
+                max_size=max_output_size,
+                spill=spill,
+                spill_dir=spill_dir,
+                spill_suffix=f".{name}",
+            )
+            for name in ("stdout", "stderr")
+        }
+        peak_buffer_size = 0
+        first_byte: typing.Optional[float] = None
+
+        async def drain(name: str, reader: asyncio.StreamReader):
+            nonlocal peak_buffer_size, first_byte
+            collector = collectors[name]
+            while True:
+                data = await reader.read(limit)
+                if not data:
+                    break
+                if first_byte is None:
+                    first_byte = time.perf_counter() - spawned
+                collector.write(data)
+                peak_buffer_size = max(
+                    peak_buffer_size,
+                    sum(collector.buffered for collector in collectors.values()),
+                )
+
+        async def feed(writer: asyncio.StreamWriter):
+            try:
+                writer.write(input)
+                await writer.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # The container doesn't read all the input, just like communicate
+                pass
+            writer.close()
+
+        try:
+            async with self.run(
+                container,
+                stdin=asyncio.subprocess.PIPE if input is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                runtime_env=runtime_env,
+                limit=limit,
+                log_level=log_level,
+                priority=priority,
+            ) as proc:
+                spawned = time.perf_counter()
+                tasks = [drain("stdout", proc.stdout), drain("stderr", proc.stderr)]
+                if input is not None:
+                    tasks.append(feed(proc.stdin))
+                await asyncio.gather(*tasks)
+                exit_code = await proc.wait()
+        except BaseException:
+            for collector in collectors.values():
+                collector.close()
+                if collector.spill_path is not None:
+                    collector.spill_path.unlink(missing_ok=True)
+            raise
+        for collector in collectors.values():
+            collector.close()
+        stdout = collectors["stdout"]
+        stderr = collectors["stderr"]
+        result = RunResult(
+            image=container.image,
+            exit_code=exit_code,
+            stdout=stdout.getvalue(),
+            stderr=stderr.getvalue(),
+            stdout_size=stdout.size,
+            stderr_size=stderr.size,
+            stdout_truncated=stdout.truncated,
+            stderr_truncated=stderr.truncated,
+            stdout_path=stdout.spill_path,
+            stderr_path=stderr.spill_path,
+            elapsed=time.perf_counter() - begin,
+            first_byte=first_byte,
+            peak_buffer_size=peak_buffer_size,
         )
-        yield proc
+        if check:
+            try:
+                result.check_returncode()
+            except ContainerRunError:
+                result.cleanup()
+                raise
+        return result
+
+    @contextlib.asynccontextmanager
+    async def stream(
+        self,
+        container: Container,
+        stdin: typing.Optional[int] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+        log_level: typing.Optional[str] = None,
+        multiplexed: bool = True,
+        max_pending: int = 16,
+        retain: int = DEFAULT_LIMIT,
+        sinks: typing.Sequence[Sink] = (),
+        priority: int = 0,
+    ) -> typing.AsyncContextManager[OutputStream]:
+        """Run the container with its stdout and stderr exposed as async iterators
+        of chunks read with up to `limit` bytes each, instead of raw pipes
+        """
+        async with self.run(
+            container,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            runtime_env=runtime_env,
+            limit=limit,
+            log_level=log_level,
+            priority=priority,
+        ) as proc:
+            on_first_byte = None
+            if self.instruments:
+                begin = time.perf_counter()
+
+                def on_first_byte(stream: str):
+                    emit(
+                        self.instruments,
+                        FIRST_BYTE,
+                        begin,
+                        image=container.image,
+                        stream=stream,
+                    )
+
+            output = OutputStream(
+                proc,
+                multiplexed=multiplexed,
+                chunk_size=limit,
+                max_pending=max_pending,
+                retain=retain,
+                sinks=sinks,
+                on_first_byte=on_first_byte,
+            )
+            try:
+                yield output
+            finally:
+                await output.close()
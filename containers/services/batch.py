@@ -0,0 +1,67 @@
+import dataclasses
+import enum
+import typing
+
+from ..errors import LoadImageError
+from ..errors import LoadImagesError
+
+DEFAULT_REGISTRY = "docker.io"
+
+
+def normalize_image_reference(image: str) -> str:
+    """Expand a short image reference into its fully qualified form, like
+    `alpine` into `docker.io/library/alpine:latest`.
+    """
+    name, at, digest = image.partition("@")
+    tag = None
+    last_slash = name.rfind("/")
+    colon = name.rfind(":")
+    if colon > last_slash:
+        name, tag = name[:colon], name[colon + 1 :]
+    parts = name.split("/")
+    if len(parts) == 1 or not (
+        "." in parts[0] or ":" in parts[0] or parts[0] == "localhost"
+    ):
+        if len(parts) == 1:
+            parts = ["library", *parts]
+        parts = [DEFAULT_REGISTRY, *parts]
+    name = "/".join(parts)
+    if at:
+        return f"{name}@{digest}"
+    return f"{name}:{tag or 'latest'}"
+
+
+class LoadImageStatus(enum.Enum):
+    CACHED = "cached"
+    PRESENT = "present"
+    PULLED = "pulled"
+    FAILED = "failed"
+
+
+@dataclasses.dataclass
+class LoadImageResult:
+    image: str
+    status: LoadImageStatus
+    elapsed: float
+    error: typing.Optional[LoadImageError] = None
+
+
+@dataclasses.dataclass
+class LoadImagesReport:
+    results: typing.List[LoadImageResult]
+    elapsed: float
+
+    @property
+    def failures(self) -> typing.List[LoadImageResult]:
+        return [
+            result for result in self.results if result.status == LoadImageStatus.FAILED
+        ]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def raise_for_errors(self):
+        failures = self.failures
+        if failures:
+            raise LoadImagesError([result.error for result in failures])
@@ -0,0 +1,111 @@
+import dataclasses
+import os
+import pathlib
+import tempfile
+import typing
+
+from ..errors import ContainerRunError
+
+# Appended to the collected output in memory when bytes are dropped
+TRUNCATION_MARKER = b"\n[... %d bytes truncated ...]\n"
+
+
+class OutputCollector:
+    """Collect a stream in memory up to `max_size` bytes, the rest is dropped, or
+    with `spill=True`, the whole stream is written into a temp file once the
+    limit is reached
+    """
+
+    def __init__(
+        self,
+        max_size: typing.Optional[int] = None,
+        spill: bool = False,
+        spill_dir: typing.Optional[pathlib.Path] = None,
+        spill_suffix: str = "",
+    ):
+        self.max_size = max_size
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.spill_suffix = spill_suffix
+        self.size = 0
+        self.truncated = 0
+        self.spill_path: typing.Optional[pathlib.Path] = None
+        self._buffer = bytearray()
+        self._spill_file: typing.Optional[typing.BinaryIO] = None
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def _start_spill(self):
+        fd, path = tempfile.mkstemp(suffix=self.spill_suffix, dir=self.spill_dir)
+        self._spill_file = os.fdopen(fd, "wb")
+        self.spill_path = pathlib.Path(path)
+        self._spill_file.write(self._buffer)
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self._spill_file is not None:
+            self._spill_file.write(data)
+        if self.max_size is None:
+            self._buffer.extend(data)
+            return
+        available = self.max_size - len(self._buffer)
+        if len(data) <= available:
+            self._buffer.extend(data)
+            return
+        if self.spill and self._spill_file is None:
+            self._start_spill()
+            self._spill_file.write(data)
+        self._buffer.extend(data[: max(available, 0)])
+        self.truncated += len(data) - max(available, 0)
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def getvalue(self) -> bytes:
+        if not self.truncated:
+            return bytes(self._buffer)
+        return bytes(self._buffer) + TRUNCATION_MARKER % self.truncated
+
+
+@dataclasses.dataclass
+class RunResult:
+    image: str
+    exit_code: int
+    stdout: bytes
+    stderr: bytes
+    # Total size of the output, including the truncated bytes
+    stdout_size: int = 0
+    stderr_size: int = 0
+    stdout_truncated: int = 0
+    stderr_truncated: int = 0
+    # Temp files with the complete output if spilled, removed by `cleanup`
+    stdout_path: typing.Optional[pathlib.Path] = None
+    stderr_path: typing.Optional[pathlib.Path] = None
+    # Seconds from the call to the exit of the container
+    elapsed: float = 0.0
+    # Seconds from the spawn to the first output byte, None if there is no output
+    first_byte: typing.Optional[float] = None
+    # Largest number of output bytes held in memory at the same time
+    peak_buffer_size: int = 0
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.stdout_truncated or self.stderr_truncated)
+
+    def check_returncode(self):
+        if self.exit_code != 0:
+            raise ContainerRunError(
+                image=self.image,
+                code=self.exit_code,
+                stdout=self.stdout,
+                stderr=self.stderr,
+            )
+
+    def cleanup(self):
+        for path in (self.stdout_path, self.stderr_path):
+            if path is not None:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,404 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import typing
+
+from ..data_types import PathType
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, the cache is then only safe for a single process
+    fcntl = None
+
+DEFAULT_MAX_CACHE_SIZE = 2**30
+# Temp files of interrupted copies are removed after this many seconds, or right
+# away if the process who wrote them is gone
+STALE_TEMP_AGE = 3600
+
+
+@dataclasses.dataclass
+class CopyStats:
+    copied_files: int = 0
+    copied_bytes: int = 0
+    # Files linked or copied from the staging cache without reading the source
+    reused_files: int = 0
+    evicted_files: int = 0
+    evicted_bytes: int = 0
+
+
+def default_cache_dir() -> pathlib.Path:
+    """The per-user staging cache directory, under `%LOCALAPPDATA%` on Windows and
+    `$XDG_CACHE_HOME` (or `~/.cache`) elsewhere
+    """
+    base = os.environ.get("LOCALAPPDATA" if os.name == "nt" else "XDG_CACHE_HOME")
+    if not base:
+        base = pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "container-helpers" / "staging"
+
+
+def make_cache_key(path: PathType, stat: os.stat_result) -> str:
+    """The staging cache key of a file, it changes whenever the file is modified"""
+    key = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+    return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+
+def _is_process_alive(pid: int) -> bool:
+    if fcntl is None:
+        # Signal 0 terminates the process on Windows instead of probing it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StagingCache:
+    """Persistent store of staged file copies keyed by `make_cache_key`, the least
+    recently used ones are evicted once the total size goes above `max_size` bytes.
+
+    The cache directory can be shared by many processes, the cleanup and eviction
+    take a lock on it and go by the files on disk, with their access time as the
+    last time they were used.
+    """
+
+    def __init__(self, root: PathType, max_size: int = DEFAULT_MAX_CACHE_SIZE):
+        self.root = pathlib.Path(root)
+        self.max_size = max_size
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._entries: typing.OrderedDict[str, int] = collections.OrderedDict()
+        self._size = 0
+        self._load()
+
+    @contextlib.contextmanager
+    def _locked(self) -> typing.Generator[None, None, None]:
+        """Lock the cache directory against the other processes using it"""
+        if fcntl is None:
+            yield
+            return
+        # Opened for each use, as flock locks of separate opens exclude each other
+        # even in the same process
+        with open(self.root / "lock", "a") as fo:
+            fcntl.flock(fo.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fo.fileno(), fcntl.LOCK_UN)
+
+    def _is_stale_temp(self, path: pathlib.Path, stat: os.stat_result) -> bool:
+        if time.time() - stat.st_mtime >= STALE_TEMP_AGE:
+            return True
+        # Named .<name>.<pid>.<thread id>
+        parts = path.name.rsplit(".", 2)
+        if len(parts) != 3 or not parts[1].isdigit():
+            return False
+        return not _is_process_alive(int(parts[1]))
+
+    def _scan(self) -> typing.List[typing.Tuple[float, str, int]]:
+        """The (access time, key, size) of the objects on disk, least recently used
+        first, stale temp files are removed along the way
+        """
+        found = []
+        for path in (self.root / "objects").glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.name.startswith("."):
+                # Temp file of a copy in progress, or left by an interrupted one
+                if self._is_stale_temp(path, stat):
+                    path.unlink(missing_ok=True)
+                continue
+            found.append((stat.st_atime, path.parent.name + path.name, stat.st_size))
+        found.sort()
+        return found
+
+    def _reset(self, found: typing.List[typing.Tuple[float, str, int]]):
+        with self._lock:
+            self._entries = collections.OrderedDict(
+                (key, size) for _, key, size in found
+            )
+            self._size = sum(self._entries.values())
+
+    def _load(self):
+        objects_dir = self.root / "objects"
+        objects_dir.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            self._reset(self._scan())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def object_path(self, key: str) -> pathlib.Path:
+        return self.root / "objects" / key[:2] / key[2:]
+
+    @staticmethod
+    def _mark_used(path: pathlib.Path):
+        # Only the access time, the modification time is the one of the source
+        stat = path.stat()
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+    def touch(self, key: str) -> bool:
+        """Mark the entry as recently used, return False if it's not in the cache"""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._entries.move_to_end(key)
+        try:
+            self._mark_used(self.object_path(key))
+        except FileNotFoundError:
+            # Evicted by another process
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._size -= size
+            return False
+        return True
+
+    def put(self, key: str, src: PathType) -> pathlib.Path:
+        """Copy the file into the cache under the key and return the stored path"""
+        path = self.object_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Copy to a temp file first so that a partial copy is never visible, the
+        # pid tells whether it's still in progress to the other processes
+        temp_path = path.parent / f".{path.name}.{os.getpid()}.{threading.get_ident()}"
+        shutil.copy2(src, temp_path)
+        # copy2 keeps the access time of the source
+        self._mark_used(temp_path)
+        os.replace(temp_path, path)
+        size = path.stat().st_size
+        with self._lock:
+            if key not in self._entries:
+                self._size += size
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+        return path
+
+    def evict(self, stats: typing.Optional[CopyStats] = None):
+        """Evict the least recently used objects of all the processes sharing the
+        cache until the total size is within `max_size`
+        """
+        with self._locked():
+            found = self._scan()
+            total = sum(size for _, _, size in found)
+            evicted = 0
+            while total > self.max_size and evicted < len(found):
+                _, key, size = found[evicted]
+                evicted += 1
+                total -= size
+                # Staged copies linked to the object are not affected by removing it
+                self.object_path(key).unlink(missing_ok=True)
+                self.logger.debug("Evicted staged file %s of %s bytes", key, size)
+                if stats is not None:
+                    stats.evicted_files += 1
+                    stats.evicted_bytes += size
+            self._reset(found[evicted:])
+
+
+class CopyEngine:
+    """Copy directory trees through a persistent staging cache, files are copied
+    in parallel in a thread pool and only the ones changed since the last copy are
+    read from the source, the others are hard linked (or copied if linking is not
+    supported) from the cache
+    """
+
+    def __init__(
+        self,
+        cache_dir: typing.Optional[PathType] = None,
+        max_cache_size: int = DEFAULT_MAX_CACHE_SIZE,
+        max_workers: int = 8,
+    ):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+            # Only readable by the current user, the staged files are copies of
+            # their files
+            cache_dir.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.cache = StagingCache(cache_dir, max_size=max_cache_size)
+        self.max_workers = max_workers
+        self.logger = logging.getLogger(__name__)
+        self._executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._stats_lock = threading.Lock()
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="copy-engine"
+            )
+        return self._executor
+
+    def _copy_file(self, src: pathlib.Path, dest: pathlib.Path, stats: CopyStats):
+        stat = src.stat()
+        key = make_cache_key(src, stat)
+        if self.cache.touch(key):
+            cached = self.cache.object_path(key)
+            with self._stats_lock:
+                stats.reused_files += 1
+        else:
+            cached = self.cache.put(key, src)
+            with self._stats_lock:
+                stats.copied_files += 1
+                stats.copied_bytes += stat.st_size
+        try:
+            os.link(cached, dest)
+        except FileNotFoundError:
+            # Evicted by another copy in the meantime
+            cached = self.cache.put(key, src)
+            os.link(cached, dest)
+        except OSError:
+            shutil.copy2(cached, dest)
+
+    def copy_tree(self, src: PathType, dest: PathType) -> CopyStats:
+        """Copy the `src` directory tree into `dest`, which must not exist yet"""
+        src = pathlib.Path(src)
+        dest = pathlib.Path(dest)
+        stats = CopyStats()
+        futures = []
+        # Follow symlinks like `shutil.copytree` does by default
+        for dir_path, _, file_names in os.walk(src, followlinks=True):
+            rel_dir = pathlib.Path(dir_path).relative_to(src)
+            target_dir = dest / rel_dir
+            target_dir.mkdir(parents=True)
+            for file_name in file_names:
+                futures.append(
+                    self.executor.submit(
+                        self._copy_file,
+                        pathlib.Path(dir_path) / file_name,
+                        target_dir / file_name,
+                        stats,
+                    )
+                )
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+        self.cache.evict(stats)
+        self.logger.debug("Copied %s to %s, %s", src, dest, stats)
+        return stats
+
+    async def copy_tree_async(self, src: PathType, dest: PathType) -> CopyStats:
+        """Same as `copy_tree` but without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.copy_tree, src, dest)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+@dataclasses.dataclass
+class _CachedFile:
+    path: pathlib.Path
+    refs: int = 0
+
+
+class SmallFileCache:
+    """Local copies of small files like seccomp profiles, stored by content hash.
+
+    A file is read only when its mtime or size changed since the last copy, copies
+    in use are reference counted and outdated ones are removed once released.
+    """
+
+    def __init__(self, root: typing.Optional[PathType] = None):
+        self.root = pathlib.Path(root) if root is not None else None
+        self._owns_root = root is None
+        self.logger = logging.getLogger(__name__)
+        # (path, suffix) -> (mtime, size, name of the copy)
+        self._stats: typing.Dict[
+            typing.Tuple[str, str], typing.Tuple[int, int, str]
+        ] = {}
+        self._files: typing.Dict[str, _CachedFile] = {}
+        # Created lazily so that the lock is bound to the running loop
+        self._lock: typing.Optional[asyncio.Lock] = None
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _get_root(self) -> pathlib.Path:
+        if self.root is None:
+            self.root = pathlib.Path(tempfile.mkdtemp(prefix="container-helpers-"))
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root
+
+    def _copy(self, src: pathlib.Path, suffix: str) -> typing.Tuple[str, pathlib.Path]:
+        content = src.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._get_root() / f"{digest}{suffix}"
+        if not path.exists():
+            temp_path = path.with_name(f".{path.name}")
+            temp_path.write_bytes(content)
+            os.replace(temp_path, path)
+        # Named by content hash so that the same content is only stored once
+        return path.name, path
+
+    async def _acquire(self, src: pathlib.Path, suffix: str) -> str:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        key = (os.path.abspath(src), suffix)
+        async with self._lock:
+            stat = await loop.run_in_executor(None, src.stat)
+            cached = self._stats.get(key)
+            if (
+                cached is not None
+                and cached[:2] == (stat.st_mtime_ns, stat.st_size)
+                and cached[2] in self._files
+            ):
+                name = cached[2]
+            else:
+                name, path = await loop.run_in_executor(None, self._copy, src, suffix)
+                self.logger.debug("Copied %s to %s", src, path)
+                self._stats[key] = (stat.st_mtime_ns, stat.st_size, name)
+                self._files.setdefault(name, _CachedFile(path=path))
+            self._files[name].refs += 1
+            return name
+
+    def _release(self, name: str):
+        cached_file = self._files[name]
+        cached_file.refs -= 1
+        if cached_file.refs:
+            return
+        # Keep the copy for the next runs unless it's outdated
+        if name not in {cached[2] for cached in self._stats.values()}:
+            del self._files[name]
+            cached_file.path.unlink(missing_ok=True)
+
+    @contextlib.asynccontextmanager
+    async def acquire(
+        self, src: PathType, suffix: str = ""
+    ) -> typing.AsyncContextManager[pathlib.Path]:
+        """Get the local copy of `src`, it stays valid until the context exits"""
+        name = await self._acquire(pathlib.Path(src), suffix)
+        try:
+            yield self._files[name].path
+        finally:
+            self._release(name)
+
+    def close(self):
+        for cached_file in self._files.values():
+            cached_file.path.unlink(missing_ok=True)
+        self._stats.clear()
+        self._files.clear()
+        if self._owns_root and self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
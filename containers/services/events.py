@@ -0,0 +1,180 @@
+import asyncio.subprocess
+import collections
+import contextlib
+import json
+import logging
+import time
+import typing
+
+from ..data_types import Container
+from ..providers.podman import Podman
+
+# Only the exits of containers are watched
+EVENT_FILTERS = ("type=container", "event=died")
+
+
+class EventsWatcher:
+    """Follow a single `podman events` stream and resolve the exit codes of
+    detached containers from it, so that waiting for many running containers only
+    takes one helper process instead of one attached `podman run` process each.
+
+    The last `max_recent_exits` exits are kept, as the container may exit before
+    its launch command even returns and anyone waits for it.
+    """
+
+    def __init__(
+        self,
+        provider: typing.Optional[Podman] = None,
+        log_level: typing.Optional[str] = None,
+        max_recent_exits: int = 4096,
+        restart_delay: float = 1.0,
+    ):
+        self.provider = provider or Podman()
+        self.log_level = log_level
+        self.max_recent_exits = max_recent_exits
+        self.restart_delay = restart_delay
+        self.logger = logging.getLogger(__name__)
+        self._waiters: typing.Dict[str, asyncio.Future] = {}
+        self._recent_exits: typing.OrderedDict[str, int] = collections.OrderedDict()
+        self._proc: typing.Optional[asyncio.subprocess.Process] = None
+        self._read_task: typing.Optional[asyncio.Task] = None
+        # Created lazily so that the event is bound to the running loop
+        self._started: typing.Optional[asyncio.Event] = None
+        self._error: typing.Optional[BaseException] = None
+
+    @property
+    def running(self) -> bool:
+        return self._read_task is not None and not self._read_task.done()
+
+    async def start(self):
+        """Start following the events if not started yet, it returns once the
+        events process is spawned
+        """
+        if self._read_task is None or self._read_task.done():
+            self._error = None
+            self._started = asyncio.Event()
+            self._read_task = asyncio.ensure_future(self._read_events())
+        started_task = asyncio.ensure_future(self._started.wait())
+        await asyncio.wait(
+            [started_task, self._read_task], return_when=asyncio.FIRST_COMPLETED
+        )
+        started_task.cancel()
+        if self._error is not None:
+            raise self._error
+
+    async def _read_events(self):
+        since = time.time()
+        try:
+            while True:
+                # Replay the events from a bit earlier, to cover the time between
+                # spawning the process and it actually subscribing to the events
+                command = self.provider.build_events_command(
+                    filters=EVENT_FILTERS,
+                    since=str(int(since) - 1),
+                    log_level=self.log_level,
+                )
+                self.logger.debug("Following events with command %s", command)
+                self._proc = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                self._started.set()
+                async for line in self._proc.stdout:
+                    self._handle_line(line)
+                    since = time.time()
+                code = await self._proc.wait()
+                self.logger.warning(
+                    "Events process exited with code %s, restarting in %ss",
+                    code,
+                    self.restart_delay,
+                )
+                await asyncio.sleep(self.restart_delay)
+        except Exception as exc:
+            self.logger.error("Failed to follow events", exc_info=True)
+            self._error = exc
+            for future in self._waiters.values():
+                if not future.done():
+                    future.set_exception(exc)
+                    # Mark the exception as retrieved in case all waiters are gone
+                    future.exception()
+            self._waiters.clear()
+        finally:
+            await self._stop_process()
+
+    async def _stop_process(self):
+        proc = self._proc
+        self._proc = None
+        if proc is None or proc.returncode is not None:
+            return
+        with contextlib.suppress(ProcessLookupError):
+            proc.terminate()
+        await proc.wait()
+
+    def _handle_line(self, line: bytes):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            self.logger.warning("Unable to parse event %r", line)
+            return
+        container_id = event.get("ID")
+        if event.get("Status") != "died" or not container_id:
+            return
+        # The exit code is omitted from the event when it's zero
+        exit_code = int(event.get("ContainerExitCode") or 0)
+        self.logger.debug("Container %s exited with code %s", container_id, exit_code)
+        # Kept even if someone is waiting, a waiter may have given up meanwhile
+        self._recent_exits[container_id] = exit_code
+        self._recent_exits.move_to_end(container_id)
+        while len(self._recent_exits) > self.max_recent_exits:
+            self._recent_exits.popitem(last=False)
+        future = self._waiters.pop(container_id, None)
+        if future is not None and not future.done():
+            future.set_result(exit_code)
+
+    async def wait(self, container_id: str) -> int:
+        """Wait for the container to exit and return its exit code"""
+        exit_code = self._recent_exits.get(container_id)
+        if exit_code is not None:
+            return exit_code
+        if self._error is not None:
+            raise self._error
+        if not self.running:
+            raise RuntimeError("Events watcher is not running")
+        future = self._waiters.get(container_id)
+        if future is None:
+            future = self._waiters[container_id] = (
+                asyncio.get_running_loop().create_future()
+            )
+        return await asyncio.shield(future)
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._read_task
+            self._read_task = None
+        for future in self._waiters.values():
+            future.cancel()
+        self._waiters.clear()
+
+
+class DetachedContainer:
+    """A container launched in the background, its exit is resolved by the
+    events watcher
+    """
+
+    def __init__(self, id: str, container: Container, watcher: EventsWatcher):
+        self.id = id
+        self.container = container
+        self.watcher = watcher
+        self.exit_code: typing.Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        return self.exit_code is not None
+
+    async def wait(self, timeout: typing.Optional[float] = None) -> int:
+        if self.exit_code is None:
+            self.exit_code = await asyncio.wait_for(self.watcher.wait(self.id), timeout)
+        return self.exit_code
@@ -0,0 +1,262 @@
+import asyncio
+import ctypes.util
+import logging
+import os
+import pathlib
+import struct
+import sys
+import typing
+
+from ..data_types import ArchiveImageMount
+from ..data_types import Mount
+from ..data_types import PathType
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+# struct inotify_event without the trailing name
+EVENT_HEADER = struct.Struct("iIII")
+DEFAULT_POLL_INTERVAL = 0.1
+
+
+def _load_libc() -> typing.Optional[ctypes.CDLL]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+    return libc
+
+
+class _Watch:
+    def __init__(self, wd: int, directory: pathlib.Path):
+        self.wd = wd
+        self.directory = directory
+        # File name to the futures waiting for it
+        self.waiters: typing.Dict[str, typing.List[asyncio.Future]] = {}
+
+
+class FileWaiter:
+    """Wait for files to appear, like the success file created by the
+    archive-overlay OCI hook once the archive is written.
+
+    On Linux, a single inotify instance is shared by all the waiters, with one watch
+    per directory no matter how many files are waited for in it, so that waiters
+    are woken up as soon as their file is created. Elsewhere, or when the directory
+    cannot be watched, all the waiting files are checked by a single poll task
+    every `poll_interval` seconds instead.
+    """
+
+    def __init__(
+        self, poll_interval: float = DEFAULT_POLL_INTERVAL, use_inotify: bool = True
+    ):
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+        self._libc = _load_libc() if use_inotify else None
+        self._fd: typing.Optional[int] = None
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._watches: typing.Dict[pathlib.Path, _Watch] = {}
+        self._watches_by_wd: typing.Dict[int, _Watch] = {}
+        self._polled: typing.Dict[pathlib.Path, typing.List[asyncio.Future]] = {}
+        self._poll_task: typing.Optional[asyncio.Task] = None
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._libc is not None
+
+    @property
+    def watch_count(self) -> int:
+        return len(self._watches)
+
+    def _ensure_inotify(self) -> bool:
+        if self._libc is None:
+            return False
+        if self._fd is None:
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                errno = ctypes.get_errno()
+                self.logger.warning(
+                    "Failed to init inotify, %s, fallback to polling",
+                    os.strerror(errno),
+                )
+                self._libc = None
+                return False
+            self._fd = fd
+            self._loop = asyncio.get_running_loop()
+            self._loop.add_reader(fd, self._read_events)
+        return True
+
+    def _add_watch(
+        self, path: pathlib.Path, future: asyncio.Future
+    ) -> typing.Optional[_Watch]:
+        """Add the future to the watch of the directory of the path, returns None if
+        the directory cannot be watched
+        """
+        if not self._ensure_inotify():
+            return None
+        directory = path.parent
+        watch = self._watches.get(directory)
+        if watch is None:
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), WATCH_MASK
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                self.logger.debug(
+                    "Cannot watch %s, %s, fallback to polling",
+                    directory,
+                    os.strerror(errno),
+                )
+                return None
+            # The same directory through another path gets the same watch
+            watch = self._watches_by_wd.get(wd)
+            if watch is None:
+                watch = _Watch(wd, directory)
+                self._watches_by_wd[wd] = watch
+            self._watches[directory] = watch
+        watch.waiters.setdefault(path.name, []).append(future)
+        return watch
+
+    def _remove_waiter(self, watch: _Watch, name: str, future: asyncio.Future):
+        futures = watch.waiters.get(name)
+        if futures is not None and future in futures:
+            futures.remove(future)
+            if not futures:
+                del watch.waiters[name]
+        if not watch.waiters and self._watches_by_wd.get(watch.wd) is watch:
+            self._drop_watch(watch)
+            self._libc.inotify_rm_watch(self._fd, watch.wd)
+
+    def _drop_watch(self, watch: _Watch):
+        del self._watches_by_wd[watch.wd]
+        for directory in [
+            directory for directory, item in self._watches.items() if item is watch
+        ]:
+            del self._watches[directory]
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, check all the files instead
+                self._recheck_watches()
+                continue
+            watch = self._watches_by_wd.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory was removed or unmounted, fallback to polling
+                self._drop_watch(watch)
+                for file_name, futures in watch.waiters.items():
+                    for future in futures:
+                        self._add_polled(watch.directory / file_name, future)
+                watch.waiters.clear()
+                continue
+            for future in watch.waiters.pop(name, []):
+                if not future.done():
+                    future.set_result(None)
+
+    def _recheck_watches(self):
+        for watch in list(self._watches_by_wd.values()):
+            for name in list(watch.waiters):
+                if (watch.directory / name).exists():
+                    for future in watch.waiters.pop(name):
+                        if not future.done():
+                            future.set_result(None)
+
+    def _add_polled(self, path: pathlib.Path, future: asyncio.Future):
+        self._polled.setdefault(path, []).append(future)
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.ensure_future(self._poll())
+
+    def _remove_polled(self, path: pathlib.Path, future: asyncio.Future):
+        futures = self._polled.get(path)
+        if futures is not None and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self._polled[path]
+
+    async def _poll(self):
+        while self._polled:
+            await asyncio.sleep(self.poll_interval)
+            for path in list(self._polled):
+                if path.exists():
+                    for future in self._polled.pop(path):
+                        if not future.done():
+                            future.set_result(None)
+
+    async def wait(self, path: PathType, timeout: typing.Optional[float] = None):
+        """Wait until the file exists, raises `asyncio.TimeoutError` if it doesn't
+        appear in `timeout` seconds
+        """
+        path = pathlib.Path(path).absolute()
+        if path.exists():
+            return
+        future = asyncio.get_running_loop().create_future()
+        watch = self._add_watch(path, future)
+        if watch is None:
+            self._add_polled(path, future)
+        # Check again as it could be created before the watch was added
+        if path.exists():
+            future.set_result(None)
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            if watch is not None:
+                self._remove_waiter(watch, path.name, future)
+            # The waiter is moved to polling if the watched directory is removed
+            self._remove_polled(path, future)
+
+    async def wait_archives(
+        self, mounts: typing.Iterable[Mount], timeout: typing.Optional[float] = None
+    ):
+        """Wait for the success files of all the archive image mounts"""
+        paths = [
+            mount.archive_success
+            for mount in mounts
+            if isinstance(mount, ArchiveImageMount)
+            and mount.archive_to is not None
+            and mount.archive_success is not None
+        ]
+        await asyncio.wait_for(
+            asyncio.gather(*(self.wait(path) for path in paths)), timeout
+        )
+
+    def close(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        for futures in self._polled.values():
+            for future in futures:
+                future.cancel()
+        self._polled.clear()
+        for watch in self._watches_by_wd.values():
+            for futures in watch.waiters.values():
+                for future in futures:
+                    future.cancel()
+        self._watches.clear()
+        self._watches_by_wd.clear()
+        if self._fd is not None:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            self._loop = None
@@ -0,0 +1,98 @@
+import dataclasses
+import time
+import typing
+
+from .batch import normalize_image_reference
+
+
+@dataclasses.dataclass
+class ImageCacheEntry:
+    image: str
+    digest: typing.Optional[str]
+    expires_at: float
+
+
+def _digest_key(image: str, digest: str) -> typing.Tuple[str, str]:
+    name = normalize_image_reference(image)
+    if "@" in name:
+        repository = name.rsplit("@", 1)[0]
+    else:
+        repository = name.rsplit(":", 1)[0]
+    return repository, digest
+
+
+class ImageCache:
+    """In-process cache of images known to be present in the local storage.
+
+    Entries are keyed by image reference and, when known, by the repository and
+    resolved digest, so that a lookup with `repo@sha256:...` hits an entry recorded
+    with a tag of the same repository.
+    Passing `ttl=None` keeps entries until they are invalidated explicitly.
+    """
+
+    def __init__(
+        self,
+        ttl: typing.Optional[float] = 60.0,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.clock = clock
+        self._by_image: typing.Dict[str, ImageCacheEntry] = {}
+        self._by_digest: typing.Dict[typing.Tuple[str, str], ImageCacheEntry] = {}
+
+    def add(self, image: str, digest: typing.Optional[str] = None) -> ImageCacheEntry:
+        self.invalidate(image)
+        if self.ttl is None:
+            expires_at = float("inf")
+        else:
+            expires_at = self.clock() + self.ttl
+        entry = ImageCacheEntry(
+            image=image, digest=digest or None, expires_at=expires_at
+        )
+        self._by_image[image] = entry
+        if entry.digest is not None:
+            self._by_digest[_digest_key(image, entry.digest)] = entry
+        return entry
+
+    def _lookup(self, image: str) -> typing.Optional[ImageCacheEntry]:
+        entry = self._by_image.get(image)
+        if entry is None and "@" in image:
+            entry = self._by_digest.get(_digest_key(image, image.rsplit("@", 1)[1]))
+        return entry
+
+    def get(self, image: str) -> typing.Optional[ImageCacheEntry]:
+        entry = self._lookup(image)
+        if entry is None:
+            return None
+        if entry.expires_at <= self.clock():
+            self._remove(entry)
+            return None
+        return entry
+
+    def __contains__(self, image: str) -> bool:
+        return self.get(image) is not None
+
+    def __len__(self) -> int:
+        return len(self._by_image)
+
+    def invalidate(self, image: str):
+        """Forget an image reference, or every entry with a digest like `sha256:...`."""
+        entry = self._lookup(image)
+        if entry is not None:
+            self._remove(entry)
+            return
+        for entry in list(self._by_image.values()):
+            if entry.digest == image:
+                self._remove(entry)
+
+    def clear(self):
+        self._by_image.clear()
+        self._by_digest.clear()
+
+    def _remove(self, entry: ImageCacheEntry):
+        if self._by_image.get(entry.image) is entry:
+            del self._by_image[entry.image]
+        if entry.digest is not None:
+            key = _digest_key(entry.image, entry.digest)
+            if self._by_digest.get(key) is entry:
+                del self._by_digest[key]
@@ -0,0 +1,242 @@
+import asyncio.subprocess
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+import typing
+import uuid
+
+from ..data_types import PathType
+from .batch import normalize_image_reference
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, the directory is then only safe for a single process
+    fcntl = None
+
+if typing.TYPE_CHECKING:
+    from .base import ContainersService
+
+
+class ImageSource:
+    """A place other than the registry to load images from, tried in order by
+    `ContainersService.load_image` before pulling from the registry
+    """
+
+    async def load(
+        self,
+        service: "ContainersService",
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ) -> bool:
+        """Load the image into the local storage, returns False if not available.
+        The credentials are the ones given to `load_image`, for sources pulling
+        from the registry
+        """
+        raise NotImplementedError()
+
+    async def store(self, service: "ContainersService", image: str):
+        """Called in the background after the image was pulled from the registry,
+        to keep a copy
+        """
+
+
+async def _run(command: typing.Sequence[str]) -> typing.Tuple[int, bytes]:
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    return proc.returncode, stderr
+
+
+class ArchiveImageSource(ImageSource):
+    """Load images from a local directory of image archives with `podman load`,
+    and write the images pulled from the registry back into it with `podman save`.
+
+    Archives are keyed by the image digest, so that all the references of the same
+    image share one archive, and a `repo@sha256:...` reference finds the archive of
+    any tag of it. When the archives take more than `max_size` bytes, the least
+    recently used ones are removed. The index is updated under a lock on the
+    directory, so that it can be shared by many processes.
+    """
+
+    def __init__(
+        self,
+        directory: PathType,
+        max_size: typing.Optional[int] = None,
+        archive_format: str = "oci-archive",
+        clock: typing.Callable[[], float] = time.time,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+        self.archive_format = archive_format
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+        # Created lazily so that the lock is bound to the running loop
+        self._lock: typing.Optional[asyncio.Lock] = None
+
+    @property
+    def index_path(self) -> pathlib.Path:
+        return self.directory / "index.json"
+
+    def archive_path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}.tar"
+
+    def read_index(self) -> typing.Dict[str, typing.Any]:
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("archives", {})
+        index.setdefault("references", {})
+        return index
+
+    def _write_index(self, index: typing.Dict[str, typing.Any]):
+        tmp_path = self.index_path.with_name(f".index-{os.getpid()}.json")
+        tmp_path.write_text(json.dumps(index))
+        tmp_path.replace(self.index_path)
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @contextlib.contextmanager
+    def _locked(self) -> typing.Generator[None, None, None]:
+        """Lock the index against the other processes using the directory"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.directory / "lock", "a") as fo:
+            fcntl.flock(fo.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fo.fileno(), fcntl.LOCK_UN)
+
+    def _find_key(
+        self, index: typing.Dict[str, typing.Any], image: str
+    ) -> typing.Optional[str]:
+        key = index["references"].get(normalize_image_reference(image))
+        if key is None:
+            _, _, digest = image.partition("@")
+            if digest.startswith("sha256:"):
+                key = digest[len("sha256:") :]
+        if key is None or key not in index["archives"]:
+            return None
+        return key
+
+    async def load(
+        self,
+        service: "ContainersService",
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ) -> bool:
+        if not self.directory.is_dir():
+            return False
+        async with self._get_lock():
+            with self._locked():
+                index = self.read_index()
+                key = self._find_key(index, image)
+                if key is None or not self.archive_path(key).exists():
+                    return False
+                index["archives"][key]["used"] = self.clock()
+                self._write_index(index)
+        self.logger.info("Loading image %s from archive %s", image, key)
+        code, stderr = await _run(
+            (
+                str(service.provider.executable),
+                "load",
+                "--input",
+                str(self.archive_path(key)),
+            )
+        )
+        if code != 0:
+            self.logger.warning(
+                "Failed to load image %s from archive with code=%s, stderr=%s",
+                image,
+                code,
+                stderr,
+            )
+            return False
+        found, _ = await service._inspect_image(image)
+        if not found:
+            self.logger.warning("Image %s not found after loading its archive", image)
+        return found
+
+    async def store(self, service: "ContainersService", image: str):
+        _, digest = await service._inspect_image(image)
+        if digest is not None and digest.startswith("sha256:"):
+            key = digest[len("sha256:") :]
+        else:
+            key = hashlib.sha256(normalize_image_reference(image).encode()).hexdigest()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        async with self._get_lock():
+            with self._locked():
+                index = self.read_index()
+                if key in index["archives"] and self.archive_path(key).exists():
+                    index["references"][normalize_image_reference(image)] = key
+                    self._write_index(index)
+                    return
+        # Saved without the lock so that loading other images doesn't wait for it,
+        # into a temp file renamed once complete
+        tmp_path = self.directory / f".{key}-{os.getpid()}-{uuid.uuid4().hex}.tar"
+        code, stderr = await _run(
+            (
+                str(service.provider.executable),
+                "save",
+                "--format",
+                self.archive_format,
+                "--output",
+                str(tmp_path),
+                image,
+            )
+        )
+        if code != 0:
+            self.logger.warning(
+                "Failed to save image %s with code=%s, stderr=%s",
+                image,
+                code,
+                stderr,
+            )
+            with contextlib.suppress(FileNotFoundError):
+                tmp_path.unlink()
+            return
+        async with self._get_lock():
+            with self._locked():
+                tmp_path.replace(self.archive_path(key))
+                self.logger.info("Saved image %s into archive %s", image, key)
+                # Other processes may have updated the index meanwhile
+                index = self.read_index()
+                index["archives"][key] = dict(
+                    size=self.archive_path(key).stat().st_size, used=self.clock()
+                )
+                index["references"][normalize_image_reference(image)] = key
+                self._evict(index, keep=key)
+                self._write_index(index)
+
+    def _evict(self, index: typing.Dict[str, typing.Any], keep: str):
+        if self.max_size is None:
+            return
+        archives = index["archives"]
+        total = sum(archive["size"] for archive in archives.values())
+        for key in sorted(archives, key=lambda key: archives[key]["used"]):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self.logger.info("Evict image archive %s", key)
+            total -= archives.pop(key)["size"]
+            with contextlib.suppress(FileNotFoundError):
+                self.archive_path(key).unlink()
+        index["references"] = {
+            reference: key
+            for reference, key in index["references"].items()
+            if key in archives
+        }
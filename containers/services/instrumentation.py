@@ -0,0 +1,196 @@
+import bisect
+import dataclasses
+import logging
+import time
+import typing
+
+# Phases of the timing events emitted by the service
+QUEUE = "queue"
+BUILD_COMMAND = "build_command"
+SPAWN = "spawn"
+FIRST_BYTE = "first_byte"
+RUN = "run"
+INSPECT_IMAGE = "inspect_image"
+PULL_IMAGE = "pull_image"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+
+@dataclasses.dataclass
+class TimingEvent:
+    phase: str
+    # Duration in seconds
+    duration: float
+    # Wall clock time in seconds since epoch when the phase ended
+    end_time: float
+    image: typing.Optional[str] = None
+    exit_code: typing.Optional[int] = None
+    attributes: typing.Dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+
+    @property
+    def start_time(self) -> float:
+        return self.end_time - self.duration
+
+
+class Instrument:
+    """Receives timing events of the service phases, subclass to implement hooks"""
+
+    def on_event(self, event: TimingEvent):
+        raise NotImplementedError()
+
+
+class CallbackInstrument(Instrument):
+    def __init__(self, callback: typing.Callable[[TimingEvent], None]):
+        self.callback = callback
+
+    def on_event(self, event: TimingEvent):
+        self.callback(event)
+
+
+class TracingInstrument(Instrument):
+    """Report timing events as spans to an OpenTelemetry style tracer, which has
+    `start_span(name, start_time=..., attributes=...)` returning a span with
+    `end(end_time=...)`, times are in nanoseconds since epoch
+    """
+
+    def __init__(self, tracer: typing.Any, prefix: str = "containers."):
+        self.tracer = tracer
+        self.prefix = prefix
+
+    def on_event(self, event: TimingEvent):
+        attributes = dict(event.attributes)
+        if event.image is not None:
+            attributes["container.image"] = event.image
+        if event.exit_code is not None:
+            attributes["container.exit_code"] = event.exit_code
+        span = self.tracer.start_span(
+            self.prefix + event.phase,
+            start_time=int(event.start_time * 1e9),
+            attributes=attributes,
+        )
+        span.end(end_time=int(event.end_time * 1e9))
+
+
+@dataclasses.dataclass
+class Histogram:
+    buckets: typing.Tuple[float, ...]
+    # The last one counts values above the largest bucket
+    counts: typing.List[int]
+    count: int = 0
+    total: float = 0.0
+    min: float = float("inf")
+    max: float = 0.0
+
+    @classmethod
+    def make(cls, buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> "Histogram":
+        return cls(buckets=tuple(buckets), counts=[0] * (len(buckets) + 1))
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Approximate percentile, reported as the upper bound of the bucket it
+        falls into, clamped by the observed max value
+        """
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        accumulated = 0
+        for index, count in enumerate(self.counts):
+            accumulated += count
+            if accumulated >= rank and count:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                return self.max
+        return self.max
+
+
+class HistogramCollector(Instrument):
+    """In-memory histograms of durations and counts of exit codes by phase"""
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms: typing.Dict[str, Histogram] = {}
+        self.exit_codes: typing.Dict[int, int] = {}
+
+    def on_event(self, event: TimingEvent):
+        histogram = self.histograms.get(event.phase)
+        if histogram is None:
+            histogram = self.histograms[event.phase] = Histogram.make(self.buckets)
+        histogram.observe(event.duration)
+        if event.phase == RUN and event.exit_code is not None:
+            self.exit_codes[event.exit_code] = (
+                self.exit_codes.get(event.exit_code, 0) + 1
+            )
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        return {
+            phase: dict(
+                count=histogram.count,
+                total=histogram.total,
+                mean=histogram.mean,
+                min=histogram.min if histogram.count else 0.0,
+                max=histogram.max,
+                p50=histogram.percentile(50),
+                p95=histogram.percentile(95),
+                p99=histogram.percentile(99),
+            )
+            for phase, histogram in self.histograms.items()
+        }
+
+    def reset(self):
+        self.histograms.clear()
+        self.exit_codes.clear()
+
+
+def emit(
+    instruments: typing.Sequence[Instrument],
+    phase: str,
+    begin: float,
+    image: typing.Optional[str] = None,
+    exit_code: typing.Optional[int] = None,
+    **attributes: typing.Any,
+):
+    """Emit a timing event of the phase began at `begin` (from `time.perf_counter`)
+    to all the instruments
+    """
+    event = TimingEvent(
+        phase=phase,
+        duration=time.perf_counter() - begin,
+        end_time=time.time(),
+        image=image,
+        exit_code=exit_code,
+        attributes=attributes,
+    )
+    for instrument in instruments:
+        try:
+            instrument.on_event(event)
+        except Exception:
+            logger.exception("Failed to emit timing event to %s", instrument)
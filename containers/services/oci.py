@@ -0,0 +1,304 @@
+import asyncio.subprocess
+import collections
+import contextlib
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+import typing
+import uuid
+
+from ..data_types import Container
+from ..data_types import ImageMount
+from ..data_types import PathType
+from ..errors import LoadImageError
+from ..providers.oci import ImageConfig
+from ..providers.oci import OCIRuntime
+from .base import ContainersService
+from .base import DEFAULT_LIMIT
+from .instrumentation import BUILD_COMMAND
+from .instrumentation import emit
+
+DEFAULT_MAX_BUNDLES = 64
+
+
+@dataclasses.dataclass(frozen=True)
+class MountedImage:
+    image: str
+    rootfs: str
+    config: ImageConfig
+
+
+@dataclasses.dataclass
+class _Bundle:
+    path: pathlib.Path
+    config: typing.Dict[str, typing.Any]
+    image_config: ImageConfig
+    # Number of launches using the bundle, it's not evicted while in use
+    users: int = 0
+
+
+def _template_key(container: Container) -> str:
+    """What the bundle of the container depends on, that is everything but the
+    parts applied to each launch by `OCIRuntime.make_launch_config`
+    """
+    resources = container.resources
+    if resources is not None:
+        resources = dataclasses.replace(resources, cpuset_cpus=None, cpuset_mems=None)
+    return repr(
+        dataclasses.replace(
+            container,
+            command=(),
+            environ={},
+            remove=False,
+            timeout=None,
+            name=None,
+            resources=resources,
+        )
+    )
+
+
+class OCIContainersService(ContainersService):
+    """Containers service runs containers with an OCI runtime like crun or runc
+    directly instead of the podman CLI, skipping the overhead of podman for each
+    launch.
+
+    Each image is mounted once with `podman image mount`, which needs root or to
+    run inside `podman unshare`. A bundle is generated into `bundle_dir` for each
+    container template, that is a container without its command, environment,
+    name and cpusets, and reused for all the launches of the template. Launches
+    with another command, environment or cpusets get their own copy of the
+    template config, removed once they exit. Up to `max_bundles` template bundles
+    are kept, the least recently used ones are removed beyond that, so a
+    `bundle_dir` must not be shared with another service.
+    """
+
+    provider: OCIRuntime
+
+    def __init__(
+        self,
+        provider: typing.Optional[OCIRuntime] = None,
+        bundle_dir: typing.Optional[PathType] = None,
+        max_bundles: int = DEFAULT_MAX_BUNDLES,
+        **kwargs,
+    ):
+        super().__init__(provider or OCIRuntime(), **kwargs)
+        # A temp dir is created on the first launch if not provided
+        self._temp_bundle_dir = bundle_dir is None
+        self.bundle_dir: typing.Optional[pathlib.Path] = (
+            pathlib.Path(bundle_dir) if bundle_dir is not None else None
+        )
+        self.max_bundles = max_bundles
+        self._mounted_images: typing.Dict[str, asyncio.Future] = {}
+        # Template key to the future of its bundle, least recently used first
+        self._bundles: typing.OrderedDict[str, asyncio.Future] = (
+            collections.OrderedDict()
+        )
+
+    async def _podman(self, *args: str) -> bytes:
+        proc = await asyncio.create_subprocess_exec(
+            str(self.provider.executable),
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise LoadImageError(
+                args[-1], proc.returncode, stderr.decode(errors="replace")
+            )
+        return stdout
+
+    async def _mount_image(self, image: str) -> MountedImage:
+        await self.load_image(image)
+        (item,) = json.loads(
+            await self._podman("image", "inspect", "--format", "json", image)
+        )
+        rootfs = (await self._podman("image", "mount", image)).decode().strip()
+        self.logger.info("Mounted image %s at %s", image, rootfs)
+        return MountedImage(
+            image=image, rootfs=rootfs, config=ImageConfig.from_inspect(item)
+        )
+
+    async def mount_image(self, image: str) -> MountedImage:
+        """Mount the image if not mounted yet, concurrent calls for the same image
+        share the same mount
+        """
+        future = self._mounted_images.get(image)
+        if future is None:
+            future = asyncio.ensure_future(self._mount_image(image))
+            self._mounted_images[image] = future
+
+            def _done(done_future: asyncio.Future):
+                # Try again next time if it failed
+                if done_future.cancelled() or done_future.exception() is not None:
+                    if self._mounted_images.get(image) is done_future:
+                        del self._mounted_images[image]
+
+            future.add_done_callback(_done)
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _write_config(bundle: pathlib.Path, config: typing.Dict[str, typing.Any]):
+        bundle.mkdir(parents=True, exist_ok=True)
+        # Written to a temp file first, as the runtime must never see it partial
+        with tempfile.NamedTemporaryFile(
+            dir=bundle, prefix=".config-", delete=False
+        ) as fo:
+            fo.write(json.dumps(config, sort_keys=True).encode())
+        os.replace(fo.name, bundle / "config.json")
+
+    def _get_bundle_dir(self) -> pathlib.Path:
+        if self.bundle_dir is None:
+            self.bundle_dir = pathlib.Path(
+                tempfile.mkdtemp(prefix="container-helpers-bundles-")
+            )
+        return self.bundle_dir
+
+    async def _make_bundle(self, key: str, container: Container) -> _Bundle:
+        sources = [
+            mount.source for mount in container.mounts if isinstance(mount, ImageMount)
+        ]
+        mounted_image, *mounted_sources = await asyncio.gather(
+            *map(self.mount_image, [container.image, *sources])
+        )
+        bundle = self._get_bundle_dir() / hashlib.sha256(key.encode()).hexdigest()
+        loop = asyncio.get_running_loop()
+        # Reading the passwd and seccomp files and writing the bundle are blocking
+        config = await loop.run_in_executor(
+            None,
+            functools.partial(
+                self.provider.make_config,
+                container,
+                rootfs=mounted_image.rootfs,
+                image_config=mounted_image.config,
+                image_mounts={
+                    mounted.image: mounted.rootfs for mounted in mounted_sources
+                },
+            ),
+        )
+        await loop.run_in_executor(None, self._write_config, bundle, config)
+        return _Bundle(path=bundle, config=config, image_config=mounted_image.config)
+
+    async def _get_bundle(self, container: Container) -> _Bundle:
+        """The bundle of the template of the container, concurrent calls for the
+        same template share the same bundle
+        """
+        key = _template_key(container)
+        future = self._bundles.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._make_bundle(key, container))
+            self._bundles[key] = future
+
+            def _done(done_future: asyncio.Future):
+                # Try again next time if it failed
+                if done_future.cancelled() or done_future.exception() is not None:
+                    if self._bundles.get(key) is done_future:
+                        del self._bundles[key]
+
+            future.add_done_callback(_done)
+        else:
+            self._bundles.move_to_end(key)
+        bundle = await asyncio.shield(future)
+        await self._evict_bundles()
+        return bundle
+
+    async def _evict_bundles(self):
+        evicted = []
+        for key, future in list(self._bundles.items()):
+            if len(self._bundles) <= self.max_bundles:
+                break
+            if not future.done() or future.cancelled() or future.exception():
+                continue
+            bundle = future.result()
+            if bundle.users:
+                continue
+            del self._bundles[key]
+            evicted.append(bundle.path)
+        for path in evicted:
+            self.logger.debug("Evict bundle %s", path)
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(shutil.rmtree, path, ignore_errors=True)
+            )
+
+    @contextlib.asynccontextmanager
+    async def prepare_bundle(
+        self, container: Container
+    ) -> typing.AsyncContextManager[pathlib.Path]:
+        """Mount the images of the container and get the bundle of its template,
+        with a bundle of its own if its command, environment or cpusets differ from
+        the template ones. The bundle is kept until the context exits.
+        """
+        bundle = await self._get_bundle(container)
+        config = self.provider.make_launch_config(
+            bundle.config, container, image_config=bundle.image_config
+        )
+        bundle.users += 1
+        try:
+            if config == bundle.config:
+                yield bundle.path
+                return
+            path = self._get_bundle_dir() / f"launch-{uuid.uuid4().hex}"
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_config, path, config)
+            try:
+                yield path
+            finally:
+                await loop.run_in_executor(
+                    None, functools.partial(shutil.rmtree, path, ignore_errors=True)
+                )
+        finally:
+            bundle.users -= 1
+
+    @contextlib.asynccontextmanager
+    async def _run(
+        self,
+        container: Container,
+        stdin: typing.Optional[int] = None,
+        stdout: typing.Optional[int] = None,
+        stderr: typing.Optional[int] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+        log_level: typing.Optional[str] = None,
+    ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
+        instruments = self.instruments
+        if instruments:
+            begin = time.perf_counter()
+        container_id = container.name or f"container-helpers-{uuid.uuid4().hex}"
+        async with self.prepare_bundle(container) as bundle:
+            command = self.provider.build_run_command(
+                bundle, container_id, log_level=log_level
+            )
+            if instruments:
+                emit(instruments, BUILD_COMMAND, begin, image=container.image)
+            if stdin is None and not container.interactive:
+                # Like podman, stdin is only passed to interactive containers
+                stdin = asyncio.subprocess.DEVNULL
+            async with self._spawn(
+                command,
+                image=container.image,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                runtime_env=runtime_env,
+                limit=limit,
+            ) as proc:
+                yield proc
+
+    async def close(self):
+        """Unmount the images and remove the temp bundles"""
+        await super().close()
+        for image, future in list(self._mounted_images.items()):
+            if future.done() and not future.cancelled() and not future.exception():
+                with contextlib.suppress(LoadImageError):
+                    await self._podman("image", "unmount", image)
+        self._mounted_images.clear()
+        if self._temp_bundle_dir and self.bundle_dir is not None:
+            shutil.rmtree(self.bundle_dir, ignore_errors=True)
+            self.bundle_dir = None
+        self._bundles.clear()
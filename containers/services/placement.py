@@ -0,0 +1,251 @@
+import asyncio
+import contextlib
+import dataclasses
+import logging
+import math
+import pathlib
+import typing
+
+from ..data_types import Container
+from ..data_types import PathType
+from ..data_types import ResourceLimits
+
+
+def parse_cpu_list(value: str) -> typing.List[int]:
+    """Parse a kernel cpu list like 0-3,8 into a sorted list of numbers"""
+    cpus = set()
+    for part in value.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: typing.Iterable[int]) -> str:
+    """Format numbers as a kernel cpu list like 0-3,8"""
+    parts = []
+    start = end = None
+    for cpu in sorted(cpus):
+        if end is not None and cpu == end + 1:
+            end = cpu
+            continue
+        if start is not None:
+            parts.append(str(start) if start == end else f"{start}-{end}")
+        start = end = cpu
+    if start is not None:
+        parts.append(str(start) if start == end else f"{start}-{end}")
+    return ",".join(parts)
+
+
+@dataclasses.dataclass(frozen=True)
+class NUMANode:
+    id: int
+    cpus: typing.Tuple[int, ...]
+
+
+@dataclasses.dataclass(frozen=True)
+class CPUTopology:
+    nodes: typing.Tuple[NUMANode, ...]
+
+    @property
+    def cpus(self) -> typing.Tuple[int, ...]:
+        return tuple(cpu for node in self.nodes for cpu in node.cpus)
+
+    @classmethod
+    def from_sysfs(cls, root: PathType = "/sys") -> "CPUTopology":
+        """Read the NUMA nodes and their online CPUs from a sysfs tree, all CPUs
+        belong to node 0 if the kernel has no NUMA support
+        """
+        system = pathlib.Path(root) / "devices" / "system"
+        nodes = []
+        for node_dir in (system / "node").glob("node[0-9]*"):
+            cpus = parse_cpu_list((node_dir / "cpulist").read_text())
+            if cpus:
+                nodes.append(NUMANode(id=int(node_dir.name[4:]), cpus=tuple(cpus)))
+        if not nodes:
+            cpus = parse_cpu_list((system / "cpu" / "online").read_text())
+            nodes.append(NUMANode(id=0, cpus=tuple(cpus)))
+        return cls(nodes=tuple(sorted(nodes, key=lambda node: node.id)))
+
+
+@dataclasses.dataclass(frozen=True)
+class Placement:
+    cpus: typing.Tuple[int, ...]
+    nodes: typing.Tuple[int, ...]
+
+    @property
+    def cpuset_cpus(self) -> str:
+        return format_cpu_list(self.cpus)
+
+    @property
+    def cpuset_mems(self) -> str:
+        return format_cpu_list(self.nodes)
+
+
+# Free CPUs of each node in the topology order
+FreeCPUs = typing.Dict[int, typing.List[int]]
+
+
+class PlacementStrategy:
+    """Pick `count` CPUs out of the free ones, or None if it cannot be placed now"""
+
+    def select(self, free: FreeCPUs, count: int) -> typing.Optional[typing.List[int]]:
+        raise NotImplementedError()
+
+
+def _take_across(
+    free: FreeCPUs, count: int, order: typing.Sequence[int]
+) -> typing.Optional[typing.List[int]]:
+    if sum(len(cpus) for cpus in free.values()) < count:
+        return None
+    selected = []
+    for node_id in order:
+        selected.extend(free[node_id][: count - len(selected)])
+        if len(selected) == count:
+            break
+    return selected
+
+
+class PackStrategy(PlacementStrategy):
+    """Fill up the busiest node that still fits the container, leaving the other
+    nodes free for big containers, split across nodes only if none fits
+    """
+
+    def select(self, free: FreeCPUs, count: int) -> typing.Optional[typing.List[int]]:
+        fits = [node_id for node_id, cpus in free.items() if len(cpus) >= count]
+        if fits:
+            node_id = min(fits, key=lambda node_id: len(free[node_id]))
+            return free[node_id][:count]
+        order = sorted(free, key=lambda node_id: -len(free[node_id]))
+        return _take_across(free, count, order)
+
+
+class SpreadStrategy(PlacementStrategy):
+    """Place on the least busy node to balance the load among nodes, split across
+    nodes only if none fits
+    """
+
+    def select(self, free: FreeCPUs, count: int) -> typing.Optional[typing.List[int]]:
+        order = sorted(free, key=lambda node_id: -len(free[node_id]))
+        if order and len(free[order[0]]) >= count:
+            return free[order[0]][:count]
+        return _take_across(free, count, order)
+
+
+class NUMALocalStrategy(PlacementStrategy):
+    """Never split a container across nodes, so that all its memory accesses are
+    local, it waits until a single node has enough free CPUs
+    """
+
+    def select(self, free: FreeCPUs, count: int) -> typing.Optional[typing.List[int]]:
+        fits = [node_id for node_id, cpus in free.items() if len(cpus) >= count]
+        if not fits:
+            return None
+        node_id = min(fits, key=lambda node_id: len(free[node_id]))
+        return free[node_id][:count]
+
+
+class PlacementManager:
+    """Assign each launched container its own CPUs and NUMA memory nodes, and wait
+    for CPUs to be released when all of them are in use.
+
+    The number of CPUs needed is the `cpus` resource limit of the container rounded
+    up, or `default_cpus`. Containers with `cpuset_cpus` already set are left alone.
+    """
+
+    def __init__(
+        self,
+        topology: typing.Optional[CPUTopology] = None,
+        strategy: typing.Optional[PlacementStrategy] = None,
+        default_cpus: int = 1,
+    ):
+        self.topology = topology if topology is not None else CPUTopology.from_sysfs()
+        self.strategy = strategy if strategy is not None else NUMALocalStrategy()
+        self.default_cpus = default_cpus
+        self.logger = logging.getLogger(__name__)
+        self._node_of = {
+            cpu: node.id for node in self.topology.nodes for cpu in node.cpus
+        }
+        self._used: typing.Set[int] = set()
+        # Created lazily so that the condition is bound to the running loop
+        self._condition: typing.Optional[asyncio.Condition] = None
+
+    def usage(self) -> typing.Dict[int, int]:
+        """Number of CPUs in use on each node"""
+        usage = {node.id: 0 for node in self.topology.nodes}
+        for cpu in self._used:
+            usage[self._node_of[cpu]] += 1
+        return usage
+
+    def get_cpu_count(self, container: Container) -> int:
+        if container.resources is not None and container.resources.cpus is not None:
+            return math.ceil(container.resources.cpus)
+        return self.default_cpus
+
+    def try_acquire(self, count: int) -> typing.Optional[Placement]:
+        if count > len(self._node_of):
+            raise ValueError(
+                f"Cannot place {count} CPUs on a host with {len(self._node_of)} CPUs"
+            )
+        free = {
+            node.id: [cpu for cpu in node.cpus if cpu not in self._used]
+            for node in self.topology.nodes
+        }
+        cpus = self.strategy.select(free, count)
+        if cpus is None:
+            if not self._used:
+                # Nothing to wait for, it can never be placed
+                raise ValueError(
+                    f"Cannot place {count} CPUs with {self.strategy.__class__.__name__}"
+                )
+            return None
+        self._used.update(cpus)
+        return Placement(
+            cpus=tuple(sorted(cpus)),
+            nodes=tuple(sorted({self._node_of[cpu] for cpu in cpus})),
+        )
+
+    async def acquire(self, count: int) -> Placement:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while True:
+                placement = self.try_acquire(count)
+                if placement is not None:
+                    return placement
+                await self._condition.wait()
+
+    async def release(self, placement: Placement):
+        self._used.difference_update(placement.cpus)
+        if self._condition is not None:
+            async with self._condition:
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def place(
+        self, container: Container
+    ) -> typing.AsyncContextManager[Container]:
+        """Pin the container to its placement until the context exits"""
+        resources = container.resources
+        if resources is not None and resources.cpuset_cpus is not None:
+            yield container
+            return
+        placement = await self.acquire(self.get_cpu_count(container))
+        self.logger.debug(
+            "Place container of image %s on CPUs %s of nodes %s",
+            container.image,
+            placement.cpuset_cpus,
+            placement.cpuset_mems,
+        )
+        try:
+            yield dataclasses.replace(
+                container,
+                resources=dataclasses.replace(
+                    resources if resources is not None else ResourceLimits(),
+                    cpuset_cpus=placement.cpuset_cpus,
+                    cpuset_mems=placement.cpuset_mems,
+                ),
+            )
+        finally:
+            await self.release(placement)
@@ -0,0 +1,298 @@
+import asyncio.subprocess
+import collections
+import contextlib
+import dataclasses
+import logging
+import shlex
+import time
+import typing
+import uuid
+
+from ..data_types import Container
+from ..errors import ContainerRunError
+from ..providers.podman import Podman
+from .base import ContainersService
+from .base import DEFAULT_LIMIT
+
+
+@dataclasses.dataclass
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    created: int = 0
+    create_failures: int = 0
+    evicted: int = 0
+
+
+@dataclasses.dataclass
+class PooledContainer:
+    container_id: str
+    created_at: float
+
+
+class ContainerPool:
+    """Keep up to `max_size` containers created (`podman create`) ahead of time
+    from a container template, so that running one only takes a `podman start`.
+
+    Warm containers idle for longer than `idle_timeout` are evicted and replaced
+    with new ones. When no warm container is available, a cold `podman run` is
+    done instead. Warm containers go through the same launch scheduler, placement,
+    termination and instrumentation of the service as cold ones, and they are
+    removed once the run is done. A named template gets a unique suffix appended
+    to the name of each warm container. The service must run containers with the
+    podman CLI, the OCI runtime and REST API services are not supported.
+    """
+
+    def __init__(
+        self,
+        service: ContainersService,
+        container: Container,
+        max_size: int = 1,
+        idle_timeout: typing.Optional[float] = None,
+        log_level: typing.Optional[str] = None,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        if not isinstance(service.provider, Podman):
+            raise TypeError(
+                f"{type(service).__name__} is not supported by ContainerPool, "
+                "it requires a service with the podman CLI provider"
+            )
+        self.service = service
+        self.container = container
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.log_level = log_level
+        self.clock = clock
+        self.stats = PoolStats()
+        self.logger = logging.getLogger(__name__)
+        self._idle: typing.Deque[PooledContainer] = collections.deque()
+        self._creating = 0
+        self._expired: typing.List[str] = []
+        self._wakeup: typing.Optional[asyncio.Event] = None
+        self._maintain_task: typing.Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    async def start(self):
+        if self._maintain_task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._maintain_task = asyncio.create_task(self._maintain())
+
+    async def close(self):
+        self._closed = True
+        if self._maintain_task is not None:
+            self._maintain_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._maintain_task
+            self._maintain_task = None
+        idle = [item.container_id for item in self._idle]
+        self._idle.clear()
+        self.stats.evicted += len(idle)
+        expired = self._expired
+        self._expired = []
+        await self._remove([*expired, *idle])
+
+    async def __aenter__(self) -> "ContainerPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def fill(self):
+        """Create containers until the pool is full"""
+        missing = self.max_size - len(self._idle) - self._creating
+        if missing <= 0:
+            return
+        await asyncio.gather(*(self._create() for _ in range(missing)))
+
+    async def evict_expired(self):
+        now = self.clock()
+        expired = self._expired
+        self._expired = []
+        while (
+            self.idle_timeout is not None
+            and self._idle
+            and now - self._idle[0].created_at >= self.idle_timeout
+        ):
+            self.stats.evicted += 1
+            expired.append(self._idle.popleft().container_id)
+        if expired:
+            self.logger.debug("Evict expired idle containers %s", expired)
+            await self._remove(expired)
+
+    async def _create(self):
+        self._creating += 1
+        container = self.container
+        if container.name is not None:
+            # Names must be unique, and many containers are created ahead of time
+            container = dataclasses.replace(
+                container, name=f"{container.name}-{uuid.uuid4().hex[:12]}"
+            )
+        try:
+            command = self.service.provider.build_create_command(
+                container, log_level=self.log_level
+            )
+            self.logger.debug(
+                "Create pooled container with command: %s",
+                " ".join(map(shlex.quote, command)),
+            )
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await proc.communicate()
+        finally:
+            self._creating -= 1
+        if proc.returncode != 0:
+            self.stats.create_failures += 1
+            self.logger.error(
+                "Failed to create pooled container with code=%s, stderr=%s",
+                proc.returncode,
+                stderr,
+            )
+            return
+        container_id = stdout.decode().strip()
+        if self._closed:
+            await self._remove([container_id])
+            return
+        self.stats.created += 1
+        self._idle.append(
+            PooledContainer(container_id=container_id, created_at=self.clock())
+        )
+
+    async def _remove(self, container_ids: typing.List[str]):
+        if not container_ids:
+            return
+        proc = await asyncio.create_subprocess_exec(
+            *self.service.provider.build_remove_command(
+                *container_ids, log_level=self.log_level
+            ),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await proc.wait()
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self.evict_expired()
+                await self.fill()
+            except Exception:
+                self.logger.exception("Failed to maintain container pool")
+            timeout = None
+            if self._idle and self.idle_timeout is not None:
+                timeout = max(
+                    self._idle[0].created_at + self.idle_timeout - self.clock(), 0
+                )
+            # Back off a bit when the pool cannot be filled due to creation errors
+            if len(self._idle) + self._creating < self.max_size:
+                timeout = 1.0 if timeout is None else min(timeout, 1.0)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            self._wakeup.clear()
+
+    def _take(self) -> typing.Optional[PooledContainer]:
+        now = self.clock()
+        while self._idle:
+            item = self._idle.popleft()
+            if (
+                self.idle_timeout is not None
+                and now - item.created_at >= self.idle_timeout
+            ):
+                # Leave the removal to the maintenance task to keep this fast
+                self.stats.evicted += 1
+                self._expired.append(item.container_id)
+                continue
+            return item
+        return None
+
+    async def _update_placement(self, container_id: str, container: Container):
+        # The warm container was created with the resources of the template
+        resources = container.resources
+        template_resources = self.container.resources
+        if resources is None or resources == template_resources:
+            return
+        command = self.service.provider.build_update_command(
+            container_id,
+            cpuset_cpus=resources.cpuset_cpus,
+            cpuset_mems=resources.cpuset_mems,
+            log_level=self.log_level,
+        )
+        code = await self.service._run_podman_command(command)
+        if code != 0:
+            raise ContainerRunError(container.image, code, b"", b"")
+
+    @contextlib.asynccontextmanager
+    async def run(
+        self,
+        stdin: typing.Optional[int] = None,
+        stdout: typing.Optional[int] = None,
+        stderr: typing.Optional[int] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+        priority: int = 0,
+    ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
+        item = self._take()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if item is None:
+            self.stats.misses += 1
+            self.logger.debug("No warm container available, run a cold one")
+            async with self.service.run(
+                self.container,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                runtime_env=runtime_env,
+                limit=limit,
+                log_level=self.log_level,
+                priority=priority,
+            ) as proc:
+                yield proc
+            return
+        self.stats.hits += 1
+        service = self.service
+        proc: typing.Optional[asyncio.subprocess.Process] = None
+        try:
+            async with (
+                service._launch_slot(self.container.image, priority=priority),
+                service._place(self.container) as container,
+            ):
+                await self._update_placement(item.container_id, container)
+                command = service.provider.build_start_command(
+                    item.container_id,
+                    interactive=self.container.interactive,
+                    log_level=self.log_level,
+                )
+                async with service._spawn(
+                    command,
+                    image=self.container.image,
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=stderr,
+                    runtime_env=runtime_env,
+                    limit=limit,
+                ) as proc:
+                    if service.termination is None:
+                        yield proc
+                    else:
+                        # Killed and removed by its ID
+                        async with service._enforce_termination(
+                            dataclasses.replace(container, name=item.container_id),
+                            proc,
+                            log_level=self.log_level,
+                        ):
+                            yield proc
+        finally:
+            # Shielded so that the container is still removed if we get cancelled
+            await asyncio.shield(self._remove([item.container_id]))
+            if proc is not None and proc.returncode is None:
+                # The container is gone, don't leave the podman process behind
+                with contextlib.suppress(ProcessLookupError):
+                    proc.kill()
@@ -0,0 +1,209 @@
+import asyncio
+import contextlib
+import dataclasses
+import itertools
+import logging
+import os
+import pathlib
+import time
+import typing
+
+from .instrumentation import Histogram
+
+
+class AdmissionPolicy:
+    """Decide whether a new launch can be admitted given the host resources"""
+
+    def admit(self) -> bool:
+        raise NotImplementedError()
+
+
+class ResourceAdmission(AdmissionPolicy):
+    """Admit launches only when the load average per CPU is below `max_load` and
+    the available memory is above `min_available_memory` bytes
+    """
+
+    def __init__(
+        self,
+        max_load: typing.Optional[float] = None,
+        min_available_memory: typing.Optional[int] = None,
+        meminfo_path: pathlib.Path = pathlib.Path("/proc/meminfo"),
+    ):
+        self.max_load = max_load
+        self.min_available_memory = min_available_memory
+        self.meminfo_path = meminfo_path
+
+    def get_load(self) -> float:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+    def get_available_memory(self) -> int:
+        with open(self.meminfo_path, "rt") as fo:
+            for line in fo:
+                key, _, value = line.partition(":")
+                if key == "MemAvailable":
+                    # The value is in kB
+                    return int(value.split()[0]) * 1024
+        raise ValueError(f"MemAvailable not found in {self.meminfo_path}")
+
+    def admit(self) -> bool:
+        if self.max_load is not None and self.get_load() > self.max_load:
+            return False
+        if (
+            self.min_available_memory is not None
+            and self.get_available_memory() < self.min_available_memory
+        ):
+            return False
+        return True
+
+
+@dataclasses.dataclass
+class SchedulerStats:
+    admitted: int = 0
+    # How many times dispatching was deferred by the admission policy
+    deferred: int = 0
+    running: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    wait_time: Histogram = dataclasses.field(default_factory=Histogram.make)
+
+
+@dataclasses.dataclass(order=True)
+class _Waiter:
+    sort_key: typing.Tuple[int, int]
+    image: str = dataclasses.field(compare=False)
+    future: asyncio.Future = dataclasses.field(compare=False)
+
+
+class LaunchScheduler:
+    """Limit how many containers are launched concurrently, globally and per image.
+
+    Launches beyond the limits wait in a queue, ordered by priority (higher first)
+    and then FIFO. A waiting launch of an image at its limit doesn't block the
+    launches of other images behind it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: typing.Optional[int] = None,
+        per_image_limit: typing.Optional[int] = None,
+        admission: typing.Optional[AdmissionPolicy] = None,
+        admission_retry_interval: float = 0.5,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_image_limit = per_image_limit
+        self.admission = admission
+        self.admission_retry_interval = admission_retry_interval
+        self.stats = SchedulerStats()
+        self.logger = logging.getLogger(__name__)
+        self._running_images: typing.Dict[str, int] = {}
+        self._waiters: typing.List[_Waiter] = []
+        self._counter = itertools.count()
+        self._retry_handle: typing.Optional[asyncio.TimerHandle] = None
+
+    def _has_capacity(self, image: str) -> bool:
+        if (
+            self.max_concurrency is not None
+            and self.stats.running >= self.max_concurrency
+        ):
+            return False
+        if (
+            self.per_image_limit is not None
+            and self._running_images.get(image, 0) >= self.per_image_limit
+        ):
+            return False
+        return True
+
+    def _admit(self) -> bool:
+        if self.admission is None or self.admission.admit():
+            return True
+        self.stats.deferred += 1
+        self.logger.debug("Launch deferred by admission policy %s", self.admission)
+        if self._retry_handle is None:
+            loop = asyncio.get_running_loop()
+            self._retry_handle = loop.call_later(
+                self.admission_retry_interval, self._retry_dispatch
+            )
+        return False
+
+    def _retry_dispatch(self):
+        self._retry_handle = None
+        self._dispatch()
+
+    def _acquire(self, image: str):
+        self.stats.running += 1
+        self.stats.admitted += 1
+        self._running_images[image] = self._running_images.get(image, 0) + 1
+
+    def _release(self, image: str):
+        self.stats.running -= 1
+        count = self._running_images[image] - 1
+        if count:
+            self._running_images[image] = count
+        else:
+            del self._running_images[image]
+        self._dispatch()
+
+    def _dispatch(self):
+        if not self._waiters:
+            return
+        self._waiters.sort()
+        remaining = []
+        for index, waiter in enumerate(self._waiters):
+            if waiter.future.done():
+                continue
+            if not self._has_capacity(waiter.image):
+                remaining.append(waiter)
+                continue
+            if not self._admit():
+                remaining.extend(self._waiters[index:])
+                break
+            self._acquire(waiter.image)
+            waiter.future.set_result(None)
+        self._waiters = remaining
+        self.stats.queue_depth = len(remaining)
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, image: str, priority: int = 0
+    ) -> typing.AsyncContextManager[None]:
+        begin = time.perf_counter()
+        fast_path = not self._waiters and self._has_capacity(image)
+        if fast_path and self._admit():
+            self._acquire(image)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(
+                _Waiter(
+                    sort_key=(-priority, next(self._counter)),
+                    image=image,
+                    future=future,
+                )
+            )
+            self.stats.queue_depth = len(self._waiters)
+            self.stats.max_queue_depth = max(
+                self.stats.max_queue_depth, self.stats.queue_depth
+            )
+            if not fast_path:
+                # A denied fast path already scheduled a retry, admitting it
+                # again right away would count it as deferred twice
+                self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted right before we got cancelled
+                    self._release(image)
+                else:
+                    future.cancel()
+                    self._waiters = [
+                        waiter
+                        for waiter in self._waiters
+                        if waiter.future is not future
+                    ]
+                    self.stats.queue_depth = len(self._waiters)
+                raise
+        self.stats.wait_time.observe(time.perf_counter() - begin)
+        try:
+            yield
+        finally:
+            self._release(image)
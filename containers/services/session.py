@@ -0,0 +1,136 @@
+import asyncio.subprocess
+import contextlib
+import dataclasses
+import logging
+import typing
+
+from ..data_types import Container
+from ..data_types import PathType
+from ..providers.podman import Podman
+from .base import ContainersService
+from .base import DEFAULT_LIMIT
+
+# Keep the container running until the session is closed
+KEEPALIVE_COMMAND = ("sleep", "infinity")
+
+
+class ContainerSession:
+    """A long-lived container started from a container template, to run many
+    commands in it with `podman exec` and pay the container startup cost only once.
+
+    The container runs `keepalive_command` instead of the template command, and
+    it's removed when the session is closed. The service must run containers with
+    the podman CLI, the OCI runtime and REST API services are not supported.
+    """
+
+    def __init__(
+        self,
+        service: ContainersService,
+        container: Container,
+        keepalive_command: typing.Sequence[str] = KEEPALIVE_COMMAND,
+        runtime_env: typing.Optional[dict] = None,
+        log_level: typing.Optional[str] = None,
+        priority: int = 0,
+    ):
+        if not isinstance(service.provider, Podman):
+            raise TypeError(
+                f"{type(service).__name__} is not supported by ContainerSession, "
+                "it requires a service with the podman CLI provider"
+            )
+        self.service = service
+        self.container = dataclasses.replace(
+            container, command=tuple(keepalive_command)
+        )
+        self.runtime_env = runtime_env
+        self.log_level = log_level
+        self.priority = priority
+        self.container_id: typing.Optional[str] = None
+        self.exec_count = 0
+        self.logger = logging.getLogger(__name__)
+        self._exit_stack: typing.Optional[contextlib.AsyncExitStack] = None
+
+    async def start(self):
+        if self._exit_stack is not None:
+            return
+        exit_stack = contextlib.AsyncExitStack()
+        try:
+            # The launch slot and placement are held for the whole session
+            await exit_stack.enter_async_context(
+                self.service._launch_slot(self.container.image, priority=self.priority)
+            )
+            self.container = await exit_stack.enter_async_context(
+                self.service._place(self.container)
+            )
+            self.container_id = await self.service._launch_detached(
+                self.container, runtime_env=self.runtime_env, log_level=self.log_level
+            )
+        except BaseException:
+            await exit_stack.aclose()
+            raise
+        self._exit_stack = exit_stack
+        self.logger.debug("Session container %s started", self.container_id)
+
+    async def close(self):
+        if self._exit_stack is None:
+            return
+        exit_stack = self._exit_stack
+        self._exit_stack = None
+        try:
+            self.logger.debug("Remove session container %s", self.container_id)
+            # Shielded so that the container is still removed if we get cancelled
+            await asyncio.shield(
+                self.service._run_podman_command(
+                    self.service.provider.build_remove_command(
+                        self.container_id, log_level=self.log_level
+                    )
+                )
+            )
+        finally:
+            await exit_stack.aclose()
+
+    async def __aenter__(self) -> "ContainerSession":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @contextlib.asynccontextmanager
+    async def exec(
+        self,
+        command: typing.Sequence[str],
+        stdin: typing.Optional[int] = None,
+        stdout: typing.Optional[int] = None,
+        stderr: typing.Optional[int] = None,
+        environ: typing.Optional[typing.Dict[str, str]] = None,
+        work_dir: typing.Optional[PathType] = None,
+        user: typing.Optional[str] = None,
+        runtime_env: typing.Optional[dict] = None,
+        limit: int = DEFAULT_LIMIT,
+    ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
+        """Run the command in the session container, `environ` is added to the
+        environment of the container, and `work_dir` and `user` override its ones
+        """
+        if self._exit_stack is None:
+            raise RuntimeError("Session is not started")
+        command = self.service.provider.build_exec_command(
+            self.container_id,
+            command,
+            interactive=self.container.interactive,
+            tty=self.container.tty,
+            environ=environ,
+            work_dir=work_dir,
+            user=user,
+            log_level=self.log_level,
+        )
+        self.exec_count += 1
+        async with self.service._spawn(
+            command,
+            image=self.container.image,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            runtime_env=runtime_env,
+            limit=limit,
+        ) as proc:
+            yield proc
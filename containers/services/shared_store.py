@@ -0,0 +1,189 @@
+import asyncio.subprocess
+import logging
+import pathlib
+import typing
+
+from ..data_types import PathType
+from ..errors import LoadImageError
+from .batch import LoadImageResult
+from .batch import LoadImagesReport
+from .batch import LoadImageStatus
+from .image_sources import ImageSource
+
+if typing.TYPE_CHECKING:
+    from .base import ContainersService
+
+DEFAULT_SHARED_STORE = pathlib.Path("/var/lib/shared")
+
+
+class SharedImageStore(ImageSource):
+    """A read-only image store shared by many podman instances or users of a host,
+    set up as `additionalimagestores` in their `storage.conf`, so that each image
+    is stored once for all of them.
+
+    The store is populated by pulling into it with podman's `--root` option, which
+    needs write access to it. It's usually owned by root and read-only for the
+    other users, so an unprivileged user can use its images but not populate it,
+    that's for its owner to do, e.g. when provisioning the host.
+
+    As an image source of `ContainersService`, images present in the store are
+    loaded once the podman of the service can see them, which it only does if the
+    store is in its `additionalimagestores`, otherwise they are pulled as usual.
+    With `pull_missing=True` the missing ones are pulled into the store instead
+    of the store of the service, which needs write access to the store too.
+    """
+
+    def __init__(
+        self,
+        root: PathType = DEFAULT_SHARED_STORE,
+        executable: typing.Optional[pathlib.Path] = None,
+        storage_driver: typing.Optional[str] = None,
+        pull_missing: bool = False,
+    ):
+        self.root = pathlib.Path(root)
+        # The podman of the service is used if not provided
+        self.executable = executable
+        self.storage_driver = storage_driver
+        self.pull_missing = pull_missing
+        self.logger = logging.getLogger(__name__)
+
+    def build_command(
+        self, *args: str, executable: typing.Optional[pathlib.Path] = None
+    ) -> typing.Tuple[str, ...]:
+        executable = self.executable or executable or pathlib.Path("podman")
+        command = [str(executable), "--root", str(self.root)]
+        if self.storage_driver is not None:
+            command.extend(["--storage-driver", self.storage_driver])
+        command.extend(args)
+        return tuple(command)
+
+    async def _run(
+        self, *args: str, executable: typing.Optional[pathlib.Path] = None
+    ) -> typing.Tuple[int, bytes, bytes]:
+        command = self.build_command(*args, executable=executable)
+        self.logger.debug("Running shared store command %s", " ".join(command))
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        return proc.returncode, stdout, stderr
+
+    async def contains(
+        self, image: str, executable: typing.Optional[pathlib.Path] = None
+    ) -> bool:
+        code, _, _ = await self._run(
+            "image", "inspect", "--format", "{{.Id}}", image, executable=executable
+        )
+        return code == 0
+
+    async def list_images(
+        self, executable: typing.Optional[pathlib.Path] = None
+    ) -> typing.List[str]:
+        """The references of the images in the store"""
+        code, stdout, stderr = await self._run(
+            "images", "--format", "{{.Repository}}:{{.Tag}}", executable=executable
+        )
+        if code != 0:
+            raise LoadImageError(str(self.root), code, stderr.decode(errors="replace"))
+        return [line for line in stdout.decode().splitlines() if line]
+
+    async def pull(
+        self,
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+        executable: typing.Optional[pathlib.Path] = None,
+    ):
+        """Pull the image into the store"""
+        args = ["pull", image]
+        if credentials is not None:
+            args.extend(["--creds", ":".join(credentials)])
+        self.logger.info("Pulling image %s into shared store %s", image, self.root)
+        code, _, stderr = await self._run(*args, executable=executable)
+        if code != 0:
+            stderr_text = stderr.decode(errors="replace")
+            self.logger.error(
+                "Failed to pull image %s into shared store with code=%s, stderr=%s",
+                image,
+                code,
+                stderr_text,
+            )
+            raise LoadImageError(image, code, stderr_text)
+
+    async def remove(
+        self, *images: str, executable: typing.Optional[pathlib.Path] = None
+    ):
+        """Remove the images from the store, the layers still used by other images
+        are kept
+        """
+        code, _, stderr = await self._run(
+            "rmi", "--force", *images, executable=executable
+        )
+        if code != 0:
+            raise LoadImageError(
+                ", ".join(images), code, stderr.decode(errors="replace")
+            )
+
+    async def populate(
+        self,
+        images: typing.Iterable[str],
+        concurrency: int = 4,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+        executable: typing.Optional[pathlib.Path] = None,
+    ) -> LoadImagesReport:
+        """Make sure all the images are in the store, pulling the missing ones.
+        Failures are collected in the returned report instead of being raised.
+        """
+        loop = asyncio.get_running_loop()
+        begin = loop.time()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _populate(image: str) -> LoadImageResult:
+            async with semaphore:
+                image_begin = loop.time()
+                if await self.contains(image, executable=executable):
+                    status = LoadImageStatus.PRESENT
+                else:
+                    try:
+                        await self.pull(
+                            image, credentials=credentials, executable=executable
+                        )
+                    except LoadImageError as exc:
+                        return LoadImageResult(
+                            image=image,
+                            status=LoadImageStatus.FAILED,
+                            elapsed=loop.time() - image_begin,
+                            error=exc,
+                        )
+                    status = LoadImageStatus.PULLED
+                return LoadImageResult(
+                    image=image, status=status, elapsed=loop.time() - image_begin
+                )
+
+        results = await asyncio.gather(*map(_populate, dict.fromkeys(images)))
+        return LoadImagesReport(results=list(results), elapsed=loop.time() - begin)
+
+    async def load(
+        self,
+        service: "ContainersService",
+        image: str,
+        credentials: typing.Optional[typing.Tuple[str, str]] = None,
+    ) -> bool:
+        executable = service.provider.executable
+        if await self.contains(image, executable=executable):
+            self.logger.debug("Image %s found in shared store %s", image, self.root)
+        elif self.pull_missing:
+            await self.pull(image, credentials=credentials, executable=executable)
+        else:
+            return False
+        # Only usable if the storage.conf of the service lists the store
+        found, _ = await service._inspect_image(image)
+        if not found:
+            self.logger.warning(
+                "Image %s is in shared store %s but not visible to the service, "
+                "the store must be in additionalimagestores of its storage.conf",
+                image,
+                self.root,
+            )
+        return found
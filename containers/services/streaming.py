@@ -0,0 +1,205 @@
+import asyncio.subprocess
+import collections
+import contextlib
+import dataclasses
+import inspect
+import typing
+
+STDOUT = "stdout"
+STDERR = "stderr"
+STREAMS = (STDOUT, STDERR)
+
+
+@dataclasses.dataclass(frozen=True)
+class OutputChunk:
+    stream: str
+    data: bytes
+
+
+Sink = typing.Callable[[str, bytes], typing.Optional[typing.Awaitable[None]]]
+
+
+class FileSink:
+    """Tee the output of the given streams into a binary file object"""
+
+    def __init__(
+        self,
+        fileobj: typing.BinaryIO,
+        streams: typing.Sequence[str] = STREAMS,
+    ):
+        self.fileobj = fileobj
+        self.streams = frozenset(streams)
+
+    def __call__(self, stream: str, data: bytes):
+        if stream in self.streams:
+            self.fileobj.write(data)
+
+
+class RingBuffer:
+    """Keep only the last `size` bytes written into it"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._chunks: typing.Deque[bytes] = collections.deque()
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, data: bytes):
+        if self.size <= 0:
+            return
+        if len(data) >= self.size:
+            self._chunks.clear()
+            self._chunks.append(data[-self.size :])
+            self._length = self.size
+            return
+        self._chunks.append(data)
+        self._length += len(data)
+        while self._length > self.size:
+            excess = self._length - self.size
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self._length -= len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self._length -= excess
+
+    def getvalue(self) -> bytes:
+        return b"".join(self._chunks)
+
+
+class OutputStream:
+    """Expose stdout and stderr of a container process as async iterators of
+    chunks, with backpressure: at most `max_pending` chunks are buffered, once
+    reached, we stop reading from the pipes until the consumer catches up.
+
+    In multiplexed mode, the chunks of both streams are delivered in a single
+    iterator tagged with the stream name. Otherwise, each stream has its own
+    iterator and they need to be consumed concurrently, just like subprocess pipes.
+    """
+
+    def __init__(
+        self,
+        proc: asyncio.subprocess.Process,
+        multiplexed: bool = True,
+        chunk_size: int = 2**16,
+        max_pending: int = 16,
+        retain: int = 2**16,
+        sinks: typing.Sequence[Sink] = (),
+        on_first_byte: typing.Optional[typing.Callable[[str], None]] = None,
+    ):
+        self.proc = proc
+        self.on_first_byte = on_first_byte
+        self.multiplexed = multiplexed
+        self.chunk_size = chunk_size
+        self.sinks = list(sinks)
+        self._tails = {stream: RingBuffer(retain) for stream in STREAMS}
+        self._ended: typing.Set[str] = set()
+        if multiplexed:
+            queue = asyncio.Queue(max_pending)
+            self._queues = {stream: queue for stream in STREAMS}
+        else:
+            self._queues = {stream: asyncio.Queue(max_pending) for stream in STREAMS}
+        self._pumps = [
+            asyncio.ensure_future(self._pump(STDOUT, proc.stdout)),
+            asyncio.ensure_future(self._pump(STDERR, proc.stderr)),
+        ]
+
+    async def _pump(self, stream: str, reader: asyncio.StreamReader):
+        queue = self._queues[stream]
+        try:
+            while True:
+                data = await reader.read(self.chunk_size)
+                if not data:
+                    break
+                if self.on_first_byte is not None:
+                    on_first_byte = self.on_first_byte
+                    self.on_first_byte = None
+                    on_first_byte(stream)
+                self._tails[stream].append(data)
+                for sink in self.sinks:
+                    result = sink(stream, data)
+                    if inspect.isawaitable(result):
+                        await result
+                await queue.put(OutputChunk(stream=stream, data=data))
+        except Exception:
+            await queue.put(stream)
+            raise
+        # The stream name marks the end of that stream
+        await queue.put(stream)
+
+    async def chunks(
+        self, stream: typing.Optional[str] = None
+    ) -> typing.AsyncIterator[OutputChunk]:
+        if self.multiplexed:
+            if stream is not None:
+                raise ValueError(
+                    "Streams cannot be iterated separately in multiplexed mode"
+                )
+            streams = STREAMS
+        else:
+            if stream not in STREAMS:
+                raise ValueError(f"Expected stream to be one of {STREAMS}")
+            streams = (stream,)
+        queue = self._queues[streams[0]]
+        while not self._ended.issuperset(streams):
+            item = await queue.get()
+            if isinstance(item, str):
+                self._ended.add(item)
+                continue
+            yield item
+
+    def __aiter__(self) -> typing.AsyncIterator[OutputChunk]:
+        return self.chunks()
+
+    async def lines(
+        self, stream: typing.Optional[str] = None
+    ) -> typing.AsyncIterator[OutputChunk]:
+        """Iterate lines instead of chunks, each line comes with the trailing line
+        break except the last one might not
+        """
+        pending: typing.Dict[str, bytearray] = collections.defaultdict(bytearray)
+        async for chunk in self.chunks(stream):
+            buffer = pending[chunk.stream]
+            buffer.extend(chunk.data)
+            start = 0
+            while True:
+                end = buffer.find(b"\n", start)
+                if end == -1:
+                    break
+                yield OutputChunk(
+                    stream=chunk.stream, data=bytes(buffer[start : end + 1])
+                )
+                start = end + 1
+            del buffer[:start]
+        for stream_name, buffer in pending.items():
+            if buffer:
+                yield OutputChunk(stream=stream_name, data=bytes(buffer))
+
+    def tail(self, stream: str) -> bytes:
+        """The last bytes retained from the stream, useful for error reporting"""
+        return self._tails[stream].getvalue()
+
+    async def wait(self) -> int:
+        """Wait for the process to exit, remaining output not consumed yet is
+        drained, it still goes to the sinks and the retained tails
+        """
+        if self.multiplexed:
+            async for _ in self.chunks():
+                pass
+        else:
+            await asyncio.gather(*(self._drain(stream) for stream in STREAMS))
+        return await self.proc.wait()
+
+    async def _drain(self, stream: str):
+        async for _ in self.chunks(stream):
+            pass
+
+    async def close(self):
+        for pump in self._pumps:
+            pump.cancel()
+        for pump in self._pumps:
+            with contextlib.suppress(asyncio.CancelledError):
+                await pump
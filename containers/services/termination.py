@@ -0,0 +1,97 @@
+import asyncio
+import dataclasses
+import logging
+import typing
+
+if typing.TYPE_CHECKING:
+    from .base import ContainersService
+
+# Stages of the escalation chain, in order
+TERMINATE = "terminate"
+KILL = "kill"
+REMOVE = "remove"
+STAGES = (TERMINATE, KILL, REMOVE)
+
+
+@dataclasses.dataclass
+class TerminationStats:
+    # Containers still running when their deadline passed
+    timeouts: int = 0
+    # Containers still running when the task running them was cancelled
+    cancellations: int = 0
+    # Containers still running when the run context exited otherwise
+    abandoned: int = 0
+    # How many times each stage of the escalation chain fired
+    stages: typing.Dict[str, int] = dataclasses.field(
+        default_factory=lambda: {stage: 0 for stage in STAGES}
+    )
+
+
+class TerminationPolicy:
+    """Enforce the deadline of running containers from the client side, and make
+    sure containers are not left running once the run context exits.
+
+    A container still running on timeout, cancellation or exit goes through the
+    escalation chain: SIGTERM, wait for `grace_period` seconds, `podman kill`, wait
+    for `kill_grace_period` seconds and then `podman rm --force`.
+    """
+
+    def __init__(
+        self,
+        grace_period: float = 10.0,
+        kill_grace_period: float = 5.0,
+        timeout: typing.Optional[float] = None,
+        enforce_timeout: bool = True,
+    ):
+        self.grace_period = grace_period
+        self.kill_grace_period = kill_grace_period
+        # Deadline in seconds overriding the timeout of the container
+        self.timeout = timeout
+        self.enforce_timeout = enforce_timeout
+        self.stats = TerminationStats()
+        self.logger = logging.getLogger(__name__)
+
+    def get_timeout(
+        self, container_timeout: typing.Optional[int]
+    ) -> typing.Optional[float]:
+        if not self.enforce_timeout:
+            return None
+        if self.timeout is not None:
+            return self.timeout
+        return container_timeout
+
+    @staticmethod
+    async def wait_exit(proc: typing.Any, timeout: typing.Optional[float]) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(proc.wait()), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def escalate(
+        self,
+        service: "ContainersService",
+        proc: typing.Any,
+        name: str,
+        log_level: typing.Optional[str] = None,
+    ):
+        """Stop the container, one stage after another until it exits"""
+        stages = (
+            (TERMINATE, service._terminate_container, self.grace_period),
+            (KILL, service._kill_container, self.kill_grace_period),
+            (REMOVE, service._force_remove_container, self.kill_grace_period),
+        )
+        for stage, action, grace_period in stages:
+            if proc.returncode is not None:
+                return
+            self.logger.info("Stop container %s with stage %s", name, stage)
+            self.stats.stages[stage] += 1
+            try:
+                await action(proc, name, log_level=log_level)
+            except Exception:
+                self.logger.exception(
+                    "Failed to stop container %s with stage %s", name, stage
+                )
+            if await self.wait_exit(proc, grace_period):
+                return
+        self.logger.warning("Container %s is still running after all stages", name)
@@ -1,17 +1,22 @@
 import asyncio.subprocess
 import contextlib
-import copy
+import dataclasses
+import functools
 import pathlib
 import shutil
 import tempfile
 import typing
 
+from ..data_types import ArchiveImageMount
 from ..data_types import BindMount
 from ..data_types import Container
 from ..data_types import Mount
 from ..data_types import PathType
+from ..providers.base import ContainerProvider
 from .base import ContainersService
 from .base import DEFAULT_LIMIT
+from .copy_engine import CopyEngine
+from .copy_engine import SmallFileCache
 
 
 def to_wsl_path(path: pathlib.Path):
@@ -32,24 +37,43 @@ def is_unc_path(path: PathType) -> bool:
 
 
 class WindowsContainersService(ContainersService):
+    def __init__(
+        self,
+        provider: typing.Optional[ContainerProvider] = None,
+        copy_engine: typing.Optional[CopyEngine] = None,
+        file_cache: typing.Optional[SmallFileCache] = None,
+        **kwargs,
+    ):
+        super().__init__(provider, **kwargs)
+        self._copy_engine = copy_engine
+        self.file_cache = file_cache if file_cache is not None else SmallFileCache()
+
+    @property
+    def copy_engine(self) -> CopyEngine:
+        # Created on the first copy, as it scans its cache directory
+        if self._copy_engine is None:
+            self._copy_engine = CopyEngine()
+        return self._copy_engine
+
+    async def close(self):
+        await super().close()
+        if self._copy_engine is not None:
+            self._copy_engine.close()
+        self.file_cache.close()
+
     @contextlib.asynccontextmanager
     async def _make_temp_copy(
         self, src: typing.Optional[pathlib.Path], suffix: typing.Optional[str] = None
     ) -> typing.AsyncContextManager[pathlib.Path]:
         # Only copy if the drive is provided and a UNC path
         if src is not None and is_unc_path(src):
-            with (
-                open(src, "rb") as src_file,
-                tempfile.NamedTemporaryFile(suffix=suffix) as temp_file,
-            ):
+            async with self.file_cache.acquire(src, suffix=suffix or "") as temp_path:
                 self.logger.debug(
-                    "Make a temp copy of seccomp profile from %s to native windows filesystem at %s",
+                    "Use a temp copy of seccomp profile from %s in native windows filesystem at %s",
                     src,
-                    temp_file.name,
+                    temp_path,
                 )
-                shutil.copyfileobj(src_file, temp_file)
-                temp_file.flush()
-                yield pathlib.Path(temp_file.name)
+                yield temp_path
         else:
             yield src
 
@@ -58,9 +82,11 @@ class WindowsContainersService(ContainersService):
         self,
         mounts: typing.List[Mount],
     ) -> typing.AsyncContextManager[typing.List[Mount]]:
-        with tempfile.TemporaryDirectory() as temp_folder:
-            temp_folder_path = pathlib.Path(temp_folder)
+        loop = asyncio.get_running_loop()
+        temp_folder_path = pathlib.Path(tempfile.mkdtemp())
+        try:
             new_mounts = []
+            copies = []
             for i, mount in enumerate(mounts):
                 if (
                     not isinstance(mount, BindMount)
@@ -73,10 +99,29 @@ class WindowsContainersService(ContainersService):
                 self.logger.info(
                     "Copy readonly UNC mount from %s to %s", mount.source, new_source
                 )
-                shutil.copytree(mount.source, new_source)
-                mount.source = new_source
-                new_mounts.append(mount)
+                copies.append(
+                    self.copy_engine.copy_tree_async(mount.source, new_source)
+                )
+                new_mounts.append(dataclasses.replace(mount, source=new_source))
+            await asyncio.gather(*copies)
             yield new_mounts
+        finally:
+            await loop.run_in_executor(
+                None, functools.partial(shutil.rmtree, temp_folder_path, True)
+            )
+
+    def _to_wsl_archive_mount(self, mount: Mount) -> Mount:
+        # The archive-overlay hook runs in the podman WSL machine, it needs WSL paths
+        if not isinstance(mount, ArchiveImageMount) or mount.archive_to is None:
+            return mount
+        archive_success = mount.archive_success
+        if archive_success is not None:
+            archive_success = to_wsl_path(pathlib.Path(archive_success))
+        return dataclasses.replace(
+            mount,
+            archive_to=to_wsl_path(pathlib.Path(mount.archive_to)),
+            archive_success=archive_success,
+        )
 
     @contextlib.asynccontextmanager
     async def run(
@@ -88,9 +133,8 @@ class WindowsContainersService(ContainersService):
         runtime_env: typing.Optional[dict] = None,
         limit: int = DEFAULT_LIMIT,
         log_level: typing.Optional[str] = None,
+        priority: int = 0,
     ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
-        container = copy.deepcopy(container)
-
         seccomp_profile = None
         if (
             container.security_options is not None
@@ -108,13 +152,19 @@ class WindowsContainersService(ContainersService):
             ) as temp_seccomp_profile,
             self._copy_readonly_unc_mounts(container.mounts) as new_mounts,
         ):
+            # The container of the caller is left untouched, only the changed parts
+            # are copied, the rest is shared
+            changes = dict(mounts=list(map(self._to_wsl_archive_mount, new_mounts)))
             if temp_seccomp_profile is not None:
                 # Not only we need to copy to native window filesystem, we also
                 # need to convert it into WSL path for podman in the podman WSL machine
                 # to read
                 # ref: https://github.com/containers/podman/issues/14494
-                container.security_options.seccomp = to_wsl_path(temp_seccomp_profile)
-            container.mounts = new_mounts
+                changes["security_options"] = dataclasses.replace(
+                    container.security_options,
+                    seccomp=to_wsl_path(temp_seccomp_profile),
+                )
+            container = dataclasses.replace(container, **changes)
             async with super().run(
                 container=container,
                 stdin=stdin,
@@ -123,5 +173,6 @@ class WindowsContainersService(ContainersService):
                 runtime_env=runtime_env,
                 limit=limit,
                 log_level=log_level,
+                priority=priority,
             ) as proc:
                 yield proc
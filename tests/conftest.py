@@ -1,131 +1,14 @@
-import asyncio.subprocess
-import copy
-import dataclasses
+import hashlib
+import json
+import pathlib
 import sys
 import typing
 
 import pytest
 
-from containers import Container
 from containers import ContainersService
-from containers import ImageMount as _ImageMount
-from containers import Mount
-from containers import Podman as _Podman
-from containers import WindowsContainersService as _WindowsContainersService
-from containers.data_types import PathType
-from containers.services.base import DEFAULT_LIMIT
-from containers.services.windows import to_wsl_path
-
-ARCHIVE_HOOK_PREFIX = "com.launchplatform.oci-hooks.archive-overlay."
-CHOWN_HOOK_PREFIX = "com.launchplatform.oci-hooks.mount-chown."
-
-
-@dataclasses.dataclass
-class ImageMount(_ImageMount):
-    archive_to: typing.Optional[PathType] = None
-    archive_success: typing.Optional[PathType] = None
-    archive_method: typing.Optional[str] = None
-    archive_tar_content_owner: typing.Optional[str] = None
-    chown: typing.Optional[str] = None
-    chown_policy: typing.Optional[str] = None
-    mode: typing.Optional[int] = None
-
-
-def make_annotation_args(annotations: typing.Dict[str, str]) -> typing.Tuple[str, ...]:
-    args = []
-    for env_arg in map(lambda item: "=".join(item), annotations.items()):
-        args.append("--annotation")
-        args.append(env_arg)
-    return tuple(args)
-
-
-class Podman(_Podman):
-    def make_overlay_archive_annotations(
-        self, image_mount: ImageMount, name: typing.Optional[str] = None
-    ) -> typing.Tuple[str, ...]:
-        if image_mount.archive_to is None:
-            return tuple()
-        if name is None:
-            name = self._make_unique_mount_name()
-        args = {
-            f"{ARCHIVE_HOOK_PREFIX}{name}.mount-point": str(image_mount.target),
-            f"{ARCHIVE_HOOK_PREFIX}{name}.archive-to": str(image_mount.archive_to),
-        }
-        if image_mount.archive_success is not None:
-            args[f"{ARCHIVE_HOOK_PREFIX}{name}.success"] = str(
-                image_mount.archive_success
-            )
-        if image_mount.archive_method is not None:
-            args[f"{ARCHIVE_HOOK_PREFIX}{name}.method"] = str(
-                image_mount.archive_method
-            )
-        if image_mount.archive_tar_content_owner is not None:
-            args[f"{ARCHIVE_HOOK_PREFIX}{name}.tar-content-owner"] = str(
-                image_mount.archive_tar_content_owner
-            )
-        return make_annotation_args(args)
-
-    def make_mount_chown_annotations(
-        self, image_mount: ImageMount, name: typing.Optional[str] = None
-    ) -> typing.Tuple[str, ...]:
-        if image_mount.chown is None and image_mount.mode is None:
-            return tuple()
-        if name is None:
-            name = self._make_unique_mount_name()
-        annotations = {
-            f"{CHOWN_HOOK_PREFIX}{name}.path": str(image_mount.target),
-        }
-        if image_mount.chown is not None:
-            annotations[f"{CHOWN_HOOK_PREFIX}{name}.owner"] = image_mount.chown
-        if image_mount.chown_policy is not None:
-            annotations[f"{CHOWN_HOOK_PREFIX}{name}.policy"] = image_mount.chown_policy
-        if image_mount.mode is not None:
-            annotations[f"{CHOWN_HOOK_PREFIX}{name}.mode"] = f"{image_mount.mode:o}"
-        return make_annotation_args(annotations)
-
-    def make_image_mount(self, mount: ImageMount, name: typing.Optional[str] = None):
-        args = super().make_image_mount(mount, name)
-        if isinstance(mount, ImageMount):
-            return (
-                *args,
-                *self.make_overlay_archive_annotations(image_mount=mount, name=name),
-                *self.make_mount_chown_annotations(image_mount=mount, name=name),
-            )
-        return args
-
-
-class WindowsContainersService(_WindowsContainersService):
-    def _filter_mount(self, mount: Mount) -> Mount:
-        if not isinstance(mount, ImageMount):
-            return mount
-        if mount.archive_to is None:
-            return mount
-        mount = copy.deepcopy(mount)
-        mount.archive_to = to_wsl_path(mount.archive_to)
-        if mount.archive_success is not None:
-            mount.archive_success = to_wsl_path(mount.archive_success)
-        return mount
-
-    def run(
-        self,
-        container: Container,
-        stdin: typing.Optional[int] = None,
-        stdout: typing.Optional[int] = None,
-        stderr: typing.Optional[int] = None,
-        runtime_env: typing.Optional[dict] = None,
-        limit: int = DEFAULT_LIMIT,
-        log_level: typing.Optional[str] = None,
-    ) -> typing.AsyncContextManager[asyncio.subprocess.Process]:
-        container = copy.deepcopy(container)
-        container.mounts = list(map(self._filter_mount, container.mounts))
-        return super().run(
-            container=container,
-            stdin=stdin,
-            stdout=stdout,
-            stderr=stderr,
-            limit=limit,
-            log_level=log_level,
-        )
+from containers import Podman
+from containers import WindowsContainersService
 
 
 @pytest.fixture
@@ -138,3 +21,101 @@ def containers(podman: Podman) -> ContainersService:
     if sys.platform == "win32":
         return WindowsContainersService(podman)
     return ContainersService(podman)
+
+
+class FakePodman:
+    def __init__(self, state_dir: pathlib.Path, executable: pathlib.Path):
+        self.state_dir = state_dir
+        self.executable = executable
+
+    def _save(self, name: str, value: typing.Any):
+        (self.state_dir / f"{name}.json").write_text(json.dumps(value))
+
+    def _load(self, name: str, default: typing.Any) -> typing.Any:
+        path = self.state_dir / f"{name}.json"
+        if not path.exists():
+            return default
+        return json.loads(path.read_text())
+
+    @property
+    def images(self) -> typing.Dict[str, str]:
+        return self._load("images", {})
+
+    def store_images(self, root: str) -> typing.Dict[str, str]:
+        """The images of the store with the given `--root`"""
+        return self._load("images-" + hashlib.sha256(root.encode()).hexdigest()[:8], {})
+
+    def add_image(self, image: str, digest: str = "sha256:" + "0" * 64):
+        images = self.images
+        images[image] = digest
+        self._save("images", images)
+
+    def remove_image(self, image: str):
+        images = self.images
+        del images[image]
+        self._save("images", images)
+
+    def set_image_config(self, image: str, config: typing.Dict[str, typing.Any]):
+        configs = self._load("image_configs", {})
+        configs[image] = config
+        self._save("image_configs", configs)
+
+    def fail_pull(self, *images: str):
+        self._save("fail_pull", list(images))
+
+    def set_pull_delay(self, delay: float):
+        self._save("pull_delay", delay)
+
+    def set_save_delay(self, delay: float):
+        self._save("save_delay", delay)
+
+    def set_additional_image_stores(self, *roots: str):
+        """Like additionalimagestores in storage.conf, the images of these stores
+        are seen by the main store
+        """
+        self._save("additional_image_stores", list(roots))
+
+    def ignore_kill(self, ignore: bool = True):
+        self._save("ignore_kill", ignore)
+
+    @property
+    def containers(self) -> typing.Dict[str, typing.List[str]]:
+        return self._load("containers", {})
+
+    def calls(self) -> typing.List[typing.List[str]]:
+        path = self.state_dir / "calls.jsonl"
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.fixture
+def fake_podman(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> FakePodman:
+    state_dir = tmp_path / "fake-podman"
+    state_dir.mkdir()
+    executable = state_dir / "podman"
+    script = pathlib.Path(__file__).parent / "fake_podman.py"
+    executable.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    executable.chmod(0o755)
+    monkeypatch.setenv("FAKE_PODMAN_STATE", str(state_dir))
+    return FakePodman(state_dir=state_dir, executable=executable)
+
+
+@pytest.fixture
+def fake_runtime(fake_podman: FakePodman) -> pathlib.Path:
+    executable = fake_podman.state_dir / "crun"
+    root = pathlib.Path(__file__).parent.parent
+    executable.write_text(
+        f'#!/bin/sh\nPYTHONPATH="{root}" exec "{sys.executable}" -m tests.fake_runtime "$@"\n'
+    )
+    executable.chmod(0o755)
+    return executable
+
+
+def count_calls(fake_podman: FakePodman, command: str) -> int:
+    return sum(call[0] == command for call in fake_podman.calls())
+
+
+@pytest.fixture
+def fake_containers(fake_podman: FakePodman) -> ContainersService:
+    return ContainersService(Podman(executable=fake_podman.executable))
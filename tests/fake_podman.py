@@ -0,0 +1,422 @@
+"""A tiny stand-in for the podman CLI used by tests which cannot run real podman.
+
+The state lives in the directory pointed by the FAKE_PODMAN_STATE environment
+variable, every invocation is appended to `calls.jsonl` in there.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import time
+import typing
+import uuid
+
+STATE_DIR = pathlib.Path(os.environ["FAKE_PODMAN_STATE"])
+# Images of another store with --root are kept in a file of their own
+IMAGES = "images"
+
+
+def load(name: str, default):
+    path = STATE_DIR / f"{name}.json"
+    if not path.exists():
+        return default
+    return json.loads(path.read_text())
+
+
+def save(name: str, value):
+    path = STATE_DIR / f"{name}.json"
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(value))
+    tmp_path.replace(path)
+
+
+@contextlib.contextmanager
+def locked():
+    with open(STATE_DIR / "state.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def store_images(root: str) -> dict:
+    return load("images-" + hashlib.sha256(root.encode()).hexdigest()[:8], {})
+
+
+def visible_images() -> dict:
+    """The images of the store, plus the ones of the additionalimagestores of the
+    main store
+    """
+    images = {}
+    if IMAGES == "images":
+        for root in load("additional_image_stores", []):
+            images.update(store_images(root))
+    images.update(load(IMAGES, {}))
+    return images
+
+
+def image_inspect(args) -> int:
+    fmt = None
+    if args[:1] == ["--format"]:
+        fmt = args[1]
+        args = args[2:]
+    images = visible_images()
+    code = 0
+    found = []
+    for image in args:
+        # A poor man's short name resolution
+        candidates = (image, f"docker.io/library/{image}", f"localhost/{image}:latest")
+        name = next((name for name in candidates if name in images), None)
+        if name is None:
+            sys.stderr.write(f"Error: {image}: image not known\n")
+            code = 125
+            continue
+        found.append(
+            dict(
+                Id=images[name],
+                Digest=images[name],
+                RepoTags=[name],
+                Config=load("image_configs", {}).get(name, {}),
+            )
+        )
+    if fmt is None or fmt == "json":
+        sys.stdout.write(json.dumps(found))
+    else:
+        for item in found:
+            sys.stdout.write(item["Digest"] + "\n")
+    return code
+
+
+def image_mount(args) -> int:
+    image = args[0]
+    if image not in load(IMAGES, {}):
+        sys.stderr.write(f"Error: {image}: image not known\n")
+        return 125
+    rootfs = STATE_DIR / "rootfs" / hashlib.sha256(image.encode()).hexdigest()
+    (rootfs / "etc").mkdir(parents=True, exist_ok=True)
+    (rootfs / "tmp").mkdir(exist_ok=True)
+    (rootfs / "etc" / "passwd").write_text(
+        "root:x:0:0:root:/root:/bin/sh\nnobody:x:65534:65534::/:/bin/false\n"
+    )
+    (rootfs / "etc" / "group").write_text("root:x:0:\nnogroup:x:65534:\n")
+    sys.stdout.write(f"{rootfs}\n")
+    return 0
+
+
+def list_images(args) -> int:
+    for image in load(IMAGES, {}):
+        sys.stdout.write(image + "\n")
+    return 0
+
+
+def rmi(args) -> int:
+    with locked():
+        images = load(IMAGES, {})
+        for image in args:
+            if not image.startswith("--"):
+                images.pop(image, None)
+        save(IMAGES, images)
+    return 0
+
+
+def save_image(args) -> int:
+    options = dict(zip(args[:-1:2], args[1:-1:2]))
+    image = args[-1]
+    time.sleep(load("save_delay", 0))
+    images = load(IMAGES, {})
+    if image not in images:
+        sys.stderr.write(f"Error: {image}: image not known\n")
+        return 125
+    # Padded to make the size of archives noticeable
+    pathlib.Path(options["--output"]).write_text(
+        json.dumps(dict(image=image, digest=images[image], padding="0" * 1024))
+    )
+    return 0
+
+
+def load_image(args) -> int:
+    path = pathlib.Path(args[args.index("--input") + 1])
+    try:
+        archive = json.loads(path.read_text())
+    except (OSError, ValueError):
+        sys.stderr.write(f"Error: invalid archive {path}\n")
+        return 125
+    with locked():
+        images = load(IMAGES, {})
+        images[archive["image"]] = archive["digest"]
+        save(IMAGES, images)
+    sys.stdout.write(f"Loaded image: {archive['image']}\n")
+    return 0
+
+
+def pull(args) -> int:
+    image = args[0]
+    time.sleep(load("pull_delay", 0))
+    if image in load("fail_pull", []):
+        sys.stderr.write(f"Error: failed to pull {image}\n")
+        return 125
+    with locked():
+        images = load(IMAGES, {})
+        images[image] = "sha256:" + hashlib.sha256(image.encode()).hexdigest()
+        save(IMAGES, images)
+    return 0
+
+
+def create(args) -> int:
+    container_id = uuid.uuid4().hex
+    with locked():
+        containers = load("containers", {})
+        containers[container_id] = args
+        save("containers", containers)
+    sys.stdout.write(container_id + "\n")
+    return 0
+
+
+def start(args) -> int:
+    container_id = args[-1]
+    container_args = load("containers", {}).get(container_id)
+    if container_args is None:
+        sys.stderr.write(f"Error: no container with name or ID {container_id}\n")
+        return 125
+    sys.stdout.write(f"started {container_id}\n")
+    sys.stdout.flush()
+    options, _, command = split_run_args(container_args)
+    if not command:
+        return 0
+    # Run the command of the created container locally, like run does
+    env = dict(os.environ)
+    for key, value in zip(options, options[1:]):
+        if key == "--env":
+            name, _, env_value = value.partition("=")
+            env[name] = env_value
+    with locked():
+        running = load("running", {})
+        running[container_id] = os.getpid()
+        save("running", running)
+    os.execvpe(command[0], command, env)
+
+
+def update(args) -> int:
+    container_id = args[-1]
+    if container_id not in load("containers", {}):
+        sys.stderr.write(f"Error: no container with name or ID {container_id}\n")
+        return 125
+    return 0
+
+
+def kill_running(name: str, sig: int) -> bool:
+    pid = load("running", {}).get(name)
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def kill(args) -> int:
+    sig = signal.SIGKILL
+    if args[:1] == ["--signal"]:
+        sig = getattr(signal, args[1])
+        args = args[2:]
+    if load("ignore_kill", False):
+        return 0
+    code = 0
+    for name in args:
+        if not kill_running(name, sig):
+            sys.stderr.write(f"Error: no container with name or ID {name}\n")
+            code = 125
+    return code
+
+
+def rm(args) -> int:
+    with locked():
+        containers = load("containers", {})
+        for container_id in args:
+            if container_id.startswith("--"):
+                continue
+            containers.pop(container_id, None)
+            kill_running(container_id, signal.SIGKILL)
+        save("containers", containers)
+    return 0
+
+
+FLAGS = frozenset(["--interactive", "--tty", "--rm", "--detach"])
+
+
+def split_run_args(args) -> typing.Tuple[typing.List[str], str, typing.List[str]]:
+    index = 0
+    while index < len(args) and args[index].startswith("--"):
+        index += 1 if args[index] in FLAGS else 2
+    return args[:index], args[index], args[index + 1 :]
+
+
+def add_event(event: dict):
+    with locked(), open(STATE_DIR / "events.jsonl", "a") as fo:
+        fo.write(json.dumps(event) + "\n")
+
+
+def events(args) -> int:
+    # Replay all the events as if --since covered all of them, then follow
+    path = STATE_DIR / "events.jsonl"
+    path.touch()
+    with open(path) as fo:
+        while True:
+            line = fo.readline()
+            if not line:
+                time.sleep(0.01)
+                continue
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+
+def supervise(args) -> int:
+    """Run the command of a detached container and record its exit event"""
+    container_id, name, *command = args
+    proc = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    with locked():
+        running = load("running", {})
+        running[container_id] = proc.pid
+        if name:
+            running[name] = proc.pid
+        save("running", running)
+    code = proc.wait()
+    event = dict(ID=container_id, Name=name, Status="died", Type="container")
+    # Like podman, the exit code is omitted when it's zero
+    if code != 0:
+        event["ContainerExitCode"] = 128 - code if code < 0 else code
+    add_event(event)
+    return 0
+
+
+def run_detached(options: typing.List[str], command: typing.List[str]) -> int:
+    container_id = uuid.uuid4().hex
+    with locked():
+        containers = load("containers", {})
+        containers[container_id] = options
+        save("containers", containers)
+    name = ""
+    env = dict(os.environ)
+    for key, value in zip(options, options[1:]):
+        if key == "--env":
+            env_name, _, env_value = value.partition("=")
+            env[env_name] = env_value
+        elif key == "--name":
+            name = value
+    subprocess.Popen(
+        [sys.executable, __file__, "__supervise", container_id, name, *command],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    sys.stdout.write(container_id + "\n")
+    return 0
+
+
+EXEC_FLAGS = frozenset(["--interactive", "--tty"])
+
+
+def exec_(args) -> int:
+    index = 0
+    while args[index].startswith("--"):
+        index += 1 if args[index] in EXEC_FLAGS else 2
+    options, container_id, command = args[:index], args[index], args[index + 1 :]
+    container_options = load("containers", {}).get(container_id)
+    if container_options is None:
+        sys.stderr.write(f"Error: no container with name or ID {container_id}\n")
+        return 125
+    # Run the command locally as if it was in the container
+    env = dict(os.environ)
+    all_options = [*container_options, *options]
+    for key, value in zip(all_options, all_options[1:]):
+        if key == "--env":
+            name, _, env_value = value.partition("=")
+            env[name] = env_value
+        elif key == "--workdir":
+            os.chdir(value)
+    os.execvpe(command[0], command, env)
+
+
+def run(args) -> int:
+    options, image, command = split_run_args(args)
+    if "--detach" in options:
+        return run_detached(options, command or ["true"])
+    if not command:
+        sys.stdout.write("run\n")
+        return 0
+    # Run the command locally as if it was in the container
+    env = dict(os.environ)
+    for key, value in zip(options, options[1:]):
+        if key == "--env":
+            name, _, env_value = value.partition("=")
+            env[name] = env_value
+        elif key == "--name":
+            # The pid stays the same after exec, so that we can kill it by name
+            with locked():
+                running = load("running", {})
+                running[value] = os.getpid()
+                save("running", running)
+    sys.stdout.flush()
+    os.execvpe(command[0], command, env)
+
+
+def main(argv) -> int:
+    if argv[:1] == ["__supervise"]:
+        return supervise(argv[1:])
+    with locked(), open(STATE_DIR / "calls.jsonl", "a") as fo:
+        fo.write(json.dumps(argv) + "\n")
+    global IMAGES
+    args = list(argv)
+    while args and args[0].startswith("--"):
+        if args[0] == "--root":
+            IMAGES = "images-" + hashlib.sha256(args[1].encode()).hexdigest()[:8]
+        args = args[2:]
+    if args[:2] == ["image", "inspect"]:
+        return image_inspect(args[2:])
+    elif args[:2] == ["image", "mount"]:
+        return image_mount(args[2:])
+    elif args[:2] == ["image", "unmount"]:
+        return 0
+    elif args[:1] == ["pull"]:
+        return pull(args[1:])
+    elif args[:1] == ["images"]:
+        return list_images(args[1:])
+    elif args[:1] == ["rmi"]:
+        return rmi(args[1:])
+    elif args[:1] == ["save"]:
+        return save_image(args[1:])
+    elif args[:1] == ["load"]:
+        return load_image(args[1:])
+    elif args[:1] == ["create"]:
+        return create(args[1:])
+    elif args[:1] == ["start"]:
+        return start(args[1:])
+    elif args[:1] == ["kill"]:
+        return kill(args[1:])
+    elif args[:1] == ["update"]:
+        return update(args[1:])
+    elif args[:1] == ["rm"]:
+        return rm(args[1:])
+    elif args[:1] == ["run"]:
+        return run(args[1:])
+    elif args[:1] == ["exec"]:
+        return exec_(args[1:])
+    elif args[:1] == ["events"]:
+        return events(args[1:])
+    sys.stderr.write(f"Error: unknown command {args}\n")
+    return 125
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,107 @@
+"""A tiny stand-in for an OCI runtime like crun, it validates the config.json of
+the bundle and runs the process locally.
+
+Every invocation is appended to `runtime_calls.jsonl` in the directory pointed by
+the FAKE_PODMAN_STATE environment variable, along with the config it ran.
+"""
+import json
+import os
+import pathlib
+import signal
+import sys
+
+from .fake_podman import kill_running
+from .fake_podman import load
+from .fake_podman import locked
+from .fake_podman import save
+from .fake_podman import STATE_DIR
+
+MOUNT_TYPES = frozenset(["bind", "none", "proc", "tmpfs", "devpts", "mqueue", "sysfs"])
+NAMESPACES = frozenset(["pid", "ipc", "uts", "mount", "cgroup", "network", "user"])
+
+
+def validate_config(config: dict) -> list:
+    errors = []
+    if not config.get("ociVersion", "").startswith("1."):
+        errors.append("invalid ociVersion")
+    process = config.get("process") or {}
+    args = process.get("args")
+    if not args or not all(isinstance(arg, str) for arg in args):
+        errors.append("process.args must be a non-empty list of strings")
+    if not str(process.get("cwd", "")).startswith("/"):
+        errors.append("process.cwd must be absolute")
+    for item in process.get("env", []):
+        if "=" not in item:
+            errors.append(f"invalid env {item!r}")
+    user = process.get("user") or {}
+    if not isinstance(user.get("uid"), int) or not isinstance(user.get("gid"), int):
+        errors.append("process.user must have numeric uid and gid")
+    for rlimit in process.get("rlimits", []):
+        if not rlimit["type"].startswith("RLIMIT_") or rlimit["soft"] > rlimit["hard"]:
+            errors.append(f"invalid rlimit {rlimit}")
+    root = config.get("root") or {}
+    if not pathlib.Path(root.get("path", "")).is_dir():
+        errors.append("root.path must be an existing directory")
+    for mount in config.get("mounts", []):
+        if not mount.get("destination", "").startswith("/"):
+            errors.append(f"mount destination must be absolute {mount}")
+        if mount.get("type") not in MOUNT_TYPES:
+            errors.append(f"unknown mount type {mount}")
+        if mount.get("type") == "bind" and not os.path.exists(mount["source"]):
+            errors.append(f"bind mount source does not exist {mount}")
+    linux = config.get("linux") or {}
+    for namespace in linux.get("namespaces", []):
+        if namespace["type"] not in NAMESPACES:
+            errors.append(f"unknown namespace {namespace}")
+    seccomp = linux.get("seccomp")
+    if seccomp is not None:
+        if not seccomp.get("defaultAction", "").startswith("SCMP_ACT_"):
+            errors.append("invalid seccomp defaultAction")
+        for syscall in seccomp.get("syscalls", []):
+            if not syscall.get("names") or "includes" in syscall:
+                errors.append(f"invalid seccomp syscall {syscall}")
+    return errors
+
+
+def run(args) -> int:
+    bundle = pathlib.Path(args[args.index("--bundle") + 1])
+    container_id = args[-1]
+    config = json.loads((bundle / "config.json").read_text())
+    with locked(), open(STATE_DIR / "runtime_calls.jsonl", "a") as fo:
+        fo.write(json.dumps(dict(args=args, config=config)) + "\n")
+    errors = validate_config(config)
+    if errors:
+        for error in errors:
+            sys.stderr.write(f"Error: {error}\n")
+        return 1
+    with locked():
+        running = load("running", {})
+        running[container_id] = os.getpid()
+        save("running", running)
+    process = config["process"]
+    env = dict(item.split("=", 1) for item in process["env"])
+    # Run the process locally as if it was in the container
+    os.execvpe(process["args"][0], process["args"], {**os.environ, **env})
+
+
+def main(argv) -> int:
+    args = list(argv)
+    while args and args[0].startswith("--"):
+        args = args[2:]
+    if args[:1] == ["run"]:
+        return run(args[1:])
+    elif args[:1] == ["kill"]:
+        container_id, sig = args[1:3]
+        if not kill_running(container_id, getattr(signal, sig)):
+            sys.stderr.write(f"Error: container {container_id} does not exist\n")
+            return 1
+        return 0
+    elif args[:1] == ["delete"]:
+        kill_running(args[-1], signal.SIGKILL)
+        return 0
+    sys.stderr.write(f"Error: unknown command {args}\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
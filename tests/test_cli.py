@@ -0,0 +1,157 @@
+import json
+import pathlib
+
+import pytest
+
+from .conftest import FakePodman
+from containers import Container
+from containers import serialization
+from containers.cli import main
+from containers.cli import parse_specs
+from containers.cli import percentile
+
+
+@pytest.fixture
+def specs_file(tmp_path: pathlib.Path) -> pathlib.Path:
+    path = tmp_path / "specs.json"
+    path.write_text(
+        serialization.dumps_json_many(
+            [
+                Container(image="alpine", command=("echo", f"hello {i}"))
+                for i in range(3)
+            ]
+            + [Container(image="alpine", command=("sh", "-c", "exit 3"))]
+        )
+    )
+    return path
+
+
+def test_parse_specs():
+    containers = [
+        Container(image="alpine", command=("ls",)),
+        Container(image="busybox", command=("true",), environ=dict(A="B")),
+    ]
+    assert parse_specs(serialization.dumps_json_many(containers)) == containers
+    dicts = list(map(serialization.to_dict, containers))
+    assert parse_specs(json.dumps(dicts)) == containers
+    assert parse_specs("\n".join(map(json.dumps, dicts)) + "\n") == containers
+    assert parse_specs(json.dumps(dicts[0])) == containers[:1]
+    with pytest.raises(ValueError):
+        parse_specs("1")
+
+
+@pytest.mark.parametrize(
+    "values, percent, expected",
+    [
+        ([], 50, 0.0),
+        ([3.0], 99, 3.0),
+        ([4.0, 1.0, 3.0, 2.0], 50, 2.0),
+        ([float(i) for i in range(1, 101)], 95, 95.0),
+        ([float(i) for i in range(1, 101)], 99, 99.0),
+    ],
+)
+def test_percentile(values, percent: float, expected: float):
+    assert percentile(values, percent) == expected
+
+
+def test_dry_run(
+    fake_podman: FakePodman,
+    specs_file: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    code = main(
+        [str(specs_file), "--dry-run", "--executable", str(fake_podman.executable)]
+    )
+    assert code == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == [
+        f"{fake_podman.executable} run alpine echo 'hello {i}'" for i in range(3)
+    ] + [f"{fake_podman.executable} run alpine sh -c 'exit 3'"]
+    assert fake_podman.calls() == []
+
+
+def test_run(
+    tmp_path: pathlib.Path,
+    fake_podman: FakePodman,
+    specs_file: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    output_dir = tmp_path / "output"
+    code = main(
+        [
+            str(specs_file),
+            "--executable",
+            str(fake_podman.executable),
+            "--concurrency",
+            "2",
+            "--output-dir",
+            str(output_dir),
+            "--json",
+        ]
+    )
+    assert code == 1
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["jobs"] == 4
+    assert summary["succeeded"] == 3
+    assert summary["failed"] == 1
+    assert set(summary["spawn_time"]) == {"p50", "p95", "p99"}
+    assert summary["total_time"]["p50"] <= summary["total_time"]["p99"]
+    assert [result["exit_code"] for result in summary["results"]] == [0, 0, 0, 3]
+    for i in range(3):
+        assert (output_dir / f"job-{i:05d}.stdout").read_text() == f"hello {i}\n"
+    assert (output_dir / "job-00003.stdout").read_text() == ""
+
+
+def test_run_output_file_error(
+    tmp_path: pathlib.Path,
+    fake_podman: FakePodman,
+    specs_file: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    output_dir = tmp_path / "output"
+    # The stderr file of the second job cannot be opened
+    (output_dir / "job-00001.stderr").mkdir(parents=True)
+    code = main(
+        [
+            str(specs_file),
+            "--executable",
+            str(fake_podman.executable),
+            "--output-dir",
+            str(output_dir),
+            "--json",
+        ]
+    )
+    assert code == 1
+    summary = json.loads(capsys.readouterr().out)
+    assert [result["exit_code"] for result in summary["results"]] == [0, None, 0, 3]
+    assert summary["results"][1]["error"]
+    assert (output_dir / "job-00002.stdout").read_text() == "hello 2\n"
+
+
+def test_run_missing_executable(
+    tmp_path: pathlib.Path,
+    specs_file: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    code = main([str(specs_file), "--executable", str(tmp_path / "missing")])
+    assert code == 1
+    out = capsys.readouterr().out
+    assert "job 0 (alpine) failed" in out
+    assert "jobs=4 succeeded=0 failed=4" in out
+
+
+def test_pull_failed(
+    fake_podman: FakePodman,
+    specs_file: pathlib.Path,
+    capsys: pytest.CaptureFixture,
+):
+    fake_podman.fail_pull("alpine")
+    code = main(
+        [str(specs_file), "--pull", "--executable", str(fake_podman.executable)]
+    )
+    assert code == 1
+    captured = capsys.readouterr()
+    assert captured.err.startswith("unable to load image alpine:")
+    assert captured.out == ""
+    # Nothing is run
+    assert not [call for call in fake_podman.calls() if call[:1] == ["run"]]
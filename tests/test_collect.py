@@ -0,0 +1,105 @@
+import pathlib
+import sys
+
+import pytest
+
+from .conftest import FakePodman
+from containers import Container
+from containers import ContainerRunError
+from containers import ContainersService
+from containers.services.collect import OutputCollector
+
+SCRIPT = """
+import sys
+data = sys.stdin.buffer.read()
+# Write more than the pipe buffer to both streams
+sys.stdout.buffer.write(b"o" * 200000)
+sys.stderr.buffer.write(b"e" * 200000)
+sys.stdout.buffer.write(data)
+sys.exit(int(sys.argv[1]))
+"""
+
+
+def make_container(exit_code: int = 0) -> Container:
+    return Container(
+        image="python", command=(sys.executable, "-c", SCRIPT, str(exit_code))
+    )
+
+
+def test_output_collector():
+    collector = OutputCollector(max_size=5)
+    collector.write(b"abc")
+    collector.write(b"defg")
+    collector.write(b"h")
+    assert collector.size == 8
+    assert collector.truncated == 3
+    assert collector.getvalue() == b"abcde\n[... 3 bytes truncated ...]\n"
+
+    collector = OutputCollector()
+    collector.write(b"abc")
+    assert collector.getvalue() == b"abc"
+
+
+def test_output_collector_spill(tmp_path: pathlib.Path):
+    collector = OutputCollector(max_size=5, spill=True, spill_dir=tmp_path)
+    collector.write(b"abc")
+    assert collector.spill_path is None
+    collector.write(b"defg")
+    collector.write(b"h")
+    collector.close()
+    assert collector.spill_path.parent == tmp_path
+    assert collector.spill_path.read_bytes() == b"abcdefgh"
+    assert collector.getvalue().startswith(b"abcde\n")
+
+
+@pytest.mark.asyncio
+async def test_run_and_collect(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    result = await fake_containers.run_and_collect(make_container(3), input=b"input")
+    assert result.exit_code == 3
+    assert result.stdout == b"o" * 200000 + b"input"
+    assert result.stderr == b"e" * 200000
+    assert not result.truncated
+    assert result.elapsed > 0
+    assert result.first_byte is not None
+    assert result.peak_buffer_size >= 200000
+
+
+@pytest.mark.asyncio
+async def test_run_and_collect_truncated(
+    fake_podman: FakePodman, fake_containers: ContainersService, tmp_path: pathlib.Path
+):
+    result = await fake_containers.run_and_collect(
+        make_container(), max_output_size=1000, spill=True, spill_dir=tmp_path
+    )
+    assert result.stdout == b"o" * 1000 + b"\n[... 199000 bytes truncated ...]\n"
+    assert result.stdout_size == 200000
+    assert result.stderr_truncated == 199000
+    assert result.truncated
+    assert result.peak_buffer_size == 2000
+    assert result.stdout_path.read_bytes() == b"o" * 200000
+    assert result.stderr_path.read_bytes() == b"e" * 200000
+    result.cleanup()
+    assert not result.stdout_path.exists()
+    assert not result.stderr_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_run_and_collect_check(
+    fake_podman: FakePodman, fake_containers: ContainersService, tmp_path: pathlib.Path
+):
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    with pytest.raises(ContainerRunError) as exc_info:
+        await fake_containers.run_and_collect(
+            make_container(1),
+            max_output_size=10,
+            spill=True,
+            spill_dir=spill_dir,
+            check=True,
+        )
+    assert exc_info.value.code == 1
+    assert exc_info.value.stderr.startswith(b"e" * 10)
+    # No temp file is left behind
+    assert list(spill_dir.iterdir()) == []
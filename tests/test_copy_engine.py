@@ -0,0 +1,217 @@
+import asyncio
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import pytest
+
+from containers import CopyEngine
+from containers import Podman
+from containers import SmallFileCache
+from containers import WindowsContainersService
+
+
+def make_tree(root: pathlib.Path):
+    (root / "sub" / "deeper").mkdir(parents=True)
+    (root / "a.txt").write_text("a")
+    (root / "sub" / "b.txt").write_text("bb")
+    (root / "sub" / "deeper" / "c.txt").write_text("ccc")
+
+
+def read_tree(root: pathlib.Path) -> dict:
+    return {
+        str(path.relative_to(root)): path.read_text()
+        for path in sorted(root.rglob("*"))
+        if path.is_file()
+    }
+
+
+@pytest.fixture
+def engine(tmp_path: pathlib.Path) -> CopyEngine:
+    engine = CopyEngine(cache_dir=tmp_path / "cache", max_workers=4)
+    yield engine
+    engine.close()
+
+
+def test_copy_tree(tmp_path: pathlib.Path, engine: CopyEngine):
+    src = tmp_path / "src"
+    make_tree(src)
+    stats = engine.copy_tree(src, tmp_path / "dest0")
+    assert read_tree(tmp_path / "dest0") == read_tree(src)
+    assert stats.copied_files == 3
+    assert stats.copied_bytes == 6
+    assert stats.reused_files == 0
+
+    # Only the changed file is copied again
+    (src / "sub" / "b.txt").write_text("changed")
+    stats = engine.copy_tree(src, tmp_path / "dest1")
+    assert read_tree(tmp_path / "dest1") == read_tree(src)
+    assert stats.copied_files == 1
+    assert stats.reused_files == 2
+    # The previous copy is not affected
+    assert (tmp_path / "dest0" / "sub" / "b.txt").read_text() == "bb"
+
+
+def test_persistent_cache(tmp_path: pathlib.Path, engine: CopyEngine):
+    src = tmp_path / "src"
+    make_tree(src)
+    engine.copy_tree(src, tmp_path / "dest0")
+    other = CopyEngine(cache_dir=tmp_path / "cache")
+    try:
+        assert len(other.cache) == 3
+        assert other.cache.size == 6
+        stats = other.copy_tree(src, tmp_path / "dest1")
+        assert stats.reused_files == 3
+    finally:
+        other.close()
+
+
+def test_eviction(tmp_path: pathlib.Path):
+    src = tmp_path / "src"
+    src.mkdir()
+    for i in range(4):
+        (src / f"{i}.bin").write_bytes(os.urandom(100))
+    engine = CopyEngine(cache_dir=tmp_path / "cache", max_cache_size=250)
+    try:
+        stats = engine.copy_tree(src, tmp_path / "dest")
+        assert stats.evicted_files == 2
+        assert stats.evicted_bytes == 200
+        assert engine.cache.size == 200
+        assert len(list((tmp_path / "cache" / "objects").glob("*/*"))) == 2
+        # The staged copies survive eviction
+        for i in range(4):
+            assert (tmp_path / "dest" / f"{i}.bin").read_bytes() == (
+                src / f"{i}.bin"
+            ).read_bytes()
+    finally:
+        engine.close()
+
+
+def test_eviction_shared(tmp_path: pathlib.Path):
+    # Two engines on the same cache directory, like two processes
+    engines = [
+        CopyEngine(cache_dir=tmp_path / "cache", max_cache_size=250) for _ in range(2)
+    ]
+    try:
+        for i, engine in enumerate(engines):
+            src = tmp_path / f"src{i}"
+            src.mkdir()
+            for j in range(2):
+                (src / f"{j}.bin").write_bytes(os.urandom(100))
+            engine.copy_tree(src, tmp_path / f"dest{i}")
+        # The objects of the first engine count in the eviction of the second one
+        objects = list((tmp_path / "cache" / "objects").glob("*/*"))
+        assert sum(path.stat().st_size for path in objects) == 200
+        assert engines[1].cache.size == 200
+    finally:
+        for engine in engines:
+            engine.close()
+
+
+def test_temp_files(tmp_path: pathlib.Path):
+    objects = tmp_path / "cache" / "objects" / "ab"
+    objects.mkdir(parents=True)
+    # In progress in a live process, left by a dead one, and too old
+    in_progress = objects / f".cdef.{os.getpid()}.1"
+    proc = subprocess.run(
+        [sys.executable, "-c", "import os; print(os.getpid())"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    dead = objects / f".cdef.{proc.stdout.strip()}.1"
+    old = objects / f".cdef.{os.getpid()}.2"
+    for path in (in_progress, dead, old):
+        path.write_bytes(b"partial")
+    os.utime(old, (time.time() - 2 * 3600,) * 2)
+
+    engine = CopyEngine(cache_dir=tmp_path / "cache")
+    try:
+        assert in_progress.exists()
+        assert not dead.exists()
+        assert not old.exists()
+        assert len(engine.cache) == 0
+    finally:
+        engine.close()
+
+
+@pytest.mark.asyncio
+async def test_copy_tree_async(tmp_path: pathlib.Path, engine: CopyEngine):
+    src = tmp_path / "src"
+    make_tree(src)
+    results = await asyncio.gather(
+        engine.copy_tree_async(src, tmp_path / "dest0"),
+        engine.copy_tree_async(src, tmp_path / "dest1"),
+    )
+    assert sum(stats.copied_files + stats.reused_files for stats in results) == 6
+    assert read_tree(tmp_path / "dest0") == read_tree(tmp_path / "dest1")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Uses XDG_CACHE_HOME")
+@pytest.mark.asyncio
+async def test_default_cache_dir(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    service = WindowsContainersService(Podman())
+    # Nothing is created until the first copy
+    assert not (tmp_path / "xdg").exists()
+    engine = service.copy_engine
+    assert engine.cache.root == tmp_path / "xdg" / "container-helpers" / "staging"
+    assert engine.cache.root.is_dir()
+    assert (engine.cache.root.parent.stat().st_mode & 0o777) == 0o700
+    src = tmp_path / "src"
+    make_tree(src)
+    await engine.copy_tree_async(src, tmp_path / "dest")
+    await service.close()
+
+
+@pytest.mark.asyncio
+async def test_small_file_cache(tmp_path: pathlib.Path):
+    cache = SmallFileCache()
+    src = tmp_path / "git.json"
+    src.write_text('{"defaultAction": "SCMP_ACT_ALLOW"}')
+    async with cache.acquire(src, suffix=".json") as path0:
+        async with cache.acquire(src, suffix=".json") as path1:
+            assert path0 == path1
+            assert path0.suffix == ".json"
+            assert path0.read_text() == src.read_text()
+    # Kept for the next runs
+    assert path0.exists()
+    assert len(cache) == 1
+
+    async with cache.acquire(src, suffix=".json") as path2:
+        assert path2 == path0
+        src.write_text('{"defaultAction": "SCMP_ACT_ERRNO"}')
+        async with cache.acquire(src, suffix=".json") as path3:
+            assert path3 != path0
+            assert path3.read_text() == src.read_text()
+            # The outdated copy is still in use
+            assert path0.exists()
+    # And removed once released
+    assert not path0.exists()
+    assert len(cache) == 1
+
+    root = cache.root
+    cache.close()
+    assert not root.exists()
+
+
+@pytest.mark.asyncio
+async def test_small_file_cache_stat_revalidation(tmp_path: pathlib.Path):
+    cache = SmallFileCache(root=tmp_path / "cache")
+    src = tmp_path / "profile.json"
+    src.write_text("{}")
+    async with cache.acquire(src) as path:
+        pass
+    stat = src.stat()
+    # Same mtime and size, the file is not read again
+    src.write_text("[]")
+    os.utime(src, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    async with cache.acquire(src) as path:
+        assert path.read_text() == "{}"
+    cache.close()
+    assert not path.exists()
+    assert (tmp_path / "cache").exists()
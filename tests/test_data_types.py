@@ -0,0 +1,77 @@
+import copy
+import dataclasses
+import pickle
+import typing
+
+import pytest
+
+from containers import ArchiveImageMount
+from containers import BindMount
+from containers import Container
+from containers import ImageMount
+from containers import ResourceLimits
+from containers import SecurityOptions
+from containers import VolumeMount
+
+
+@pytest.fixture
+def container() -> Container:
+    return Container(
+        image="my-image",
+        command=("git", "status"),
+        environ=dict(ENV_VAR0="VAL0"),
+        mounts=[
+            ImageMount(target="/data", source="data-image"),
+            BindMount(target="/artifacts", source="/var/tmp", readonly=True),
+            VolumeMount(target="/cache", readonly=False),
+        ],
+        security_options=SecurityOptions(seccomp="git.json"),
+        resources=ResourceLimits(cpus=1),
+    )
+
+
+def test_slots(container: Container):
+    for obj in (
+        container,
+        container.security_options,
+        container.resources,
+        *container.mounts,
+    ):
+        assert not hasattr(obj, "__dict__")
+    with pytest.raises(AttributeError):
+        container.unknown = 1
+    # Inherited fields are not duplicated in the slots of subclasses
+    assert BindMount.__slots__ == (
+        "source",
+        "readonly",
+        "chown",
+        "relabel",
+        "bind_propagation",
+    )
+
+
+def test_copy(container: Container):
+    assert copy.deepcopy(container) == container
+    assert pickle.loads(pickle.dumps(container)) == container
+    new_container = dataclasses.replace(container, command=("git", "log"))
+    assert new_container.command == ("git", "log")
+    assert container.command == ("git", "status")
+    # The unchanged parts are shared
+    assert new_container.mounts is container.mounts
+
+
+def test_subclass():
+    @dataclasses.dataclass
+    class LabeledImageMount(ImageMount):
+        label: typing.Optional[str] = None
+
+    mount = LabeledImageMount(target="/data", source="data-image", label="a")
+    assert mount.label == "a"
+    assert dataclasses.replace(mount, label="b").label == "b"
+
+
+def test_archive_image_mount():
+    mount = ArchiveImageMount(target="/data", source="data-image", archive_to="/a")
+    assert not hasattr(mount, "__dict__")
+    assert mount.archive_to == "/a"
+    assert dataclasses.replace(mount, archive_to="/b").archive_to == "/b"
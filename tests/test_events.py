@@ -0,0 +1,167 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+from .conftest import count_calls
+from .conftest import FakePodman
+from containers import APIContainersService
+from containers import Container
+from containers import ContainerRunError
+from containers import ContainersService
+from containers import EventsWatcher
+from containers import OCIContainersService
+from containers import Podman
+
+SLEEP = "import time; time.sleep(30)"
+
+
+@pytest.mark.asyncio
+async def test_run_detached(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    containers = [
+        Container(image="alpine", command=(sys.executable, "-c", f"exit({code})"))
+        for code in range(8)
+    ]
+
+    async def run(container: Container) -> int:
+        async with fake_containers.run_detached(container) as detached:
+            assert detached.id
+            return await detached.wait(timeout=10)
+
+    try:
+        codes = await asyncio.gather(*map(run, containers))
+        watcher = fake_containers.events
+        assert watcher.running
+    finally:
+        await fake_containers.close()
+    # The events process is stopped with the service
+    assert not watcher.running
+    assert fake_containers.events is None
+    assert codes == list(range(8))
+    # All the containers are watched by a single events process
+    assert count_calls(fake_podman, "events") == 1
+    assert count_calls(fake_podman, "rm") == 0
+
+
+@pytest.mark.asyncio
+async def test_run_detached_env(
+    tmp_path, fake_podman: FakePodman, fake_containers: ContainersService
+):
+    output = tmp_path / "output.txt"
+    container = Container(
+        image="alpine",
+        command=(
+            sys.executable,
+            "-c",
+            f"import os; open({str(output)!r}, 'w').write(os.environ['MY_ENV'])",
+        ),
+        environ=dict(MY_ENV="hello"),
+    )
+    try:
+        async with fake_containers.run_detached(container) as detached:
+            assert await detached.wait(timeout=10) == 0
+    finally:
+        await fake_containers.close()
+    assert output.read_text() == "hello"
+
+
+@pytest.mark.asyncio
+async def test_run_detached_remove_on_exit(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    container = Container(image="alpine", command=(sys.executable, "-c", SLEEP))
+    try:
+        async with fake_containers.run_detached(container) as detached:
+            with pytest.raises(asyncio.TimeoutError):
+                await detached.wait(timeout=0.5)
+        assert ["rm", "--force", detached.id] in fake_podman.calls()
+        # The removal kills the container, which shows up in the events
+        assert (
+            await asyncio.wait_for(fake_containers.events.wait(detached.id), 10) == 137
+        )
+    finally:
+        await fake_containers.close()
+
+
+@pytest.mark.asyncio
+async def test_run_detached_launch_failure(tmp_path):
+    executable = tmp_path / "podman"
+    executable.write_text(
+        "#!/bin/sh\n"
+        'if [ "$1" = "events" ]; then exec sleep 30; fi\n'
+        'echo "Error: no such image" >&2\n'
+        "exit 125\n"
+    )
+    executable.chmod(0o755)
+    service = ContainersService(Podman(executable=executable))
+    try:
+        with pytest.raises(ContainerRunError) as exc_info:
+            async with service.run_detached(Container(image="missing", command=())):
+                pass
+    finally:
+        await service.close()
+    assert exc_info.value.code == 125
+    assert b"no such image" in exc_info.value.stderr
+
+
+@pytest.mark.asyncio
+async def test_events_watcher_recent_exits(fake_podman: FakePodman):
+    watcher = EventsWatcher(Podman(executable=fake_podman.executable))
+    events = fake_podman.state_dir / "events.jsonl"
+    events.write_text(
+        "".join(
+            json.dumps(dict(ID=f"c{i}", Status="died", ContainerExitCode=i)) + "\n"
+            for i in range(3)
+        )
+        + "not json\n"
+        + json.dumps(dict(ID="c9", Status="start"))
+        + "\n"
+    )
+    await watcher.start()
+    try:
+        waiters = [
+            asyncio.ensure_future(watcher.wait(container_id))
+            for container_id in ("c0", "c1", "c2", "c3", "c3")
+        ]
+        with events.open("a") as fo:
+            fo.write(json.dumps(dict(ID="c3", Status="died")) + "\n")
+        assert await asyncio.wait_for(asyncio.gather(*waiters), 10) == [0, 1, 2, 0, 0]
+    finally:
+        await watcher.close()
+    assert not watcher.running
+
+
+@pytest.mark.asyncio
+async def test_events_watcher_missing_executable(tmp_path):
+    watcher = EventsWatcher(Podman(executable=tmp_path / "missing"))
+    with pytest.raises(FileNotFoundError):
+        await watcher.start()
+    with pytest.raises(FileNotFoundError):
+        await watcher.wait("c0")
+
+
+@pytest.mark.parametrize("service_class", [APIContainersService, OCIContainersService])
+@pytest.mark.asyncio
+async def test_run_detached_unsupported_service(service_class: type):
+    service = service_class()
+    with pytest.raises(TypeError, match="doesn't support detached runs"):
+        async with service.run_detached(Container(image="alpine", command=())):
+            pass
+    assert service.events is None
+
+
+@pytest.mark.asyncio
+async def test_close_given_watcher(fake_podman: FakePodman):
+    provider = Podman(executable=fake_podman.executable)
+    watcher = EventsWatcher(provider)
+    service = ContainersService(provider, events=watcher)
+    try:
+        await watcher.start()
+        await service.close()
+        # Left to its owner
+        assert watcher.running
+    finally:
+        await watcher.close()
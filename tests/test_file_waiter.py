@@ -0,0 +1,164 @@
+import asyncio
+import os
+import pathlib
+import sys
+import typing
+
+import pytest
+
+from containers import ArchiveImageMount
+from containers import BindMount
+from containers import FileWaiter
+
+requires_inotify = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is only on Linux"
+)
+
+
+@pytest.fixture
+def waiter() -> typing.Generator[FileWaiter, None, None]:
+    # Polling that slow would time out the tests, so inotify must be used
+    waiter = FileWaiter(poll_interval=60)
+    yield waiter
+    waiter.close()
+
+
+@pytest.fixture
+def poll_waiter() -> typing.Generator[FileWaiter, None, None]:
+    waiter = FileWaiter(poll_interval=0.01, use_inotify=False)
+    yield waiter
+    waiter.close()
+
+
+async def create_later(path: pathlib.Path, delay: float = 0.05):
+    await asyncio.sleep(delay)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("")
+
+
+@pytest.mark.asyncio
+async def test_existing_file(waiter: FileWaiter, tmp_path: pathlib.Path):
+    (tmp_path / "success").write_text("")
+    await waiter.wait(tmp_path / "success", timeout=0)
+    assert waiter.watch_count == 0
+
+
+@requires_inotify
+@pytest.mark.asyncio
+async def test_many_waiters(waiter: FileWaiter, tmp_path: pathlib.Path):
+    assert waiter.uses_inotify
+    paths = [tmp_path / f"job-{i}.success" for i in range(50)]
+    waits = [asyncio.ensure_future(waiter.wait(path, timeout=5)) for path in paths]
+    await asyncio.sleep(0)
+    # One watch for all the files in the same directory
+    assert waiter.watch_count == 1
+
+    await create_later(paths[0])
+    await asyncio.sleep(0.05)
+    assert waits[0].done()
+    assert not any(wait.done() for wait in waits[1:])
+
+    for path in paths[1:]:
+        path.write_text("")
+    await asyncio.gather(*waits)
+    assert waiter.watch_count == 0
+
+
+@requires_inotify
+@pytest.mark.asyncio
+async def test_same_file(waiter: FileWaiter, tmp_path: pathlib.Path):
+    path = tmp_path / "success"
+    await asyncio.gather(
+        waiter.wait(path, timeout=5),
+        waiter.wait(path, timeout=5),
+        create_later(path),
+    )
+    assert waiter.watch_count == 0
+
+
+@requires_inotify
+@pytest.mark.asyncio
+async def test_renamed_file(waiter: FileWaiter, tmp_path: pathlib.Path):
+    path = tmp_path / "success"
+
+    async def rename_later():
+        await create_later(tmp_path / ".success.tmp")
+        os.rename(tmp_path / ".success.tmp", path)
+
+    await asyncio.gather(waiter.wait(path, timeout=5), rename_later())
+
+
+@pytest.mark.asyncio
+async def test_timeout(waiter: FileWaiter, tmp_path: pathlib.Path):
+    with pytest.raises(asyncio.TimeoutError):
+        await waiter.wait(tmp_path / "never", timeout=0.05)
+    assert waiter.watch_count == 0
+
+
+@pytest.mark.asyncio
+async def test_poll(poll_waiter: FileWaiter, tmp_path: pathlib.Path):
+    assert not poll_waiter.uses_inotify
+    path = tmp_path / "success"
+    await asyncio.gather(
+        poll_waiter.wait(path, timeout=5),
+        poll_waiter.wait(path, timeout=5),
+        create_later(path),
+    )
+    with pytest.raises(asyncio.TimeoutError):
+        await poll_waiter.wait(tmp_path / "never", timeout=0.05)
+
+
+@requires_inotify
+@pytest.mark.asyncio
+async def test_missing_directory(tmp_path: pathlib.Path):
+    waiter = FileWaiter(poll_interval=0.01)
+    try:
+        # Cannot be watched yet, polled instead
+        path = tmp_path / "not-yet" / "success"
+        await asyncio.gather(waiter.wait(path, timeout=5), create_later(path))
+    finally:
+        waiter.close()
+
+
+@requires_inotify
+@pytest.mark.asyncio
+async def test_directory_removed(tmp_path: pathlib.Path):
+    waiter = FileWaiter(poll_interval=0.01)
+    try:
+        directory = tmp_path / "archives"
+        directory.mkdir()
+        path = directory / "success"
+        wait = asyncio.ensure_future(waiter.wait(path, timeout=5))
+        await asyncio.sleep(0.01)
+        assert waiter.watch_count == 1
+        directory.rmdir()
+        await asyncio.sleep(0.05)
+        # The waiter is moved to polling
+        assert waiter.watch_count == 0
+        assert not wait.done()
+        await create_later(path, delay=0)
+        await wait
+    finally:
+        waiter.close()
+
+
+@requires_inotify
+@pytest.mark.asyncio
+async def test_wait_archives(waiter: FileWaiter, tmp_path: pathlib.Path):
+    mounts = [
+        ArchiveImageMount(
+            target=f"/data{i}",
+            source="data-image",
+            archive_to=tmp_path / f"data{i}.tar",
+            archive_success=tmp_path / f"data{i}.success",
+        )
+        for i in range(2)
+    ]
+    mounts.append(BindMount(target="/src", source=tmp_path, readonly=True))
+    with pytest.raises(asyncio.TimeoutError):
+        await waiter.wait_archives(mounts, timeout=0.05)
+    await asyncio.gather(
+        waiter.wait_archives(mounts, timeout=5),
+        create_later(tmp_path / "data0.success"),
+        create_later(tmp_path / "data1.success", delay=0.1),
+    )
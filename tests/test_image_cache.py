@@ -0,0 +1,107 @@
+import pytest
+
+from .conftest import FakePodman
+from containers import ContainersService
+from containers import ImageCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_image_cache_ttl():
+    clock = FakeClock()
+    cache = ImageCache(ttl=10, clock=clock)
+    cache.add("alpine")
+    assert "alpine" in cache
+    clock.now = 9.9
+    assert "alpine" in cache
+    clock.now = 10
+    assert "alpine" not in cache
+    assert len(cache) == 0
+
+
+def test_image_cache_without_ttl():
+    clock = FakeClock()
+    cache = ImageCache(ttl=None, clock=clock)
+    cache.add("alpine")
+    clock.now = 1e9
+    assert "alpine" in cache
+
+
+def test_image_cache_digest():
+    digest = "sha256:" + "a" * 64
+    cache = ImageCache()
+    cache.add("alpine:3.18.2", digest=digest)
+    assert f"alpine@{digest}" in cache
+    assert "alpine@sha256:" + "b" * 64 not in cache
+    cache.invalidate(f"alpine@{digest}")
+    assert "alpine:3.18.2" not in cache
+
+
+def test_image_cache_digest_repository():
+    digest = "sha256:" + "a" * 64
+    cache = ImageCache()
+    cache.add("alpine:3.18.2", digest=digest)
+    assert f"docker.io/library/alpine@{digest}" in cache
+    assert f"busybox@{digest}" not in cache
+    cache.invalidate(f"busybox@{digest}")
+    assert "alpine:3.18.2" in cache
+    cache.invalidate(digest)
+    assert "alpine:3.18.2" not in cache
+    assert len(cache) == 0
+
+
+def test_image_cache_invalidate_and_clear():
+    cache = ImageCache()
+    cache.add("alpine")
+    cache.add("python:3.11")
+    cache.invalidate("alpine")
+    assert "alpine" not in cache
+    assert "python:3.11" in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_load_image_uses_cache(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    fake_podman.add_image("alpine")
+    await fake_containers.load_image("alpine")
+    await fake_containers.load_image("alpine")
+    assert fake_podman.calls() == [
+        ["image", "inspect", "--format", "{{.Digest}}", "alpine"],
+    ]
+    assert fake_containers.image_cache.get("alpine").digest == "sha256:" + "0" * 64
+
+
+@pytest.mark.asyncio
+async def test_load_image_records_pull(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    await fake_containers.load_image("alpine")
+    await fake_containers.load_image("alpine")
+    assert fake_podman.calls() == [
+        ["image", "inspect", "--format", "{{.Digest}}", "alpine"],
+        ["pull", "alpine"],
+    ]
+
+    fake_containers.image_cache.invalidate("alpine")
+    await fake_containers.load_image("alpine")
+    assert len(fake_podman.calls()) == 3
+
+
+@pytest.mark.asyncio
+async def test_load_image_always_pull_skips_cache(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    fake_podman.add_image("alpine")
+    await fake_containers.load_image("alpine")
+    await fake_containers.load_image("alpine", always_pull=True)
+    assert fake_podman.calls()[-1] == ["pull", "alpine"]
+    assert "alpine" in fake_containers.image_cache
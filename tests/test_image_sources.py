@@ -0,0 +1,167 @@
+import itertools
+import pathlib
+import subprocess
+import sys
+import time
+
+import pytest
+
+from .conftest import FakePodman
+from containers import ArchiveImageSource
+from containers import ContainersService
+from containers import Podman
+
+
+def make_service(
+    fake_podman: FakePodman, source: ArchiveImageSource
+) -> ContainersService:
+    return ContainersService(
+        Podman(executable=fake_podman.executable), image_sources=[source]
+    )
+
+
+def commands(fake_podman: FakePodman) -> list:
+    return [call[0] for call in fake_podman.calls() if call[0] != "image"]
+
+
+@pytest.fixture
+def source(tmp_path: pathlib.Path) -> ArchiveImageSource:
+    counter = itertools.count()
+    return ArchiveImageSource(tmp_path / "archives", clock=lambda: float(next(counter)))
+
+
+@pytest.mark.asyncio
+async def test_store_and_load(fake_podman: FakePodman, source: ArchiveImageSource):
+    service = make_service(fake_podman, source)
+    assert await service.load_image("alpine")
+    await service.wait_image_stores()
+    assert commands(fake_podman) == ["pull", "save"]
+    digest = fake_podman.images["alpine"]
+    key = digest.split(":")[1]
+    index = source.read_index()
+    assert index["references"] == {"docker.io/library/alpine:latest": key}
+    assert source.archive_path(key).exists()
+
+    # A cold node loads it from the archive instead of the registry
+    fake_podman.remove_image("alpine")
+    assert await make_service(fake_podman, source).load_image("alpine")
+    assert commands(fake_podman) == ["pull", "save", "load"]
+    assert fake_podman.images["alpine"] == digest
+
+    # A digest reference finds the archive of any tag of the same image
+    assert source._find_key(source.read_index(), f"quay.io/other@{digest}") == key
+
+
+@pytest.mark.asyncio
+async def test_always_pull_skips_sources(
+    fake_podman: FakePodman, source: ArchiveImageSource
+):
+    service = make_service(fake_podman, source)
+    await service.load_image("alpine")
+    await service.wait_image_stores()
+    await service.load_image("alpine", always_pull=True)
+    await service.wait_image_stores()
+    assert commands(fake_podman) == ["pull", "save", "pull"]
+
+
+@pytest.mark.asyncio
+async def test_broken_archive_falls_back_to_registry(
+    fake_podman: FakePodman, source: ArchiveImageSource
+):
+    service = make_service(fake_podman, source)
+    await service.load_image("alpine")
+    await service.wait_image_stores()
+    key = fake_podman.images["alpine"].split(":")[1]
+    source.archive_path(key).write_text("broken")
+    fake_podman.remove_image("alpine")
+    service = make_service(fake_podman, source)
+    assert await service.load_image("alpine")
+    await service.wait_image_stores()
+    assert commands(fake_podman) == ["pull", "save", "load", "pull"]
+
+
+@pytest.mark.asyncio
+async def test_eviction(tmp_path: pathlib.Path, fake_podman: FakePodman):
+    counter = itertools.count()
+    source = ArchiveImageSource(
+        tmp_path / "archives", max_size=2500, clock=lambda: float(next(counter))
+    )
+    service = make_service(fake_podman, source)
+    for image in ("alpine", "busybox", "ubuntu"):
+        await service.load_image(image)
+        await service.wait_image_stores()
+        # Use alpine again, so that busybox is the least recently used
+        if image == "busybox":
+            fake_podman.remove_image("alpine")
+            service.image_cache.invalidate("alpine")
+            await service.load_image("alpine")
+            await service.wait_image_stores()
+    index = source.read_index()
+    assert set(index["references"]) == {
+        "docker.io/library/alpine:latest",
+        "docker.io/library/ubuntu:latest",
+    }
+    assert len(list(source.directory.glob("*.tar"))) == 2
+
+
+@pytest.mark.asyncio
+async def test_store_in_background(fake_podman: FakePodman, source: ArchiveImageSource):
+    service = make_service(fake_podman, source)
+    await service.load_image("busybox")
+    await service.wait_image_stores()
+    fake_podman.remove_image("busybox")
+    service.image_cache.invalidate("busybox")
+
+    fake_podman.set_save_delay(2)
+    # Available before it's saved
+    assert await service.load_image("alpine")
+    assert list(source.read_index()["references"]) == [
+        "docker.io/library/busybox:latest"
+    ]
+    # Loading another archive doesn't wait for the save
+    assert await service.load_image("busybox")
+    # The save of alpine is still running
+    assert commands(fake_podman)[:3] == ["pull", "save", "pull"]
+    assert sorted(commands(fake_podman)[3:]) == ["load", "save"]
+    assert list(source.read_index()["references"]) == [
+        "docker.io/library/busybox:latest"
+    ]
+
+    await service.wait_image_stores()
+    assert set(source.read_index()["references"]) == {
+        "docker.io/library/alpine:latest",
+        "docker.io/library/busybox:latest",
+    }
+    assert len(list(source.directory.glob("*.tar"))) == 2
+    assert not list(source.directory.glob(".*"))
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="No directory lock on Windows")
+@pytest.mark.asyncio
+async def test_index_locked_across_processes(
+    fake_podman: FakePodman, source: ArchiveImageSource
+):
+    source.directory.mkdir()
+    # Another process holding the lock on the directory
+    holder = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import fcntl, sys, time\n"
+            "fo = open(sys.argv[1], 'a')\n"
+            "fcntl.flock(fo.fileno(), fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "time.sleep(0.5)\n",
+            str(source.directory / "lock"),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout.readline() == "locked\n"
+        begin = time.monotonic()
+        assert not await source.load(make_service(fake_podman, source), "alpine")
+        assert time.monotonic() - begin >= 0.3
+    finally:
+        holder.wait()
+        holder.stdout.close()
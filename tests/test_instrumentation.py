@@ -0,0 +1,119 @@
+import asyncio
+import sys
+import typing
+
+import pytest
+
+from .conftest import FakePodman
+from containers import CallbackInstrument
+from containers import Container
+from containers import ContainersService
+from containers import Podman
+from containers import TimingEvent
+from containers import TracingInstrument
+from containers.services.instrumentation import Histogram
+
+
+class FakeSpan:
+    def __init__(self, name: str, start_time: int, attributes: typing.Dict):
+        self.name = name
+        self.start_time = start_time
+        self.attributes = attributes
+        self.end_time = None
+
+    def end(self, end_time: int):
+        self.end_time = end_time
+
+
+class FakeTracer:
+    def __init__(self):
+        self.spans: typing.List[FakeSpan] = []
+
+    def start_span(self, name: str, start_time: int, attributes: typing.Dict):
+        span = FakeSpan(name, start_time=start_time, attributes=attributes)
+        self.spans.append(span)
+        return span
+
+
+def test_histogram():
+    histogram = Histogram.make(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.count == 5
+    assert histogram.mean == pytest.approx(16.5 / 5)
+    assert histogram.percentile(50) == 2
+    assert histogram.percentile(80) == 4
+    assert histogram.percentile(99) == 10
+    assert Histogram.make().percentile(50) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_service_instruments(fake_podman: FakePodman):
+    events: typing.List[TimingEvent] = []
+    tracer = FakeTracer()
+    service = ContainersService(
+        Podman(executable=fake_podman.executable),
+        instruments=[CallbackInstrument(events.append), TracingInstrument(tracer)],
+        collect_timings=True,
+    )
+    await service.load_image("alpine")
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", "import sys; sys.exit(3)")
+    )
+    async with service.run(container) as proc:
+        await proc.wait()
+    async with service.stream(
+        Container(image="alpine", command=("echo", "hello"))
+    ) as output:
+        await output.wait()
+
+    assert [(event.phase, event.image) for event in events] == [
+        ("inspect_image", "alpine"),
+        ("pull_image", "alpine"),
+        ("build_command", "alpine"),
+        ("spawn", "alpine"),
+        ("run", "alpine"),
+        ("build_command", "alpine"),
+        ("spawn", "alpine"),
+        ("first_byte", "alpine"),
+        ("run", "alpine"),
+    ]
+    assert events[0].attributes == dict(found=False)
+    assert events[4].exit_code == 3
+    assert events[7].attributes == dict(stream="stdout")
+    assert all(event.duration >= 0 for event in events)
+
+    assert [span.name for span in tracer.spans][:2] == [
+        "containers.inspect_image",
+        "containers.pull_image",
+    ]
+    assert tracer.spans[4].attributes == {
+        "container.image": "alpine",
+        "container.exit_code": 3,
+    }
+    assert all(span.end_time >= span.start_time for span in tracer.spans)
+
+    snapshot = service.timings.snapshot()
+    assert snapshot["run"]["count"] == 2
+    assert snapshot["spawn"]["count"] == 2
+    assert service.timings.exit_codes == {3: 1, 0: 1}
+
+
+@pytest.mark.asyncio
+async def test_broken_instrument(
+    fake_podman: FakePodman, caplog: pytest.LogCaptureFixture
+):
+    def broken(event: TimingEvent):
+        raise RuntimeError("boom")
+
+    service = ContainersService(
+        Podman(executable=fake_podman.executable),
+        instruments=[CallbackInstrument(broken)],
+    )
+    async with service.run(
+        Container(image="alpine", command=("true",)),
+        stdout=asyncio.subprocess.DEVNULL,
+    ) as proc:
+        assert await proc.wait() == 0
+    assert "Failed to emit timing event" in caplog.text
@@ -0,0 +1,177 @@
+import asyncio
+import typing
+
+import pytest
+
+from .conftest import FakePodman
+from containers import ContainersService
+from containers import LoadImageError
+from containers import LoadImagesError
+from containers import LoadImageStatus
+from containers import Podman
+from containers.services.batch import normalize_image_reference
+
+
+@pytest.mark.asyncio
+async def test_load_image_single_flight(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    fake_podman.set_pull_delay(0.2)
+    await asyncio.gather(*(fake_containers.load_image("alpine") for _ in range(50)))
+    assert fake_podman.calls() == [
+        ["image", "inspect", "--format", "{{.Digest}}", "alpine"],
+        ["pull", "alpine"],
+    ]
+    assert not fake_containers._loading_images
+
+
+@pytest.mark.asyncio
+async def test_load_image_single_flight_error(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    fake_podman.fail_pull("alpine")
+    results = await asyncio.gather(
+        *(fake_containers.load_image("alpine") for _ in range(10)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, LoadImageError) for result in results)
+    assert len(set(map(id, results))) == 1
+    assert len(fake_podman.calls()) == 2
+
+    # Failures are not cached, next call tries again
+    with pytest.raises(LoadImageError):
+        await fake_containers.load_image("alpine")
+    assert len(fake_podman.calls()) == 4
+
+
+@pytest.mark.asyncio
+async def test_load_image_single_flight_credentials(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    fake_podman.set_pull_delay(0.2)
+    await asyncio.gather(
+        fake_containers.load_image("alpine"),
+        fake_containers.load_image("alpine"),
+        fake_containers.load_image("alpine", credentials=("user", "secret")),
+    )
+    # The call with credentials doesn't join the pull without them
+    pull_calls = [call for call in fake_podman.calls() if call[0] == "pull"]
+    assert sorted(pull_calls) == [
+        ["pull", "alpine"],
+        ["pull", "alpine", "--creds", "user:secret"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_load_image_waiter_cancelled(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    fake_podman.set_pull_delay(0.2)
+    first = asyncio.ensure_future(fake_containers.load_image("alpine"))
+    second = asyncio.ensure_future(fake_containers.load_image("alpine"))
+    await asyncio.sleep(0.05)
+    first.cancel()
+    await second
+    assert first.cancelled()
+    assert fake_podman.calls()[-1] == ["pull", "alpine"]
+
+
+@pytest.mark.asyncio
+async def test_max_concurrent_pulls():
+    class Service(ContainersService):
+        def __init__(self):
+            super().__init__(Podman(), max_concurrent_pulls=2)
+            self.current = 0
+            self.peak = 0
+            self.pulled: typing.List[str] = []
+
+        async def _inspect_image(self, image: str):
+            return False, None
+
+        async def _pull_image(self, image: str, credentials=None):
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+            await asyncio.sleep(0.01)
+            self.pulled.append(image)
+            self.current -= 1
+
+    service = Service()
+    images = [f"image-{i}" for i in range(8)]
+    await asyncio.gather(*(service.load_image(image) for image in images))
+    assert service.peak == 2
+    assert sorted(service.pulled) == images
+
+
+@pytest.mark.parametrize(
+    "image, expected",
+    [
+        ("alpine", "docker.io/library/alpine:latest"),
+        ("alpine:3.18.2", "docker.io/library/alpine:3.18.2"),
+        ("launchplatform/app", "docker.io/launchplatform/app:latest"),
+        ("quay.io/podman/stable:v4", "quay.io/podman/stable:v4"),
+        ("localhost/my-image", "localhost/my-image:latest"),
+        ("localhost:5000/my-image:1.0", "localhost:5000/my-image:1.0"),
+        ("alpine@sha256:abc", "docker.io/library/alpine@sha256:abc"),
+    ],
+)
+def test_normalize_image_reference(image: str, expected: str):
+    assert normalize_image_reference(image) == expected
+
+
+@pytest.mark.asyncio
+async def test_load_images(fake_podman: FakePodman, fake_containers: ContainersService):
+    fake_podman.add_image("alpine")
+    fake_podman.add_image("docker.io/library/python:3.11")
+    fake_podman.fail_pull("bad:tag")
+    await fake_containers.load_image("alpine")
+
+    report = await fake_containers.load_images(
+        ["alpine", "python:3.11", "busybox", "bad:tag", "alpine"], concurrency=2
+    )
+    assert [(result.image, result.status) for result in report.results] == [
+        ("alpine", LoadImageStatus.CACHED),
+        ("python:3.11", LoadImageStatus.PRESENT),
+        ("busybox", LoadImageStatus.PULLED),
+        ("bad:tag", LoadImageStatus.FAILED),
+    ]
+    assert not report.ok
+    assert [result.image for result in report.failures] == ["bad:tag"]
+    assert all(result.elapsed >= 0 for result in report.results)
+    with pytest.raises(LoadImagesError) as exc_info:
+        report.raise_for_errors()
+    assert [error.image for error in exc_info.value.errors] == ["bad:tag"]
+
+    # One batched inspect, then the missing images are pulled without being
+    # inspected again
+    _, inspect_call, *pull_calls = fake_podman.calls()
+    assert inspect_call == [
+        "image",
+        "inspect",
+        "--format",
+        "json",
+        "python:3.11",
+        "busybox",
+        "bad:tag",
+    ]
+    assert sorted(pull_calls) == [["pull", "bad:tag"], ["pull", "busybox"]]
+    assert "python:3.11" in fake_containers.image_cache
+
+
+@pytest.mark.asyncio
+async def test_load_images_unmatched(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    # Reported as localhost/myimg:latest, which doesn't match the reference
+    fake_podman.add_image("localhost/myimg:latest")
+    report = await fake_containers.load_images(["myimg", "busybox"])
+    assert [(result.image, result.status) for result in report.results] == [
+        ("myimg", LoadImageStatus.PRESENT),
+        ("busybox", LoadImageStatus.PULLED),
+    ]
+    # Inspected again one by one before pulling, as they may be present
+    _, *calls = fake_podman.calls()
+    assert sorted(calls) == [
+        ["image", "inspect", "--format", "{{.Digest}}", "busybox"],
+        ["image", "inspect", "--format", "{{.Digest}}", "myimg"],
+        ["pull", "busybox"],
+    ]
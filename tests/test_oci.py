@@ -0,0 +1,398 @@
+import asyncio
+import dataclasses
+import json
+import pathlib
+import sys
+
+import pytest
+
+from .conftest import FakePodman
+from containers import BindMount
+from containers import Container
+from containers import ImageMount
+from containers import OCIContainersService
+from containers import OCIRuntime
+from containers import ResourceLimits
+from containers import SecurityOptions
+from containers import TerminationPolicy
+from containers import VolumeMount
+from containers.providers.oci import convert_seccomp_profile
+from containers.providers.oci import ImageConfig
+from containers.providers.oci import resolve_user
+
+
+@pytest.fixture
+def rootfs(tmp_path: pathlib.Path) -> pathlib.Path:
+    rootfs = tmp_path / "rootfs"
+    (rootfs / "etc").mkdir(parents=True)
+    (rootfs / "etc" / "passwd").write_text(
+        "root:x:0:0:root:/root:/bin/sh\napp:x:1000:1001::/home/app:/bin/sh\n"
+    )
+    (rootfs / "etc" / "group").write_text("root:x:0:\napp:x:1001:\nstaff:x:50:\n")
+    return rootfs
+
+
+@pytest.fixture
+def service(
+    tmp_path: pathlib.Path, fake_podman: FakePodman, fake_runtime: pathlib.Path
+) -> OCIContainersService:
+    fake_podman.add_image("alpine")
+    return OCIContainersService(
+        OCIRuntime(runtime=fake_runtime, executable=fake_podman.executable),
+        bundle_dir=tmp_path / "bundles",
+    )
+
+
+def runtime_calls(fake_podman: FakePodman) -> list:
+    path = fake_podman.state_dir / "runtime_calls.jsonl"
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.mark.parametrize(
+    "user, group, expected",
+    [
+        (None, None, (0, 0)),
+        ("app", None, (1000, 1001)),
+        ("1000", None, (1000, 1001)),
+        ("app", "staff", (1000, 50)),
+        ("app:50", None, (1000, 50)),
+        ("2000", "3000", (2000, 3000)),
+    ],
+)
+def test_resolve_user(rootfs: pathlib.Path, user, group, expected):
+    assert resolve_user(rootfs, user, group) == expected
+
+
+def test_resolve_user_unknown(rootfs: pathlib.Path):
+    with pytest.raises(ValueError):
+        resolve_user(rootfs, "missing")
+    with pytest.raises(ValueError):
+        resolve_user(rootfs, "app", "missing")
+
+
+def test_convert_seccomp_profile():
+    profile = {
+        "defaultAction": "SCMP_ACT_ERRNO",
+        "defaultErrnoRet": 1,
+        "archMap": [
+            {
+                "architecture": "SCMP_ARCH_X86_64",
+                "subArchitectures": ["SCMP_ARCH_X86", "SCMP_ARCH_X32"],
+            },
+            {"architecture": "SCMP_ARCH_AARCH64", "subArchitectures": []},
+        ],
+        "syscalls": [
+            {"names": ["read", "write"], "action": "SCMP_ACT_ALLOW"},
+            {"name": "close", "action": "SCMP_ACT_ALLOW", "args": []},
+            {
+                "names": ["arch_prctl"],
+                "action": "SCMP_ACT_ALLOW",
+                "includes": {"arches": ["amd64"]},
+            },
+            {
+                "names": ["mount"],
+                "action": "SCMP_ACT_ALLOW",
+                "includes": {"caps": ["CAP_SYS_ADMIN"]},
+            },
+            {
+                "names": ["chown"],
+                "action": "SCMP_ACT_ALLOW",
+                "includes": {"caps": ["CAP_CHOWN"]},
+            },
+            {
+                "names": ["personality"],
+                "action": "SCMP_ACT_ERRNO",
+                "errnoRet": 1,
+                "excludes": {"caps": ["CAP_SYS_ADMIN"]},
+            },
+        ],
+    }
+    assert convert_seccomp_profile(profile, arch="SCMP_ARCH_X86_64") == {
+        "defaultAction": "SCMP_ACT_ERRNO",
+        "defaultErrnoRet": 1,
+        "architectures": ["SCMP_ARCH_X86_64", "SCMP_ARCH_X86", "SCMP_ARCH_X32"],
+        "syscalls": [
+            {"names": ["read", "write"], "action": "SCMP_ACT_ALLOW"},
+            {"names": ["close"], "action": "SCMP_ACT_ALLOW"},
+            {"names": ["chown"], "action": "SCMP_ACT_ALLOW"},
+            {"names": ["personality"], "action": "SCMP_ACT_ERRNO", "errnoRet": 1},
+        ],
+    }
+
+
+def test_make_config(tmp_path: pathlib.Path, rootfs: pathlib.Path):
+    runtime = OCIRuntime(rootless=False)
+    container = Container(
+        image="alpine",
+        command=("-c", "echo hi"),
+        environ=dict(A="B", PATH="/bin"),
+        user="app",
+        work_dir="/data",
+        network="host",
+        shm_size="128m",
+        mounts=[
+            BindMount(source=tmp_path, target="/data", readonly=True),
+            ImageMount(source="tools", target="/tools"),
+            BindMount(source=tmp_path, target="/tmp", readonly=False),
+        ],
+        resources=ResourceLimits(cpus=1.5, memory="1g", ulimits=dict(nofile=1024)),
+        security_options=SecurityOptions(no_new_privileges=True),
+    )
+    config = runtime.make_config(
+        container,
+        rootfs=rootfs,
+        image_config=ImageConfig(
+            env=("PATH=/usr/bin", "LANG=C"), entrypoint=("sh",), cmd=("ls",)
+        ),
+        image_mounts={"tools": "/var/lib/tools"},
+    )
+    process = config["process"]
+    assert process["args"] == ["sh", "-c", "echo hi"]
+    assert process["env"] == ["PATH=/bin", "LANG=C", "A=B"]
+    assert process["cwd"] == "/data"
+    assert process["user"] == {"uid": 1000, "gid": 1001}
+    assert process["noNewPrivileges"]
+    assert process["rlimits"] == [{"type": "RLIMIT_NOFILE", "soft": 1024, "hard": 1024}]
+    assert config["root"] == {"path": str(rootfs), "readonly": True}
+    assert config["linux"]["resources"] == {
+        "cpu": {"quota": 150000, "period": 100000},
+        "memory": {"limit": 1024**3},
+    }
+    namespaces = [item["type"] for item in config["linux"]["namespaces"]]
+    assert "network" not in namespaces
+    assert "user" not in namespaces
+    mounts = {mount["destination"]: mount for mount in config["mounts"]}
+    assert mounts["/data"] == {
+        "destination": "/data",
+        "type": "bind",
+        "source": str(tmp_path),
+        "options": ["rbind", "ro"],
+    }
+    assert mounts["/tools"]["source"] == "/var/lib/tools"
+    assert mounts["/dev/shm"]["options"][-1] == f"size={128 * 1024**2}"
+    # Only /run gets a tmpfs, /tmp is mounted over
+    assert mounts["/run"]["type"] == "tmpfs"
+    assert mounts["/tmp"]["type"] == "bind"
+    assert mounts["/sys"]["type"] == "none"
+
+
+def test_make_config_defaults(rootfs: pathlib.Path):
+    runtime = OCIRuntime(rootless=True)
+    config = runtime.make_config(
+        Container(image="alpine", command=()),
+        rootfs=rootfs,
+        image_config=ImageConfig(cmd=("sh",), work_dir="/app"),
+    )
+    assert config["process"]["args"] == ["sh"]
+    assert config["process"]["cwd"] == "/app"
+    assert config["process"]["env"][0].startswith("PATH=")
+    namespaces = [item["type"] for item in config["linux"]["namespaces"]]
+    assert "network" in namespaces
+    assert "user" in namespaces
+    assert config["linux"]["uidMappings"][0]["containerID"] == 0
+
+
+@pytest.mark.parametrize(
+    "container",
+    [
+        Container(image="alpine", command=()),
+        Container(image="alpine", command=("ls",), network="bridge"),
+        Container(
+            image="alpine",
+            command=("ls",),
+            mounts=[VolumeMount(target="/data", readonly=True)],
+        ),
+        Container(
+            image="alpine",
+            command=("ls",),
+            mounts=[ImageMount(source="tools", target="/tools", read_write=True)],
+        ),
+    ],
+)
+def test_make_config_unsupported(rootfs: pathlib.Path, container: Container):
+    with pytest.raises(ValueError):
+        OCIRuntime().make_config(container, rootfs=rootfs)
+
+
+def test_build_commands(tmp_path: pathlib.Path):
+    runtime = OCIRuntime(state_dir=tmp_path)
+    assert runtime.build_run_command("/bundle", "c0", log_level="debug") == (
+        "crun",
+        "--root",
+        str(tmp_path),
+        "--log-level",
+        "debug",
+        "run",
+        "--bundle",
+        "/bundle",
+        "c0",
+    )
+    runtime = OCIRuntime(runtime=pathlib.Path("runc"))
+    assert runtime.build_kill_command("c0", signal="SIGTERM") == (
+        "runc",
+        "kill",
+        "c0",
+        "SIGTERM",
+    )
+    assert runtime.build_remove_command("c0") == ("runc", "delete", "--force", "c0")
+
+
+@pytest.mark.asyncio
+async def test_run(
+    tmp_path: pathlib.Path, fake_podman: FakePodman, service: OCIContainersService
+):
+    fake_podman.set_image_config(
+        "alpine", dict(Env=["PATH=/usr/bin:/bin", "IMAGE_ENV=1"])
+    )
+    container = Container(
+        image="alpine",
+        command=(
+            sys.executable,
+            "-c",
+            "import os; print(os.environ['IMAGE_ENV'], os.environ['MY_ENV'])",
+        ),
+        environ=dict(MY_ENV="hello"),
+        mounts=[BindMount(source=tmp_path, target="/data", readonly=True)],
+    )
+
+    async def run() -> bytes:
+        async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+            stdout, _ = await proc.communicate()
+            assert proc.returncode == 0
+            return stdout
+
+    try:
+        assert await asyncio.gather(run(), run(), run()) == [b"1 hello\n"] * 3
+    finally:
+        await service.close()
+    # The image is mounted once, and the bundle is generated once
+    mount_calls = [
+        call for call in fake_podman.calls() if call[:2] == ["image", "mount"]
+    ]
+    assert mount_calls == [["image", "mount", "alpine"]]
+    calls = runtime_calls(fake_podman)
+    assert len(calls) == 3
+    bundles = {call["args"][call["args"].index("--bundle") + 1] for call in calls}
+    assert len(bundles) == 1
+    assert len({call["args"][-1] for call in calls}) == 3
+    assert ["image", "unmount", "alpine"] in fake_podman.calls()
+
+
+@pytest.mark.asyncio
+async def test_run_pulls_missing_image(
+    fake_podman: FakePodman, service: OCIContainersService
+):
+    container = Container(image="busybox", command=("true",))
+    try:
+        async with service.run(container) as proc:
+            assert await proc.wait() == 0
+    finally:
+        await service.close()
+    assert ["pull", "busybox"] in fake_podman.calls()
+
+
+@pytest.mark.asyncio
+async def test_run_timeout(fake_podman: FakePodman, fake_runtime: pathlib.Path):
+    fake_podman.add_image("alpine")
+    policy = TerminationPolicy(grace_period=0.5, kill_grace_period=5)
+    service = OCIContainersService(
+        OCIRuntime(runtime=fake_runtime, executable=fake_podman.executable),
+        termination=policy,
+    )
+    ignore_sigterm = (
+        "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+        "time.sleep(30)"
+    )
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", ignore_sigterm), timeout=1
+    )
+    try:
+        async with service.run(container) as proc:
+            assert await asyncio.wait_for(proc.wait(), 10) != 0
+    finally:
+        await service.close()
+    assert policy.stats.stages["kill"] == 1
+    assert service.bundle_dir is None
+
+
+@pytest.mark.asyncio
+async def test_run_invalid_config(
+    tmp_path: pathlib.Path, service: OCIContainersService
+):
+    container = Container(
+        image="alpine",
+        command=("true",),
+        mounts=[BindMount(source=tmp_path / "missing", target="/data", readonly=True)],
+    )
+    try:
+        async with service.run(container, stderr=asyncio.subprocess.PIPE) as proc:
+            _, stderr = await proc.communicate()
+    finally:
+        await service.close()
+    assert proc.returncode == 1
+    assert b"bind mount source does not exist" in stderr
+
+
+@pytest.mark.asyncio
+async def test_run_template_bundle(
+    tmp_path: pathlib.Path, fake_podman: FakePodman, service: OCIContainersService
+):
+    async def run(container: Container) -> bytes:
+        async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+            stdout, _ = await proc.communicate()
+            assert proc.returncode == 0
+            return stdout
+
+    template = Container(image="alpine", command=(), work_dir=tmp_path)
+    print_env = "import os; print(os.environ['INDEX'])"
+    try:
+        outputs = await asyncio.gather(
+            *(
+                run(
+                    dataclasses.replace(
+                        template,
+                        command=(sys.executable, "-c", print_env),
+                        environ=dict(INDEX=str(index)),
+                    )
+                )
+                for index in range(3)
+            )
+        )
+        assert outputs == [f"{index}\n".encode() for index in range(3)]
+        # One bundle for the template, the ones of the launches are removed
+        assert len(list((tmp_path / "bundles").iterdir())) == 1
+        bundles = {
+            call["args"][call["args"].index("--bundle") + 1]
+            for call in runtime_calls(fake_podman)
+        }
+        assert len(bundles) == 3
+    finally:
+        await service.close()
+
+
+@pytest.mark.asyncio
+async def test_bundle_eviction(
+    tmp_path: pathlib.Path, fake_podman: FakePodman, fake_runtime: pathlib.Path
+):
+    fake_podman.add_image("alpine")
+    service = OCIContainersService(
+        OCIRuntime(runtime=fake_runtime, executable=fake_podman.executable),
+        bundle_dir=tmp_path / "bundles",
+        max_bundles=2,
+    )
+    try:
+        for index in range(4):
+            container = Container(
+                image="alpine", command=("true",), work_dir=f"/work{index}"
+            )
+            async with service.run(container) as proc:
+                assert await proc.wait() == 0
+        bundles = list((tmp_path / "bundles").iterdir())
+        assert len(bundles) == 2
+        configs = [json.loads((path / "config.json").read_text()) for path in bundles]
+        assert sorted(config["process"]["cwd"] for config in configs) == [
+            "/work2",
+            "/work3",
+        ]
+    finally:
+        await service.close()
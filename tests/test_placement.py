@@ -0,0 +1,136 @@
+import asyncio
+import pathlib
+import sys
+
+import pytest
+
+from .conftest import FakePodman
+from containers import Container
+from containers import ContainersService
+from containers import CPUTopology
+from containers import NUMALocalStrategy
+from containers import NUMANode
+from containers import PackStrategy
+from containers import PlacementManager
+from containers import Podman
+from containers import ResourceLimits
+from containers import SpreadStrategy
+from containers.services.placement import format_cpu_list
+from containers.services.placement import parse_cpu_list
+
+
+@pytest.fixture
+def topology() -> CPUTopology:
+    return CPUTopology(
+        nodes=(NUMANode(id=0, cpus=(0, 1, 2, 3)), NUMANode(id=1, cpus=(4, 5, 6, 7)))
+    )
+
+
+def make_sysfs(root: pathlib.Path, nodes: dict) -> pathlib.Path:
+    system = root / "devices" / "system"
+    (system / "cpu").mkdir(parents=True)
+    (system / "cpu" / "online").write_text("0-7\n")
+    for node_id, cpulist in nodes.items():
+        node_dir = system / "node" / f"node{node_id}"
+        node_dir.mkdir(parents=True)
+        (node_dir / "cpulist").write_text(cpulist + "\n")
+    return root
+
+
+@pytest.mark.parametrize(
+    "value, cpus",
+    [
+        ("0-3,8", [0, 1, 2, 3, 8]),
+        ("5", [5]),
+        ("0,2-3,10-11", [0, 2, 3, 10, 11]),
+        ("", []),
+    ],
+)
+def test_cpu_list(value: str, cpus: list):
+    assert parse_cpu_list(value) == cpus
+    assert format_cpu_list(cpus) == value
+
+
+def test_from_sysfs(tmp_path: pathlib.Path):
+    root = make_sysfs(tmp_path / "numa", {0: "0-3", 1: "4-7", 2: ""})
+    assert CPUTopology.from_sysfs(root) == CPUTopology(
+        nodes=(NUMANode(id=0, cpus=(0, 1, 2, 3)), NUMANode(id=1, cpus=(4, 5, 6, 7)))
+    )
+    # Without NUMA support, all the online CPUs belong to node 0
+    root = make_sysfs(tmp_path / "flat", {})
+    assert CPUTopology.from_sysfs(root) == CPUTopology(
+        nodes=(NUMANode(id=0, cpus=tuple(range(8))),)
+    )
+
+
+def test_pack(topology: CPUTopology):
+    manager = PlacementManager(topology, strategy=PackStrategy())
+    first = manager.try_acquire(2)
+    assert first.cpuset_cpus == "0-1"
+    assert first.cpuset_mems == "0"
+    # Fill up node 0 first
+    assert manager.try_acquire(1).cpus == (2,)
+    assert manager.try_acquire(2).cpus == (4, 5)
+    # Split across nodes when no single node fits
+    split = manager.try_acquire(3)
+    assert split.cpus == (3, 6, 7)
+    assert split.cpuset_mems == "0-1"
+    assert manager.try_acquire(1) is None
+
+
+def test_spread(topology: CPUTopology):
+    manager = PlacementManager(topology, strategy=SpreadStrategy())
+    assert manager.try_acquire(1).nodes == (0,)
+    assert manager.try_acquire(1).nodes == (1,)
+    assert manager.try_acquire(1).nodes == (0,)
+    assert manager.usage() == {0: 2, 1: 1}
+
+
+def test_numa_local(topology: CPUTopology):
+    manager = PlacementManager(topology, strategy=NUMALocalStrategy())
+    assert manager.try_acquire(3).cpus == (0, 1, 2)
+    assert manager.try_acquire(3).cpus == (4, 5, 6)
+    # Two CPUs are free but on different nodes
+    assert manager.try_acquire(2) is None
+    with pytest.raises(ValueError):
+        manager.try_acquire(9)
+    # Doesn't fit in any single node even when all CPUs are free
+    with pytest.raises(ValueError):
+        PlacementManager(topology, strategy=NUMALocalStrategy()).try_acquire(5)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_release(topology: CPUTopology):
+    manager = PlacementManager(topology)
+    container = Container(
+        image="alpine", command=("true",), resources=ResourceLimits(cpus=3.5)
+    )
+    async with manager.place(container) as placed:
+        assert placed.resources.cpuset_cpus == "0-3"
+        assert placed.resources.cpuset_mems == "0"
+        assert placed.resources.cpus == 3.5
+        async with manager.place(container) as other:
+            assert other.resources.cpuset_cpus == "4-7"
+            waiting = asyncio.ensure_future(manager.place(container).__aenter__())
+            await asyncio.sleep(0.01)
+            assert not waiting.done()
+        third = await asyncio.wait_for(waiting, 1)
+        assert third.resources.cpuset_cpus == "4-7"
+    # The original container is not modified
+    assert container.resources.cpuset_cpus is None
+
+
+@pytest.mark.asyncio
+async def test_service_placement(fake_podman: FakePodman, topology: CPUTopology):
+    manager = PlacementManager(topology, strategy=SpreadStrategy())
+    service = ContainersService(
+        Podman(executable=fake_podman.executable), placement=manager
+    )
+    container = Container(image="alpine", command=(sys.executable, "-c", "pass"))
+    async with service.run(container) as proc:
+        assert manager.usage() == {0: 1, 1: 0}
+        await proc.wait()
+    assert manager.usage() == {0: 0, 1: 0}
+    (call,) = fake_podman.calls()
+    assert call[call.index("--cpuset-cpus") + 1] == "0"
+    assert call[call.index("--cpuset-mems") + 1] == "0"
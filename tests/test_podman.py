@@ -1,11 +1,15 @@
+import dataclasses
 import typing
 
 import pytest
 
+from containers import ArchiveImageMount
 from containers import BindMount
 from containers import Container
 from containers import ImageMount
 from containers import Podman
+from containers import ResourceLimits
+from containers import SecurityOptions
 
 
 def parse_mount_options(options: str) -> typing.Dict[str, str]:
@@ -153,6 +157,52 @@ def test_bind_mount_args(
             ),
             ("podman", "run", "--timeout", "100", "my-image", "git", "status"),
         ),
+        (
+            Container(
+                image="my-image",
+                command=("git", "status"),
+                resources=ResourceLimits(
+                    cpus=1.5,
+                    cpuset_cpus="0-3,8",
+                    memory="512m",
+                    memory_swap="1g",
+                    pids_limit=100,
+                    ulimits=dict(nofile=(1024, 2048), core=0),
+                    blkio_weight=500,
+                ),
+            ),
+            (
+                "podman",
+                "run",
+                "--cpus",
+                "1.5",
+                "--cpuset-cpus",
+                "0-3,8",
+                "--memory",
+                "512m",
+                "--memory-swap",
+                "1g",
+                "--pids-limit",
+                "100",
+                "--ulimit",
+                "nofile=1024:2048",
+                "--ulimit",
+                "core=0",
+                "--blkio-weight",
+                "500",
+                "my-image",
+                "git",
+                "status",
+            ),
+        ),
+        (
+            Container(
+                image="my-image",
+                command=("git", "status"),
+                name="my-container",
+            ),
+            ("podman", "run", "--name", "my-container", "my-image", "git", "status"),
+        ),
         (
             Container(
                 image="my-image",
@@ -201,3 +251,201 @@ def test_build_command(
     expected_args: typing.Tuple[str, ...],
 ):
     assert podman.build_command(container) == expected_args
+
+
+@pytest.fixture
+def template_container() -> Container:
+    return Container(
+        image="my-image",
+        command=("git", "status"),
+        interactive=True,
+        tty=True,
+        remove=True,
+        timeout=100,
+        environ=dict(ENV_VAR0="VAL0", ENV_VAR1="VAL1"),
+        user="2000",
+        group="3000",
+        work_dir="/my-dir",
+        network="none",
+        shm_size="256m",
+        security_options=SecurityOptions(no_new_privileges=True, seccomp="git.json"),
+        mounts=[
+            ImageMount(target=f"/data{i}", source="git-repo-data:write")
+            for i in range(100)
+        ],
+    )
+
+
+def test_compile(podman: Podman, template_container: Container):
+    compiled = podman.compile(template_container, log_level="debug")
+    assert compiled.build_command() == podman.build_command(
+        template_container, log_level="debug"
+    )
+
+
+@pytest.mark.parametrize(
+    "command, environ",
+    [
+        (None, None),
+        (("git", "log"), None),
+        (None, dict(ENV_VAR1="NEW_VAL1", ENV_VAR2="VAL2")),
+        ((), dict(ENV_VAR2="VAL2")),
+    ],
+)
+def test_compile_overrides(
+    podman: Podman,
+    template_container: Container,
+    command: typing.Optional[typing.Tuple[str, ...]],
+    environ: typing.Optional[typing.Dict[str, str]],
+):
+    compiled = podman.compile(template_container)
+    expected_container = dataclasses.replace(
+        template_container,
+        command=template_container.command if command is None else command,
+        environ={**template_container.environ, **(environ or {})},
+    )
+    assert compiled.build_command(
+        command=command, environ=environ
+    ) == podman.build_command(expected_container)
+
+
+def test_build_kill_command(podman: Podman):
+    assert podman.build_kill_command("c0", "c1") == ("podman", "kill", "c0", "c1")
+    assert podman.build_kill_command("c0", signal="SIGTERM", log_level="debug") == (
+        "podman",
+        "--log-level",
+        "debug",
+        "kill",
+        "--signal",
+        "SIGTERM",
+        "c0",
+    )
+
+
+def test_build_detached_command(podman: Podman):
+    container = Container(image="alpine", command=("sleep", "10"), remove=True)
+    assert podman.build_detached_command(container) == (
+        "podman",
+        "run",
+        "--detach",
+        "--rm",
+        "alpine",
+        "sleep",
+        "10",
+    )
+
+
+def test_build_exec_command(podman: Podman):
+    assert podman.build_exec_command("c0", ("ls", "-l")) == (
+        "podman",
+        "exec",
+        "c0",
+        "ls",
+        "-l",
+    )
+    assert podman.build_exec_command(
+        "c0",
+        ("cat",),
+        interactive=True,
+        environ=dict(A="B"),
+        work_dir="/data",
+        user="nobody",
+    ) == (
+        "podman",
+        "exec",
+        "--interactive",
+        "--env",
+        "A=B",
+        "--workdir",
+        "/data",
+        "--user",
+        "nobody",
+        "c0",
+        "cat",
+    )
+
+
+def test_build_events_command(podman: Podman):
+    assert podman.build_events_command() == ("podman", "events", "--format", "json")
+    assert podman.build_events_command(
+        filters=("type=container", "event=died"), since="1700000000"
+    ) == (
+        "podman",
+        "events",
+        "--format",
+        "json",
+        "--filter",
+        "type=container",
+        "--filter",
+        "event=died",
+        "--since",
+        "1700000000",
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(cpus=0),
+        dict(cpus="many"),
+        dict(cpus=float("nan")),
+        dict(cpus=[1]),
+        dict(cpuset_cpus="0-"),
+        dict(cpuset_cpus="3-1"),
+        dict(memory="lots"),
+        dict(memory=0),
+        dict(memory_swap="1g"),
+        dict(memory="1g", memory_swap="512m"),
+        dict(pids_limit=0),
+        dict(pids_limit=-2),
+        dict(ulimits=dict(files=1024)),
+        dict(ulimits=dict(nofile=(2048, 1024))),
+        dict(blkio_weight=5),
+    ],
+)
+def test_invalid_resource_limits(kwargs: dict):
+    with pytest.raises(ValueError):
+        ResourceLimits(**kwargs)
+
+
+def test_valid_resource_limits():
+    ResourceLimits(memory="1g", memory_swap=-1, pids_limit=-1)
+    assert ResourceLimits(memory="1g", memory_swap="-1").memory_swap == -1
+    assert ResourceLimits(cpus="1.5").cpus == 1.5
+    ResourceLimits(ulimits=dict(nofile=(1024, -1), core=-1))
+
+
+def test_archive_image_mount_args(podman: Podman):
+    mount = ArchiveImageMount(
+        source="data-image",
+        target="/data",
+        read_write=True,
+        archive_to="/var/tmp/archive.tar.gz",
+        archive_success="/var/tmp/archive.success",
+        archive_method="tar.gz",
+        chown="1000:1000",
+        mode=0o755,
+    )
+    prefix = "com.launchplatform.oci-hooks."
+    assert podman.make_mount(mount, name="mount-0") == (
+        "--mount",
+        "type=image,source=data-image,target=/data,rw=true",
+        "--annotation",
+        f"{prefix}archive-overlay.mount-0.mount-point=/data",
+        "--annotation",
+        f"{prefix}archive-overlay.mount-0.archive-to=/var/tmp/archive.tar.gz",
+        "--annotation",
+        f"{prefix}archive-overlay.mount-0.success=/var/tmp/archive.success",
+        "--annotation",
+        f"{prefix}archive-overlay.mount-0.method=tar.gz",
+        "--annotation",
+        f"{prefix}mount-chown.mount-0.path=/data",
+        "--annotation",
+        f"{prefix}mount-chown.mount-0.owner=1000:1000",
+        "--annotation",
+        f"{prefix}mount-chown.mount-0.mode=755",
+    )
+    # Without hooks, it's a plain image mount
+    assert podman.make_mount(
+        ArchiveImageMount(source="data-image", target="/data")
+    ) == ("--mount", "type=image,source=data-image,target=/data,rw=false")
@@ -0,0 +1,361 @@
+import asyncio
+import io
+import json
+import pathlib
+import struct
+import typing
+import urllib.parse
+
+import pytest
+import pytest_asyncio
+
+from containers import APIContainersService
+from containers import ArchiveImageMount
+from containers import BindMount
+from containers import CallbackInstrument
+from containers import Container
+from containers import ImageMount
+from containers import LoadImageError
+from containers import PodmanAPI
+from containers import PodmanAPIClient
+from containers import ResourceLimits
+from containers import SecurityOptions
+from containers import TerminationPolicy
+from containers import VolumeMount
+
+
+class FakePodmanAPIServer:
+    """A stand-in of the libpod REST API server listening on a Unix socket"""
+
+    def __init__(self, socket_path: pathlib.Path):
+        self.socket_path = socket_path
+        self.images: typing.Dict[str, str] = {"alpine": "sha256:" + "0" * 64}
+        self.containers: typing.Dict[str, typing.Dict] = {}
+        self.requests: typing.List[typing.Tuple[str, str]] = []
+        self.kills: typing.List[str] = []
+        self.connections = 0
+        self._started: typing.Dict[str, asyncio.Event] = {}
+        self._exited: typing.Dict[str, asyncio.Future] = {}
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=str(self.socket_path)
+        )
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def _response(status: int, body: typing.Any = None, chunked: bool = False) -> bytes:
+        payload = b"" if body is None else json.dumps(body).encode()
+        if chunked:
+            head = f"HTTP/1.1 {status} OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            chunks = b"".join(
+                b"%x\r\n%s\r\n" % (len(payload[i : i + 7]), payload[i : i + 7])
+                for i in range(0, len(payload), 7)
+            )
+            return head.encode() + chunks + b"0\r\n\r\n"
+        head = f"HTTP/1.1 {status} OK\r\nContent-Length: {len(payload)}\r\n\r\n"
+        return head.encode() + payload
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, url, _ = request_line.decode().split(" ")
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                parsed = urllib.parse.urlparse(url)
+                path = parsed.path.split("/libpod", 1)[1]
+                params = dict(urllib.parse.parse_qsl(parsed.query))
+                self.requests.append((method, path))
+                if path.endswith("/attach"):
+                    await self._attach(path.split("/")[2], writer)
+                    return
+                writer.write(await self._route(method, path, params, body))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(
+        self, method: str, path: str, params: typing.Dict[str, str], body: bytes
+    ) -> bytes:
+        parts = path.split("/")
+        if parts[1] == "images" and parts[-1] == "json":
+            image = urllib.parse.unquote(parts[2])
+            if image not in self.images:
+                return self._response(404, dict(message="image not known"))
+            return self._response(200, dict(Id=image, Digest=self.images[image]))
+        elif path == "/images/pull":
+            image = params["reference"]
+            if image.startswith("bad"):
+                return self._response(
+                    200, dict(error=f"failed to pull {image}"), chunked=True
+                )
+            self.images[image] = "sha256:" + "1" * 64
+            return self._response(200, dict(id=image, images=[image]), chunked=True)
+        elif path == "/containers/create":
+            container_id = f"container-{len(self.containers)}"
+            self.containers[container_id] = json.loads(body)
+            self._started[container_id] = asyncio.Event()
+            self._exited[container_id] = asyncio.get_running_loop().create_future()
+            return self._response(201, dict(Id=container_id, Warnings=[]))
+        elif parts[-1] == "start":
+            self._started[parts[2]].set()
+            return self._response(204)
+        elif parts[-1] == "wait":
+            return self._response(200, await asyncio.shield(self._exited[parts[2]]))
+        elif parts[-1] == "kill":
+            exited = self._exited[parts[2]]
+            if exited.done():
+                return self._response(409, dict(message="not running"))
+            signal = params["signal"]
+            self.kills.append(signal)
+            env = self.containers[parts[2]]["env"]
+            if signal != "SIGTERM" or "IGNORE_SIGTERM" not in env:
+                exited.set_result(128 + dict(SIGTERM=15, SIGKILL=9)[signal])
+            return self._response(204)
+        elif method == "DELETE":
+            self.containers.pop(parts[2], None)
+            return self._response(200, [])
+        return self._response(404, dict(message="not found"))
+
+    async def _attach(self, container_id: str, writer: asyncio.StreamWriter):
+        spec = self.containers[container_id]
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/vnd.docker.multiplexed-stream\r\n\r\n"
+        )
+        await self._started[container_id].wait()
+        for stream, text in ((1, "hello\n"), (2, "oops\n"), (1, "world\n")):
+            data = text.encode()
+            writer.write(struct.pack(">BxxxL", stream, len(data)) + data)
+        await writer.drain()
+        if "HANG" not in spec["env"]:
+            self._exited[container_id].set_result(int(spec["env"].get("EXIT_CODE", 0)))
+
+
+@pytest_asyncio.fixture
+async def api_server(tmp_path: pathlib.Path) -> FakePodmanAPIServer:
+    server = FakePodmanAPIServer(tmp_path / "podman.sock")
+    await server.start()
+    yield server
+    await server.stop()
+
+
+@pytest_asyncio.fixture
+async def api_service(api_server: FakePodmanAPIServer) -> APIContainersService:
+    service = APIContainersService(
+        PodmanAPI(PodmanAPIClient(socket_path=api_server.socket_path))
+    )
+    yield service
+    await service.provider.client.close()
+
+
+def test_make_spec():
+    container = Container(
+        image="my-image",
+        command=("git", "status"),
+        interactive=True,
+        remove=True,
+        timeout=100,
+        environ=dict(ENV_VAR0="VAL0"),
+        user="2000",
+        group="3000",
+        work_dir="/my-dir",
+        network="none",
+        shm_size="256m",
+        security_options=SecurityOptions(no_new_privileges=True, seccomp="git.json"),
+        mounts=[
+            ImageMount(target="/data", source="data-image", read_write=True),
+            BindMount(
+                target="/artifacts",
+                source="/var/tmp/artifacts",
+                readonly=True,
+                chown=True,
+                relabel="private",
+                bind_propagation="rslave",
+            ),
+            VolumeMount(target="/cache", readonly=False),
+        ],
+    )
+    assert PodmanAPI(PodmanAPIClient(socket_path="/dev/null")).make_spec(container) == {
+        "image": "my-image",
+        "command": ["git", "status"],
+        "env": {"ENV_VAR0": "VAL0"},
+        "stdin": True,
+        "terminal": False,
+        "remove": True,
+        "timeout": 100,
+        "user": "2000:3000",
+        "work_dir": "/my-dir",
+        "netns": {"nsmode": "none"},
+        "shm_size": 256 * 1024 * 1024,
+        "no_new_privileges": True,
+        "seccomp_profile_path": "git.json",
+        "image_volumes": [
+            {"Source": "data-image", "Destination": "/data", "ReadWrite": True}
+        ],
+        "mounts": [
+            {
+                "type": "bind",
+                "source": "/var/tmp/artifacts",
+                "destination": "/artifacts",
+                "options": ["ro", "U", "Z", "rslave"],
+            }
+        ],
+        "volumes": [{"Name": "", "Dest": "/cache", "Options": []}],
+    }
+
+
+def test_make_resource_spec():
+    api = PodmanAPI(PodmanAPIClient(socket_path="/dev/null"))
+    resources = ResourceLimits(
+        cpus=1.5,
+        cpuset_cpus="0-3",
+        memory="512m",
+        memory_swap=-1,
+        pids_limit=100,
+        ulimits=dict(nofile=(1024, -1)),
+        blkio_weight=500,
+    )
+    assert api.make_resource_spec(resources) == {
+        "resource_limits": {
+            "cpu": {"quota": 150000, "period": 100000, "cpus": "0-3"},
+            "memory": {"limit": 512 * 1024 * 1024, "swap": -1},
+            "pids": {"limit": 100},
+            "blockIO": {"weight": 500},
+        },
+        "r_limits": [{"type": "RLIMIT_NOFILE", "soft": 1024, "hard": 2**64 - 1}],
+    }
+    assert api.make_resource_spec(ResourceLimits()) == {}
+
+
+@pytest.mark.asyncio
+async def test_load_image(
+    api_server: FakePodmanAPIServer, api_service: APIContainersService
+):
+    assert not await api_service.load_image("alpine")
+    assert api_service.image_cache.get("alpine").digest == "sha256:" + "0" * 64
+    assert await api_service.load_image("python:3.11")
+    assert "python:3.11" in api_server.images
+    with pytest.raises(LoadImageError) as exc_info:
+        await api_service.load_image("bad:tag")
+    assert exc_info.value.stderr == "failed to pull bad:tag"
+    # All requests go through the same keep-alive connection
+    assert api_server.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_run(api_server: FakePodmanAPIServer, api_service: APIContainersService):
+    container = Container(
+        image="alpine", command=("echo", "hello"), environ=dict(EXIT_CODE="3")
+    )
+    for _ in range(3):
+        async with api_service.run(
+            container,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        ) as proc:
+            assert await proc.stdout.read() == b"hello\nworld\n"
+            assert await proc.stderr.read() == b"oops\n"
+            assert await proc.wait() == 3
+            assert proc.returncode == 3
+    assert [method_path for method_path in api_server.requests[:4]] == [
+        ("POST", "/containers/create"),
+        ("POST", "/containers/container-0/attach"),
+        ("POST", "/containers/container-0/start"),
+        ("POST", "/containers/container-0/wait"),
+    ]
+    # One pooled connection plus one dedicated attach connection for each run
+    assert api_server.connections == 1 + 3
+
+
+@pytest.mark.asyncio
+async def test_run_inherit_replaced_stdout(
+    api_server: FakePodmanAPIServer,
+    api_service: APIContainersService,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # Replaced by streams without a binary buffer, like in a notebook
+    stdout, stderr = io.StringIO(), io.StringIO()
+    monkeypatch.setattr("sys.stdout", stdout)
+    monkeypatch.setattr("sys.stderr", stderr)
+    container = Container(image="alpine", command=("echo", "hello"))
+    async with api_service.run(container) as proc:
+        assert await proc.wait() == 0
+    assert stdout.getvalue() == "hello\nworld\n"
+    assert stderr.getvalue() == "oops\n"
+
+
+def test_make_spec_archive_annotations():
+    container = Container(
+        image="my-image",
+        command=("git", "status"),
+        mounts=[
+            VolumeMount(target="/cache", readonly=False),
+            ArchiveImageMount(
+                target="/data", source="data-image", archive_to="/var/tmp/data.tar"
+            ),
+        ],
+    )
+    spec = PodmanAPI(PodmanAPIClient(socket_path="/dev/null")).make_spec(container)
+    prefix = "com.launchplatform.oci-hooks.archive-overlay.mount-1"
+    assert spec["annotations"] == {
+        f"{prefix}.mount-point": "/data",
+        f"{prefix}.archive-to": "/var/tmp/data.tar",
+    }
+
+
+@pytest.mark.asyncio
+async def test_run_instruments(api_server: FakePodmanAPIServer):
+    events = []
+    service = APIContainersService(
+        PodmanAPI(PodmanAPIClient(socket_path=api_server.socket_path)),
+        instruments=[CallbackInstrument(events.append)],
+    )
+    container = Container(
+        image="alpine", command=("echo", "hello"), environ=dict(EXIT_CODE="3")
+    )
+    try:
+        async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+            await proc.stdout.read()
+            assert await proc.wait() == 3
+    finally:
+        await service.provider.client.close()
+    assert [event.phase for event in events] == ["build_command", "spawn", "run"]
+    assert events[-1].exit_code == 3
+    assert all(event.image == "alpine" for event in events)
+
+
+@pytest.mark.asyncio
+async def test_run_termination(api_server: FakePodmanAPIServer):
+    policy = TerminationPolicy(grace_period=0.1, kill_grace_period=5, timeout=0.1)
+    service = APIContainersService(
+        PodmanAPI(PodmanAPIClient(socket_path=api_server.socket_path)),
+        termination=policy,
+    )
+    container = Container(
+        image="alpine",
+        command=("sleep", "30"),
+        environ=dict(HANG="1", IGNORE_SIGTERM="1"),
+    )
+    try:
+        async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+            assert await asyncio.wait_for(proc.wait(), 5) == 128 + 9
+    finally:
+        await service.provider.client.close()
+    assert policy.stats.timeouts == 1
+    # Escalated from SIGTERM to SIGKILL through the API
+    assert api_server.kills == ["SIGTERM", "SIGKILL"]
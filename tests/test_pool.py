@@ -0,0 +1,217 @@
+import asyncio
+
+import pytest
+
+from .conftest import FakePodman
+from containers import APIContainersService
+from containers import CallbackInstrument
+from containers import Container
+from containers import ContainerPool
+from containers import ContainersService
+from containers import CPUTopology
+from containers import NUMANode
+from containers import OCIContainersService
+from containers import PackStrategy
+from containers import PlacementManager
+from containers import Podman
+from containers import TerminationPolicy
+
+
+@pytest.fixture
+def container() -> Container:
+    return Container(image="alpine", command=("echo", "hello"), remove=True)
+
+
+async def wait_for_idle(pool: ContainerPool, count: int):
+    while pool.idle_count < count:
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_pool(
+    fake_podman: FakePodman,
+    fake_containers: ContainersService,
+    container: Container,
+):
+    async with ContainerPool(fake_containers, container, max_size=2) as pool:
+        await asyncio.wait_for(wait_for_idle(pool, 2), 5)
+        assert len(fake_podman.containers) == 2
+        for args in fake_podman.containers.values():
+            assert args == ["--rm", "alpine", "echo", "hello"]
+
+        container_ids = set()
+        for _ in range(3):
+            async with pool.run(stdout=asyncio.subprocess.PIPE) as proc:
+                output = (await proc.stdout.read()).decode()
+                assert await proc.wait() == 0
+                assert output.startswith("started ")
+                container_ids.add(output.split()[1])
+            await asyncio.wait_for(wait_for_idle(pool, 2), 5)
+        assert len(container_ids) == 3
+        assert pool.stats.hits == 3
+        assert pool.stats.misses == 0
+        assert pool.stats.created == 5
+
+    assert pool.stats.evicted == 2
+    assert fake_podman.calls()[-1][:2] == ["rm", "--force"]
+    assert len(fake_podman.calls()[-1]) == 4
+
+
+@pytest.mark.asyncio
+async def test_pool_miss(
+    fake_podman: FakePodman,
+    fake_containers: ContainersService,
+    container: Container,
+):
+    pool = ContainerPool(fake_containers, container, max_size=1)
+    async with pool.run(stdout=asyncio.subprocess.PIPE) as proc:
+        assert await proc.stdout.read() == b"hello\n"
+        assert await proc.wait() == 0
+    assert pool.stats.misses == 1
+    assert pool.stats.hits == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_idle_timeout(
+    fake_podman: FakePodman,
+    fake_containers: ContainersService,
+    container: Container,
+):
+    now = 0.0
+    pool = ContainerPool(
+        fake_containers,
+        container,
+        max_size=2,
+        idle_timeout=10,
+        clock=lambda: now,
+    )
+    await pool.fill()
+    assert pool.idle_count == 2
+    now = 10
+    await pool.evict_expired()
+    assert pool.idle_count == 0
+    assert pool.stats.evicted == 2
+    assert fake_podman.containers == {}
+
+    await pool.fill()
+    now = 20
+    async with pool.run(stdout=asyncio.subprocess.PIPE) as proc:
+        assert await proc.stdout.read() == b"hello\n"
+    assert pool.stats.misses == 1
+    assert pool.stats.evicted == 4
+    await pool.close()
+    assert fake_podman.containers == {}
+
+
+@pytest.mark.asyncio
+async def test_pool_removes_started_containers(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    container = Container(image="alpine", command=("echo", "hello"))
+    pool = ContainerPool(fake_containers, container, max_size=1)
+    await pool.fill()
+    (container_id,) = fake_podman.containers
+    async with pool.run(stdout=asyncio.subprocess.PIPE) as proc:
+        assert await proc.stdout.read() == f"started {container_id}\nhello\n".encode()
+        assert await proc.wait() == 0
+    assert pool.stats.hits == 1
+    # Removed even though the template doesn't set remove
+    assert fake_podman.calls()[-1] == ["rm", "--force", container_id]
+    assert fake_podman.containers == {}
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_cancelled(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    container = Container(image="alpine", command=("sleep", "30"))
+    pool = ContainerPool(fake_containers, container, max_size=1)
+    await pool.fill()
+    (container_id,) = fake_podman.containers
+    started = asyncio.Event()
+    procs = []
+
+    async def run():
+        async with pool.run(stdout=asyncio.subprocess.PIPE) as proc:
+            procs.append(proc)
+            await proc.stdout.readline()
+            started.set()
+            await proc.wait()
+
+    task = asyncio.ensure_future(run())
+    await asyncio.wait_for(started.wait(), 5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert fake_podman.calls()[-1] == ["rm", "--force", container_id]
+    assert fake_podman.containers == {}
+    # The container process is killed with it
+    assert await asyncio.wait_for(procs[0].wait(), 5) != 0
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_named_template(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    container = Container(image="alpine", command=("echo", "hello"), name="job")
+    pool = ContainerPool(fake_containers, container, max_size=3)
+    await pool.fill()
+    assert pool.stats.created == 3
+    names = {args[args.index("--name") + 1] for args in fake_podman.containers.values()}
+    assert len(names) == 3
+    assert all(name.startswith("job-") for name in names)
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_service_hooks(fake_podman: FakePodman):
+    events = []
+    policy = TerminationPolicy(grace_period=5, timeout=0.2)
+    service = ContainersService(
+        Podman(executable=fake_podman.executable),
+        instruments=[CallbackInstrument(events.append)],
+        termination=policy,
+    )
+    container = Container(image="alpine", command=("sleep", "30"))
+    pool = ContainerPool(service, container, max_size=1)
+    await pool.fill()
+    async with pool.run(stdout=asyncio.subprocess.DEVNULL) as proc:
+        assert await asyncio.wait_for(proc.wait(), 5) != 0
+    assert pool.stats.hits == 1
+    assert policy.stats.timeouts == 1
+    assert [event.phase for event in events] == ["spawn", "run"]
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_placement(fake_podman: FakePodman):
+    topology = CPUTopology(nodes=(NUMANode(id=0, cpus=(0, 1)),))
+    service = ContainersService(
+        Podman(executable=fake_podman.executable),
+        placement=PlacementManager(topology, strategy=PackStrategy()),
+    )
+    container = Container(image="alpine", command=("echo", "hello"))
+    pool = ContainerPool(service, container, max_size=1)
+    await pool.fill()
+    (container_id,) = fake_podman.containers
+    async with pool.run(stdout=asyncio.subprocess.DEVNULL) as proc:
+        await proc.wait()
+    # The placement is applied to the warm container before starting it
+    assert [
+        "update",
+        "--cpuset-cpus",
+        "0",
+        "--cpuset-mems",
+        "0",
+        container_id,
+    ] in fake_podman.calls()
+    await pool.close()
+
+
+@pytest.mark.parametrize("service_class", [APIContainersService, OCIContainersService])
+def test_pool_unsupported_service(service_class: type, container: Container):
+    service = service_class()
+    with pytest.raises(TypeError, match="not supported by ContainerPool"):
+        ContainerPool(service, container)
@@ -0,0 +1,176 @@
+import asyncio
+import pathlib
+import sys
+import typing
+
+import pytest
+
+from .conftest import FakePodman
+from containers import AdmissionPolicy
+from containers import Container
+from containers import ContainersService
+from containers import LaunchScheduler
+from containers import Podman
+from containers import ResourceAdmission
+
+
+class SwitchAdmission(AdmissionPolicy):
+    def __init__(self):
+        self.allowed = True
+
+    def admit(self) -> bool:
+        return self.allowed
+
+
+async def hold(
+    scheduler: LaunchScheduler,
+    image: str,
+    started: typing.List[str],
+    release: asyncio.Event,
+    priority: int = 0,
+    name: typing.Optional[str] = None,
+):
+    async with scheduler.slot(image, priority=priority):
+        started.append(name or image)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_max_concurrency_and_priority():
+    scheduler = LaunchScheduler(max_concurrency=1)
+    started = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(hold(scheduler, "a", started, release, name="first"))
+    ]
+    await settle()
+    for name, priority in (("low", 0), ("high", 10), ("low2", 0)):
+        tasks.append(
+            asyncio.ensure_future(
+                hold(scheduler, "a", started, release, priority=priority, name=name)
+            )
+        )
+    await settle()
+    assert started == ["first"]
+    assert scheduler.stats.queue_depth == 3
+    assert scheduler.stats.max_queue_depth == 3
+    release.set()
+    await asyncio.gather(*tasks)
+    assert started == ["first", "high", "low", "low2"]
+    assert scheduler.stats.running == 0
+    assert scheduler.stats.queue_depth == 0
+    assert scheduler.stats.admitted == 4
+    assert scheduler.stats.wait_time.count == 4
+
+
+@pytest.mark.asyncio
+async def test_per_image_limit():
+    scheduler = LaunchScheduler(per_image_limit=1)
+    started = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(hold(scheduler, image, started, release))
+        for image in ("a", "a", "b")
+    ]
+    await settle()
+    # The second "a" waits, but it doesn't block "b"
+    assert started == ["a", "b"]
+    release.set()
+    await asyncio.gather(*tasks)
+    assert started == ["a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_waiting():
+    scheduler = LaunchScheduler(max_concurrency=1)
+    started = []
+    release = asyncio.Event()
+    first = asyncio.ensure_future(hold(scheduler, "a", started, release))
+    second = asyncio.ensure_future(hold(scheduler, "a", started, release, name="b"))
+    await settle()
+    second.cancel()
+    await settle()
+    assert scheduler.stats.queue_depth == 0
+    release.set()
+    await first
+    assert started == ["a"]
+    assert scheduler.stats.running == 0
+
+
+@pytest.mark.asyncio
+async def test_admission():
+    admission = SwitchAdmission()
+    admission.allowed = False
+    scheduler = LaunchScheduler(admission=admission, admission_retry_interval=0.01)
+    started = []
+    release = asyncio.Event()
+    release.set()
+    task = asyncio.ensure_future(hold(scheduler, "a", started, release))
+    await asyncio.sleep(0.05)
+    assert started == []
+    assert scheduler.stats.deferred >= 2
+    admission.allowed = True
+    await asyncio.wait_for(task, 1)
+    assert started == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_admission_deferred_once():
+    admission = SwitchAdmission()
+    admission.allowed = False
+    scheduler = LaunchScheduler(admission=admission, admission_retry_interval=0.05)
+    started = []
+    release = asyncio.Event()
+    release.set()
+    task = asyncio.ensure_future(hold(scheduler, "a", started, release))
+    await settle()
+    assert started == []
+    assert scheduler.stats.deferred == 1
+    assert scheduler.stats.queue_depth == 1
+    admission.allowed = True
+    await asyncio.wait_for(task, 1)
+    assert started == ["a"]
+    assert scheduler.stats.deferred == 1
+
+
+def test_resource_admission(tmp_path: pathlib.Path):
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text(
+        "MemTotal:       16000000 kB\n"
+        "MemFree:         1000000 kB\n"
+        "MemAvailable:    2000000 kB\n"
+    )
+    admission = ResourceAdmission(meminfo_path=meminfo)
+    assert admission.get_available_memory() == 2000000 * 1024
+    admission.min_available_memory = 1000000 * 1024
+    assert admission.admit()
+    admission.min_available_memory = 3000000 * 1024
+    assert not admission.admit()
+
+
+@pytest.mark.asyncio
+async def test_service_scheduler(fake_podman: FakePodman):
+    scheduler = LaunchScheduler(max_concurrency=2)
+    service = ContainersService(
+        Podman(executable=fake_podman.executable), scheduler=scheduler
+    )
+    peak = 0
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", "import time; time.sleep(0.1)")
+    )
+
+    async def run():
+        nonlocal peak
+        async with service.run(container) as proc:
+            peak = max(peak, scheduler.stats.running)
+            await proc.wait()
+
+    await asyncio.gather(*(run() for _ in range(6)))
+    assert peak == 2
+    assert scheduler.stats.running == 0
+    assert scheduler.stats.admitted == 6
@@ -0,0 +1,159 @@
+import dataclasses
+import json
+import pathlib
+
+import pytest
+
+from containers import ArchiveImageMount
+from containers import BindMount
+from containers import Container
+from containers import ImageMount
+from containers import ResourceLimits
+from containers import SecurityOptions
+from containers import serialization
+from containers import VolumeMount
+
+
+@pytest.fixture
+def container() -> Container:
+    return Container(
+        image="my-image",
+        command=("git", "status"),
+        interactive=True,
+        environ=dict(ENV_VAR0="VAL0"),
+        work_dir=pathlib.PurePosixPath("/my-dir"),
+        mounts=[
+            ImageMount(target="/data", source="data-image", read_write=True),
+            BindMount(
+                target="/artifacts",
+                source="/var/tmp/artifacts",
+                readonly=True,
+                relabel="private",
+            ),
+            VolumeMount(target="/cache", readonly=False),
+        ],
+        timeout=100,
+        security_options=SecurityOptions(no_new_privileges=True, seccomp="git.json"),
+        resources=ResourceLimits(
+            cpus=1.5, memory="512m", pids_limit=-1, ulimits=dict(nofile=(1024, 2048))
+        ),
+    )
+
+
+def test_json(container: Container):
+    data = json.loads(serialization.dumps_json(container))
+    assert data["version"] == serialization.SCHEMA_VERSION
+    (spec,) = data["containers"]
+    # Fields with default values are omitted
+    assert "tty" not in spec
+    assert spec["work_dir"] == "/my-dir"
+    assert [mount["type"] for mount in spec["mounts"]] == ["image", "bind", "volume"]
+    assert serialization.loads_json(
+        serialization.dumps_json(container)
+    ) == dataclasses.replace(container, work_dir="/my-dir")
+
+
+def test_binary(container: Container, monkeypatch: pytest.MonkeyPatch):
+    # JSON bytes without msgpack
+    monkeypatch.setattr(serialization, "msgpack", None)
+    data = serialization.dumps_binary(container)
+    assert json.loads(data)["version"] == serialization.SCHEMA_VERSION
+    decoded = serialization.loads_binary(data)
+    assert decoded == dataclasses.replace(container, work_dir="/my-dir")
+    assert decoded.resources.ulimits == dict(nofile=(1024, 2048))
+    assert decoded.command == ("git", "status")
+
+
+def test_msgpack(container: Container, monkeypatch: pytest.MonkeyPatch):
+    msgpack = pytest.importorskip("msgpack")
+    data = serialization.dumps_binary(container)
+    assert len(data) < len(serialization.dumps_json(container))
+    expected = dataclasses.replace(container, work_dir="/my-dir")
+    assert serialization.loads_binary(data) == expected
+    # Written without msgpack
+    monkeypatch.setattr(serialization, "msgpack", None)
+    data = serialization.dumps_binary(container)
+    monkeypatch.setattr(serialization, "msgpack", msgpack)
+    assert serialization.loads_binary(data) == expected
+
+
+def test_many(container: Container):
+    containers = [
+        dataclasses.replace(container, command=("echo", str(i))) for i in range(100)
+    ]
+    containers.append(Container(image="alpine", command=()))
+    expected = [
+        dataclasses.replace(c, work_dir=c.work_dir and str(c.work_dir))
+        for c in containers
+    ]
+    assert (
+        serialization.loads_json_many(serialization.dumps_json_many(containers))
+        == expected
+    )
+    assert (
+        serialization.loads_binary_many(serialization.dumps_binary_many(containers))
+        == expected
+    )
+
+
+def test_invalid_documents():
+    with pytest.raises(ValueError, match="schema version"):
+        serialization.loads_json('{"version": 99, "containers": []}')
+    with pytest.raises(ValueError, match="schema version"):
+        serialization.loads_json('{"containers": []}')
+    with pytest.raises(ValueError, match="schema version"):
+        serialization.loads_json('{"version": "1", "containers": []}')
+    with pytest.raises(ValueError, match="list of containers"):
+        serialization.loads_json('{"version": 1}')
+    with pytest.raises(ValueError, match="list of containers"):
+        serialization.from_document(dict(version=1, containers=None))
+    with pytest.raises(ValueError, match="Unknown mount type"):
+        serialization.loads_json(
+            '{"version": 1, "containers": [{"image": "a", "command": [],'
+            ' "mounts": [{"type": "tmpfs", "target": "/tmp"}]}]}'
+        )
+    with pytest.raises(ValueError):
+        serialization.loads_json('{"version": 1, "containers": [{"command": []}]}')
+
+
+def test_custom_mount_type(monkeypatch: pytest.MonkeyPatch):
+    # Registered in copies of the registries, restored after the test
+    monkeypatch.setattr(
+        serialization, "_mount_codecs", dict(serialization._mount_codecs)
+    )
+    monkeypatch.setattr(
+        serialization, "_mount_codecs_by_tag", dict(serialization._mount_codecs_by_tag)
+    )
+
+    @dataclasses.dataclass
+    class TmpfsMount(VolumeMount):
+        size: str = "64m"
+
+    container = Container(
+        image="alpine",
+        command=(),
+        mounts=[TmpfsMount(target="/tmp", readonly=False, size="1g")],
+    )
+    with pytest.raises(ValueError, match="Unknown mount type"):
+        serialization.dumps_json(container)
+    serialization.register_mount_type("tmpfs", TmpfsMount)
+    assert serialization.loads_json(serialization.dumps_json(container)) == container
+
+
+def test_archive_image_mount():
+    mount = ArchiveImageMount(
+        target="/data",
+        source="data-image",
+        read_write=True,
+        archive_to=pathlib.Path("/var/tmp/archive.tar.gz"),
+        archive_success=pathlib.Path("/var/tmp/archive.success"),
+        archive_method="tar.gz",
+    )
+    data = serialization.encode_mount(mount)
+    assert data["type"] == "archive-image"
+    assert data["archive_to"] == "/var/tmp/archive.tar.gz"
+    assert serialization.decode_mount(data) == dataclasses.replace(
+        mount,
+        archive_to="/var/tmp/archive.tar.gz",
+        archive_success="/var/tmp/archive.success",
+    )
@@ -5,18 +5,15 @@ import uuid
 
 import pytest
 
-from .conftest import ImageMount
+from containers import ArchiveImageMount
 from containers import BindMount
 from containers import Container
 from containers import ContainersService
+from containers import FileWaiter
+from containers import ImageMount
 from containers import LoadImageError
 
 
-async def poll_success_file(target_file: pathlib.Path):
-    while not target_file.exists():
-        await asyncio.sleep(0.1)
-
-
 @pytest.mark.asyncio
 async def test_load_image(containers: ContainersService):
     await containers.load_image("alpine")
@@ -131,7 +128,7 @@ async def test_run_with_runtime_env(
     await containers.load_image(data_image)
     archive_target = tmp_path / "archive.tar.gz"
     archive_success = tmp_path / "archive.success"
-    image_mount = ImageMount(
+    image_mount = ArchiveImageMount(
         source=data_image,
         target="/data",
         archive_to=archive_target,
@@ -154,7 +151,11 @@ async def test_run_with_runtime_env(
     ) as proc:
         assert (await proc.wait()) == 0
 
-    await asyncio.wait_for(poll_success_file(archive_success), 5)
+    waiter = FileWaiter()
+    try:
+        await waiter.wait(archive_success, timeout=5)
+    finally:
+        waiter.close()
     with tarfile.open(archive_target) as tar:
         if not disable_ovl_white_out:
             device = tar.getmember("./bin/sh")
@@ -0,0 +1,77 @@
+import asyncio
+import pathlib
+import sys
+
+import pytest
+
+from .conftest import count_calls
+from .conftest import FakePodman
+from containers import APIContainersService
+from containers import Container
+from containers import ContainerSession
+from containers import ContainersService
+from containers import OCIContainersService
+
+
+@pytest.mark.asyncio
+async def test_session(
+    tmp_path: pathlib.Path, fake_podman: FakePodman, fake_containers: ContainersService
+):
+    container = Container(
+        image="alpine", command=("ignored",), environ=dict(NAME="container")
+    )
+    async with ContainerSession(fake_containers, container) as session:
+        assert session.container_id in fake_podman.containers
+
+        async def run(index: int) -> bytes:
+            async with session.exec(
+                (
+                    sys.executable,
+                    "-c",
+                    "import os; print(os.environ['NAME'], os.environ['INDEX'], "
+                    "os.getcwd())",
+                ),
+                stdout=asyncio.subprocess.PIPE,
+                environ=dict(INDEX=str(index)),
+                work_dir=tmp_path,
+            ) as proc:
+                stdout, _ = await proc.communicate()
+                assert proc.returncode == 0
+                return stdout
+
+        outputs = await asyncio.gather(*map(run, range(5)))
+        assert outputs == [
+            f"container {index} {tmp_path}\n".encode() for index in range(5)
+        ]
+        assert session.exec_count == 5
+
+        async with session.exec(
+            ("sh", "-c", "cat; exit 3"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        ) as proc:
+            stdout, _ = await proc.communicate(b"input")
+        assert stdout == b"input"
+        assert proc.returncode == 3
+
+    # The container is started once, and removed at the end
+    assert count_calls(fake_podman, "run") == 1
+    assert count_calls(fake_podman, "exec") == 6
+    assert ["rm", "--force", session.container_id] in fake_podman.calls()
+    run_call = next(call for call in fake_podman.calls() if call[0] == "run")
+    assert run_call[-2:] == ["sleep", "infinity"]
+
+
+@pytest.mark.asyncio
+async def test_session_not_started(fake_containers: ContainersService):
+    session = ContainerSession(fake_containers, Container(image="alpine", command=()))
+    with pytest.raises(RuntimeError):
+        async with session.exec(("ls",)):
+            pass
+
+
+@pytest.mark.parametrize("service_class", [APIContainersService, OCIContainersService])
+def test_session_unsupported_service(service_class: type):
+    service = service_class()
+    with pytest.raises(TypeError, match="not supported by ContainerSession"):
+        ContainerSession(service, Container(image="alpine", command=()))
@@ -0,0 +1,110 @@
+import pathlib
+
+import pytest
+
+from .conftest import FakePodman
+from containers import ContainersService
+from containers import LoadImageError
+from containers import LoadImageStatus
+from containers import Podman
+from containers import SharedImageStore
+
+
+def make_store(
+    fake_podman: FakePodman, root: pathlib.Path, **kwargs
+) -> SharedImageStore:
+    return SharedImageStore(root, executable=fake_podman.executable, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_populate(fake_podman: FakePodman, tmp_path: pathlib.Path):
+    store = make_store(fake_podman, tmp_path / "shared")
+    report = await store.populate(["alpine", "busybox", "alpine"])
+    assert [(result.image, result.status) for result in report.results] == [
+        ("alpine", LoadImageStatus.PULLED),
+        ("busybox", LoadImageStatus.PULLED),
+    ]
+    # Pulled into the shared store only
+    assert set(fake_podman.store_images(str(tmp_path / "shared"))) == {
+        "alpine",
+        "busybox",
+    }
+    assert fake_podman.images == {}
+    assert all(
+        call[:2] == ["--root", str(tmp_path / "shared")] for call in fake_podman.calls()
+    )
+
+    fake_podman.fail_pull("ubuntu")
+    report = await store.populate(["alpine", "ubuntu"])
+    assert [(result.image, result.status) for result in report.results] == [
+        ("alpine", LoadImageStatus.PRESENT),
+        ("ubuntu", LoadImageStatus.FAILED),
+    ]
+    assert sorted(await store.list_images()) == ["alpine", "busybox"]
+
+    await store.remove("busybox")
+    assert await store.list_images() == ["alpine"]
+
+
+@pytest.mark.asyncio
+async def test_load_image(fake_podman: FakePodman, tmp_path: pathlib.Path):
+    store = make_store(fake_podman, tmp_path / "shared")
+    await store.populate(["alpine"])
+    fake_podman.set_additional_image_stores(str(tmp_path / "shared"))
+    service = ContainersService(
+        Podman(executable=fake_podman.executable), image_sources=[store]
+    )
+    # Seen through additionalimagestores, nothing pulled into the store of the
+    # service
+    assert not await service.load_image("alpine")
+    assert not [call for call in fake_podman.calls() if "pull" in call[:1]]
+    assert fake_podman.images == {}
+
+    # Not in the shared store, pulled from the registry as usual
+    assert await service.load_image("busybox")
+    assert list(fake_podman.images) == ["busybox"]
+
+
+@pytest.mark.asyncio
+async def test_pull_missing(fake_podman: FakePodman, tmp_path: pathlib.Path):
+    store = make_store(fake_podman, tmp_path / "shared", pull_missing=True)
+    fake_podman.set_additional_image_stores(str(tmp_path / "shared"))
+    service = ContainersService(
+        Podman(executable=fake_podman.executable), image_sources=[store]
+    )
+    assert await service.load_image("alpine")
+    assert list(fake_podman.store_images(str(tmp_path / "shared"))) == ["alpine"]
+    assert fake_podman.images == {}
+
+    # Falls back to the registry if it cannot be pulled into the store
+    fake_podman.fail_pull("busybox")
+    with pytest.raises(LoadImageError):
+        await service.load_image("busybox")
+    pulls = [call for call in fake_podman.calls() if "busybox" in call]
+    assert [call[0] for call in pulls if "pull" in call] == ["--root", "pull"]
+
+
+@pytest.mark.asyncio
+async def test_pull_missing_credentials(
+    fake_podman: FakePodman, tmp_path: pathlib.Path
+):
+    store = make_store(fake_podman, tmp_path / "shared", pull_missing=True)
+    fake_podman.set_additional_image_stores(str(tmp_path / "shared"))
+    service = ContainersService(
+        Podman(executable=fake_podman.executable), image_sources=[store]
+    )
+    assert await service.load_image("alpine", credentials=("user", "secret"))
+    (pull_call,) = [call for call in fake_podman.calls() if "pull" in call]
+    assert pull_call[-2:] == ["--creds", "user:secret"]
+
+
+@pytest.mark.asyncio
+async def test_store_not_visible(fake_podman: FakePodman, tmp_path: pathlib.Path):
+    store = make_store(fake_podman, tmp_path / "shared")
+    await store.populate(["alpine"])
+    service = ContainersService(
+        Podman(executable=fake_podman.executable), image_sources=[store]
+    )
+    # Not in additionalimagestores, pulled into the store of the service
+    assert await service.load_image("alpine")
+    assert list(fake_podman.images) == ["alpine"]
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import sys
+import typing
+
+import pytest
+
+from .conftest import FakePodman
+from containers import Container
+from containers import ContainersService
+from containers import FileSink
+from containers import OutputChunk
+from containers.services.streaming import RingBuffer
+
+SCRIPT = """
+import sys
+for i in range(3):
+    sys.stdout.write(f"out{i}\\n")
+    sys.stdout.flush()
+    sys.stderr.write(f"err{i}\\n")
+    sys.stderr.flush()
+sys.stdout.write("no-newline")
+sys.exit(2)
+"""
+
+
+@pytest.fixture
+def container() -> Container:
+    return Container(image="python", command=(sys.executable, "-c", SCRIPT))
+
+
+@pytest.mark.parametrize(
+    "size, writes, expected",
+    [
+        (5, [b"abc", b"def"], b"bcdef"),
+        (5, [b"abcdefgh"], b"defgh"),
+        (5, [b"ab", b"abcdefgh", b"x"], b"efghx"),
+        (5, [b"ab"], b"ab"),
+        (0, [b"ab"], b""),
+    ],
+)
+def test_ring_buffer(size: int, writes: typing.List[bytes], expected: bytes):
+    buffer = RingBuffer(size)
+    for data in writes:
+        buffer.append(data)
+    assert buffer.getvalue() == expected
+    assert len(buffer) == len(expected)
+
+
+@pytest.mark.asyncio
+async def test_stream_multiplexed(
+    fake_podman: FakePodman, fake_containers: ContainersService, container: Container
+):
+    collected: typing.Dict[str, bytes] = dict(stdout=b"", stderr=b"")
+    async with fake_containers.stream(container) as output:
+        async for chunk in output:
+            collected[chunk.stream] += chunk.data
+        assert await output.wait() == 2
+    assert collected == dict(
+        stdout=b"out0\nout1\nout2\nno-newline", stderr=b"err0\nerr1\nerr2\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_stream_lines(
+    fake_podman: FakePodman, fake_containers: ContainersService, container: Container
+):
+    async with fake_containers.stream(container, multiplexed=False) as output:
+        stdout_lines, stderr_lines = await asyncio.gather(
+            collect(output.lines("stdout")), collect(output.lines("stderr"))
+        )
+        assert await output.wait() == 2
+    assert stdout_lines == [
+        OutputChunk("stdout", b"out0\n"),
+        OutputChunk("stdout", b"out1\n"),
+        OutputChunk("stdout", b"out2\n"),
+        OutputChunk("stdout", b"no-newline"),
+    ]
+    assert [line.data for line in stderr_lines] == [b"err0\n", b"err1\n", b"err2\n"]
+
+
+async def collect(iterator: typing.AsyncIterator[OutputChunk]):
+    return [item async for item in iterator]
+
+
+@pytest.mark.asyncio
+async def test_stream_sinks_and_tail(
+    fake_podman: FakePodman, fake_containers: ContainersService, container: Container
+):
+    stdout_file = io.BytesIO()
+    callback_chunks = []
+    async with fake_containers.stream(
+        container,
+        retain=8,
+        sinks=[
+            FileSink(stdout_file, streams=["stdout"]),
+            lambda stream, data: callback_chunks.append((stream, data)),
+        ],
+    ) as output:
+        # Not consuming the output at all, wait drains it
+        assert await output.wait() == 2
+        assert output.tail("stdout") == b"-newline"
+        assert output.tail("stderr") == b"r1\nerr2\n"
+    assert stdout_file.getvalue() == b"out0\nout1\nout2\nno-newline"
+    assert b"".join(data for stream, data in callback_chunks if stream == "stderr") == (
+        b"err0\nerr1\nerr2\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_stream_backpressure(
+    fake_podman: FakePodman, fake_containers: ContainersService
+):
+    container = Container(
+        image="python",
+        command=(sys.executable, "-c", "print('x' * (1024 * 1024 * 4))"),
+    )
+    async with fake_containers.stream(container, limit=1024, max_pending=4) as output:
+        await asyncio.sleep(0.2)
+        # The readers are blocked on the full queue instead of reading everything
+        assert output._queues["stdout"].qsize() == 4
+        size = 0
+        async for chunk in output:
+            assert len(chunk.data) <= 1024
+            size += len(chunk.data)
+        assert size == 1024 * 1024 * 4 + 1
+        assert await output.wait() == 0
@@ -0,0 +1,100 @@
+import asyncio
+import sys
+
+import pytest
+
+from .conftest import FakePodman
+from containers import Container
+from containers import ContainersService
+from containers import Podman
+from containers import TerminationPolicy
+
+SLEEP = "import time; time.sleep(30)"
+IGNORE_SIGTERM = (
+    "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+    "print('ready', flush=True); time.sleep(30)"
+)
+
+
+def make_service(fake_podman: FakePodman, policy: TerminationPolicy):
+    return ContainersService(
+        Podman(executable=fake_podman.executable), termination=policy
+    )
+
+
+def kill_calls(fake_podman: FakePodman):
+    return [call for call in fake_podman.calls() if call[0] in ("kill", "rm")]
+
+
+@pytest.mark.asyncio
+async def test_timeout_terminate(fake_podman: FakePodman):
+    policy = TerminationPolicy(grace_period=5)
+    service = make_service(fake_podman, policy)
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", SLEEP), timeout=1
+    )
+    async with service.run(container) as proc:
+        assert await asyncio.wait_for(proc.wait(), 5) != 0
+    assert policy.stats.timeouts == 1
+    assert policy.stats.stages == dict(terminate=1, kill=0, remove=0)
+    assert kill_calls(fake_podman) == []
+
+
+@pytest.mark.asyncio
+async def test_timeout_escalation(fake_podman: FakePodman):
+    policy = TerminationPolicy(grace_period=0.2, kill_grace_period=0.2, timeout=0.3)
+    service = make_service(fake_podman, policy)
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", IGNORE_SIGTERM), name="job"
+    )
+    async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+        assert await proc.stdout.readline() == b"ready\n"
+        assert await asyncio.wait_for(proc.wait(), 5) == -9
+    assert policy.stats.timeouts == 1
+    assert policy.stats.stages == dict(terminate=1, kill=1, remove=0)
+    assert kill_calls(fake_podman) == [["kill", "job"]]
+
+
+@pytest.mark.asyncio
+async def test_cancel_remove(fake_podman: FakePodman):
+    fake_podman.ignore_kill()
+    policy = TerminationPolicy(grace_period=0.1, kill_grace_period=0.1)
+    service = make_service(fake_podman, policy)
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", IGNORE_SIGTERM)
+    )
+    ready = asyncio.Event()
+    procs = []
+
+    async def run():
+        async with service.run(container, stdout=asyncio.subprocess.PIPE) as proc:
+            procs.append(proc)
+            await proc.stdout.readline()
+            ready.set()
+            await proc.wait()
+
+    task = asyncio.ensure_future(run())
+    await ready.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert procs[0].returncode is not None
+    assert policy.stats.cancellations == 1
+    assert policy.stats.stages == dict(terminate=1, kill=1, remove=1)
+    (_, name), (_, _, removed_name) = kill_calls(fake_podman)
+    assert name == removed_name
+    assert name.startswith("container-helpers-")
+
+
+@pytest.mark.asyncio
+async def test_exited(fake_podman: FakePodman):
+    policy = TerminationPolicy()
+    service = make_service(fake_podman, policy)
+    container = Container(
+        image="alpine", command=(sys.executable, "-c", "print('hi')"), timeout=10
+    )
+    async with service.run(container) as proc:
+        assert await proc.wait() == 0
+    assert policy.stats.timeouts == 0
+    assert policy.stats.abandoned == 0
+    assert policy.stats.stages == dict(terminate=0, kill=0, remove=0)